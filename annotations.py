@@ -0,0 +1,236 @@
+'''
+Annotations ponctuelles (cellules, défauts, points d'intérêt) dessinées au-dessus de l'image.
+
+Les annotations sont repérées en coordonnées relatives à l'image complète, entre 0.0 et 1.0 sur
+chaque axe : les mêmes coordonnées servent à toutes les résolutions. Elles sont indexées par un
+quadtree linéaire : triées selon le code de Morton (ordre en Z) de leur position, les annotations
+d'une cellule du quadtree, à n'importe quelle profondeur, occupent une plage contiguë du tableau
+trié, trouvée par recherche dichotomique. Seules les cellules couvrant la zone visible sont
+consultées.
+
+Lorsque la zone visible contient trop d'annotations, elles sont regroupées par cellule d'une
+trentaine de pixels d'affichage : chaque groupe est dessiné à la position moyenne de ses annotations,
+calculée à partir de sommes cumulées, avec leur nombre. Le coût d'une image dépend ainsi du nombre
+de cellules visibles et non du nombre d'annotations.
+
+Les annotations sont lues et enregistrées en bloc dans un fichier .npz compressé contenant les
+tableaux x, y (flottants), categorie (entiers) et noms (nom de chaque catégorie).
+
+'''
+
+import os
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+# Nombre de bits par axe du code de Morton, soit la profondeur maximale du quadtree.
+PROFONDEUR = 24
+
+# Côté, en pixels d'affichage, des cellules de regroupement.
+CELLULE = 32
+
+# Nombre d'annotations visibles au-delà duquel elles sont regroupées.
+LIMITE_INDIVIDUELLES = 500
+
+# Couleurs des catégories, réutilisées cycliquement.
+COULEURS = ((255, 64, 64), (64, 200, 255), (255, 220, 0), (120, 255, 80), (255, 100, 255), (255, 150, 40))
+
+
+# Masques des nombres affichés sur les groupes, rendus une seule fois : dessiner un texte coûte
+# beaucoup plus cher que coller un masque.
+_etiquettes = {}
+_police = None
+
+
+def etiquette(nombre):
+	''' Renvoie le masque du nombre d'annotations d'un groupe, abrégé au-delà de mille. '''
+	if nombre < 1000:
+		texte = str(nombre)
+	elif nombre < 10000:
+		texte = '%.1fk' % (nombre / 1000)
+	elif nombre < 1000000:
+		texte = '%dk' % (nombre // 1000)
+	else:
+		texte = '%.1fM' % (nombre / 1000000)
+	if texte not in _etiquettes:
+		global _police
+		if _police is None:
+			_police = ImageFont.load_default()
+		x1, y1, x2, y2 = _police.getbbox(texte)
+		masque = Image.new('L', (x2 - x1, y2 - y1))
+		ImageDraw.Draw(masque).text((-x1, -y1), texte, fill=255, font=_police)
+		_etiquettes[texte] = masque
+	return _etiquettes[texte]
+
+
+def _etaler(valeurs):
+	''' Intercale un bit nul entre les bits de chaque entier (au plus 32 bits). '''
+	valeurs = valeurs.astype(np.uint64)
+	for decalage, masque in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+							 (2, 0x3333333333333333), (1, 0x5555555555555555)):
+		valeurs = (valeurs | (valeurs << np.uint64(decalage))) & np.uint64(masque)
+	return valeurs
+
+
+def code_morton(x, y):
+	''' Renvoie le code de Morton des positions relatives (x, y), à la profondeur maximale. '''
+	cote = 1 << PROFONDEUR
+	ix = np.clip(np.floor(np.asarray(x, dtype=np.float64) * cote), 0, cote - 1)
+	iy = np.clip(np.floor(np.asarray(y, dtype=np.float64) * cote), 0, cote - 1)
+	return _etaler(ix) | (_etaler(iy) << np.uint64(1))
+
+
+class Annotations:
+	''' Ensemble d'annotations ponctuelles indexé par un quadtree linéaire. '''
+
+	def __init__(self, x=(), y=(), categories=None, noms=None):
+		''' Indexe un ensemble d'annotations.
+
+			Args:
+			 - x, y : positions relatives à l'image complète, entre 0.0 et 1.0 ;
+			 - categories : indice de la catégorie de chaque annotation, 0 par défaut ;
+			 - noms : noms des catégories.
+		'''
+		x = np.asarray(x, dtype=np.float64)
+		y = np.asarray(y, dtype=np.float64)
+		if categories is None:
+			categories = np.zeros(len(x), dtype=np.int16)
+		self.noms = list(noms) if noms is not None else []
+		self.modifiees = False
+		self._ranger(x, y, np.asarray(categories, dtype=np.int16))
+
+
+	def _ranger(self, x, y, categories):
+		''' Trie les annotations selon leur code de Morton et calcule les sommes cumulées. '''
+		codes = code_morton(x, y)
+		ordre = np.argsort(codes, kind='stable')
+		self.codes = codes[ordre]
+		self.x = x[ordre]
+		self.y = y[ordre]
+		self.categories = categories[ordre]
+		self._sommes()
+
+
+	def _sommes(self):
+		''' Sommes cumulées des positions, précédées d'un zéro : la position moyenne des annotations
+			d'une plage [debut, fin) s'en déduit en temps constant.
+		'''
+		self._somme_x = np.concatenate(([0.0], np.cumsum(self.x)))
+		self._somme_y = np.concatenate(([0.0], np.cumsum(self.y)))
+
+
+	def __len__(self):
+		return len(self.codes)
+
+
+	def ajouter(self, x, y, categorie=0):
+		''' Ajoute une annotation à sa place dans l'ordre de Morton. '''
+		code = code_morton([x], [y])
+		i = int(np.searchsorted(self.codes, code[0], side='right'))
+		self.codes = np.insert(self.codes, i, code)
+		self.x = np.insert(self.x, i, x)
+		self.y = np.insert(self.y, i, y)
+		self.categories = np.insert(self.categories, i, categorie)
+		self._sommes()
+		self.modifiees = True
+
+
+	def cellules(self, x1, y1, x2, y2, profondeur):
+		''' Renvoie les plages d'annotations des cellules d'une profondeur couvrant une zone.
+
+			Args:
+			 - x1, y1, x2, y2 : zone en coordonnées relatives ;
+			 - profondeur : profondeur des cellules dans le quadtree, de 0 (image entière) à PROFONDEUR.
+
+			Returns:
+			 - debuts, fins : plages [debut, fin) des cellules non vides dans les tableaux triés.
+		'''
+		cote = 1 << profondeur
+		colonnes = np.arange(int(np.clip(x1 * cote, 0, cote - 1)), int(np.clip(x2 * cote, 0, cote - 1)) + 1)
+		lignes = np.arange(int(np.clip(y1 * cote, 0, cote - 1)), int(np.clip(y2 * cote, 0, cote - 1)) + 1)
+		ix, iy = np.meshgrid(colonnes, lignes)
+		prefixes = _etaler(ix.ravel()) | (_etaler(iy.ravel()) << np.uint64(1))
+		decalage = np.uint64(2 * (PROFONDEUR - profondeur))
+		debuts = np.searchsorted(self.codes, prefixes << decalage)
+		fins = np.searchsorted(self.codes, (prefixes + np.uint64(1)) << decalage)
+		non_vides = fins > debuts
+		return debuts[non_vides], fins[non_vides]
+
+
+	def requete(self, x1, y1, x2, y2):
+		''' Renvoie les indices, dans les tableaux triés, des annotations situées dans une zone. '''
+		# Cellules de l'ordre du quart de la zone : peu de cellules, peu d'annotations hors zone.
+		etendue = max(x2 - x1, y2 - y1, 1.0 / (1 << PROFONDEUR))
+		profondeur = int(np.clip(np.floor(-np.log2(etendue)) + 2, 0, PROFONDEUR))
+		debuts, fins = self.cellules(x1, y1, x2, y2, profondeur)
+		if len(debuts) == 0:
+			return np.zeros(0, dtype=np.intp)
+		indices = np.concatenate([np.arange(debut, fin) for debut, fin in zip(debuts, fins)])
+		x, y = self.x[indices], self.y[indices]
+		return indices[(x >= x1) & (x < x2) & (y >= y1) & (y < y2)]
+
+
+	def visibles(self, zone, taille):
+		''' Renvoie les annotations ou groupes d'annotations à dessiner dans une zone affichée.
+
+			Args:
+			 - zone : boîte (x1, y1, x2, y2) en pixels d'affichage ;
+			 - taille : taille (largeur, hauteur) de l'image complète en pixels d'affichage.
+
+			Returns:
+			 - (x, y, nombres, categories) : position en pixels d'affichage relatifs à la zone, nombre
+			   d'annotations et catégorie (celle de la première annotation) de chaque élément à dessiner.
+		'''
+		x1, y1, x2, y2 = zone[0] / taille[0], zone[1] / taille[1], zone[2] / taille[0], zone[3] / taille[1]
+		# Cellules de regroupement d'au moins CELLULE pixels d'affichage.
+		profondeur = int(np.clip(np.floor(np.log2(min(taille) / CELLULE)), 0, PROFONDEUR))
+		debuts, fins = self.cellules(x1, y1, x2, y2, profondeur)
+		nombres = fins - debuts
+		if nombres.sum() <= LIMITE_INDIVIDUELLES:
+			indices = self.requete(x1, y1, x2, y2)
+			x, y = self.x[indices], self.y[indices]
+			nombres = np.ones(len(indices), dtype=np.intp)
+			categories = self.categories[indices]
+		else:
+			x = (self._somme_x[fins] - self._somme_x[debuts]) / nombres
+			y = (self._somme_y[fins] - self._somme_y[debuts]) / nombres
+			categories = self.categories[debuts]
+		return x * taille[0] - zone[0], y * taille[1] - zone[1], nombres, categories
+
+
+	def dessiner(self, cadre, zone, taille):
+		''' Dessine les annotations visibles dans l'image composée d'une zone.
+
+			Args:
+			 - cadre : image RGB de la zone, modifiée sur place ;
+			 - zone, taille : voir visibles().
+		'''
+		if not len(self):
+			return
+		dessin = ImageDraw.Draw(cadre)
+		for x, y, nombre, categorie in zip(*self.visibles(zone, taille)):
+			couleur = COULEURS[int(categorie) % len(COULEURS)]
+			if nombre == 1:
+				dessin.ellipse((x - 4, y - 4, x + 4, y + 4), outline=couleur, width=2)
+			else:
+				rayon = 8 + 3 * np.log10(nombre)
+				dessin.ellipse((x - rayon, y - rayon, x + rayon, y + rayon), fill=(0, 0, 0), outline=couleur, width=2)
+				masque = etiquette(int(nombre))
+				cadre.paste(couleur, (int(x) - masque.size[0] // 2, int(y) - masque.size[1] // 2), masque)
+
+
+	@classmethod
+	def lire(cls, chemin):
+		''' Lit un fichier d'annotations .npz. '''
+		with np.load(chemin, allow_pickle=False) as donnees:
+			return cls(donnees['x'], donnees['y'], donnees['categorie'], [str(nom) for nom in donnees['noms']])
+
+
+	def ecrire(self, chemin):
+		''' Enregistre les annotations dans un fichier .npz, sous un nom temporaire puis renommé. '''
+		temporaire = chemin + '.tmp'
+		with open(temporaire, 'wb') as fichier:
+			np.savez_compressed(fichier, x=self.x, y=self.y, categorie=self.categories,
+				noms=np.array(self.noms, dtype=str))
+		os.replace(temporaire, chemin)
+		self.modifiees = False
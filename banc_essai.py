@@ -0,0 +1,441 @@
+'''
+Banc d'essai reproductible de la navigation (déplacements et zooms).
+
+Sous-commandes :
+ - generer : crée des pyramides synthétiques de plusieurs tailles, tailles de tuiles et formats ;
+ - trace : crée une trace synthétique de navigation (zooms et déplacements) sur une pyramide ;
+ - rejouer : rejoue une trace, synthétique ou enregistrée avec show.py --trace, sans écran, à travers
+   le moteur de rendu utilisé par show.py, changements de résolution compris ;
+ - comparer : compare deux rapports et signale les régressions.
+
+Le rapport d'un rejeu donne les centiles du temps de rendu des images, le nombre de tuiles décodées,
+les compteurs du cache et le pic de mémoire résidente du processus.
+
+Exemple:
+ python banc_essai.py generer bancs/ --tailles 8192 --tuiles 256 512 --formats jpg png brut
+ python banc_essai.py trace bancs/jpg_8192_256 session.json --images 500
+ python banc_essai.py rejouer session.json --pyramide bancs/jpg_8192_256 --rapport avant.json
+ python banc_essai.py rejouer session.json --prechargement --decodage processus --rapport processus.json
+ python banc_essai.py comparer avant.json apres.json --seuil 10
+
+'''
+
+import argparse
+import json
+import math
+import os
+import random
+import resource
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from cache_disque import CacheDisque, PyramideCacheDisque
+from cache_tuiles import CacheTuiles
+from construction_pyramide import FORMATS, enregistrer_tuile, nom_tuile, plan_pyramide
+from decodage import MODES_DECODAGE, PyramideProcessus
+from instrumentation import Chronometre
+from moteur import MoteurRendu, choisir_resolution
+from prechargement import Prechargeur
+from pyramide import ouvrir_pyramide
+
+# Magnitude d'un cran de molette de show.py (Zoom_Advanced.wheel).
+DELTA = 1.3
+
+# Indicateurs comparés entre deux rapports ; une augmentation est une régression.
+INDICATEURS = ('p50', 'p90', 'p95', 'p99', 'max', 'moyenne', 'decodages', 'rss_max_mo')
+
+
+def motif(x, y, resolution, graine):
+	''' Calcule les pixels d'une zone de l'image synthétique.
+		Le motif dépend de la position relative dans l'image complète, de sorte que toutes les
+		résolutions représentent la même image ; un bruit fin rend la compression réaliste.
+
+		Args:
+		 - x, y : grilles des coordonnées des pixels, dans la résolution ;
+		 - resolution : côté de la résolution ;
+		 - graine : graine du bruit.
+
+		Returns:
+		 - pixels : tableau RGB de la forme des grilles.
+	'''
+	u = x / resolution
+	v = y / resolution
+	r = 127.5 * (1 + np.sin(2 * np.pi * (7 * u + 3 * v)))
+	g = 127.5 * (1 + np.sin(2 * np.pi * (11 * u * v + 5 * v)))
+	b = 127.5 * (1 + np.cos(2 * np.pi * (13 * u - 4 * v * v)))
+	bruit = np.random.default_rng(graine).normal(0, 12, x.shape + (3,))
+	return np.clip(np.stack([r, g, b], axis=-1) + bruit, 0, 255).astype(np.uint8)
+
+
+def generer_rangee(parametres, resolution, ty):
+	''' Génère une rangée de tuiles synthétiques d'une résolution. '''
+	taille = parametres['taille_tuile']
+	for tx in range(resolution // taille):
+		chemin = nom_tuile(parametres, resolution, tx, ty)
+		if os.path.exists(chemin):
+			continue
+		y, x = np.mgrid[ty * taille:(ty + 1) * taille, tx * taille:(tx + 1) * taille]
+		pixels = motif(x, y, resolution, (resolution, tx, ty))
+		enregistrer_tuile(parametres, Image.fromarray(pixels), chemin)
+
+
+def generer_pyramide(destination, taille, taille_tuile, format, qualite=90, processus=None):
+	''' Génère une pyramide synthétique carrée.
+
+		Args:
+		 - destination : répertoire des tuiles, ou fichier conteneur pour le format brut ;
+		 - taille : côté de la résolution la plus haute ;
+		 - taille_tuile : côté des tuiles ;
+		 - format : extension des tuiles (jpg, png, webp...) ou brut pour un conteneur ;
+		 - qualite : qualité JPEG ou WebP ;
+		 - processus : nombre de processus.
+
+		Returns:
+		 - resolutions : résolutions générées, de la plus haute à la plus faible.
+	'''
+	repertoire = destination + '.tuiles' if format == 'brut' else destination
+	os.makedirs(repertoire, exist_ok=True)
+	parametres = {'destination': repertoire, 'nom': 'synthese', 'extension': 'png' if format == 'brut' else format,
+				  'qualite': qualite, 'taille_tuile': taille_tuile}
+	resolutions = plan_pyramide(taille, taille, taille_tuile)
+	with ProcessPoolExecutor(max_workers=processus) as executeur:
+		for resolution in resolutions:
+			rangees = resolution // taille_tuile
+			list(executeur.map(generer_rangee, [parametres] * rangees, [resolution] * rangees, range(rangees)))
+	if format == 'brut':
+		from conteneur import ecrire_conteneur
+		ecrire_conteneur(repertoire, destination, 'brut')
+		shutil.rmtree(repertoire)
+	return resolutions
+
+
+def generer_trace(pyramide, nombre, fenetre=(700, 700), graine=0):
+	''' Crée une trace synthétique de navigation : zooms vers des points aléatoires, avec changements
+		de résolution choisis comme par show.py (voir moteur.choisir_resolution), et déplacements à
+		vitesse variable.
+
+		Chaque image de la trace modifie la vue : les déplacements rebondissent sur les bords de
+		l'image au lieu d'y rester bloqués, les zooms arrière s'arrêtent lorsque l'image ne couvrirait
+		plus la zone visible, et un pas qui laisse la vue inchangée n'est pas enregistré.
+
+		Args:
+		 - pyramide : pyramide parcourue ;
+		 - nombre : nombre d'images de la trace ;
+		 - fenetre : taille (largeur, hauteur) de la zone visible ;
+		 - graine : graine du générateur aléatoire.
+
+		Returns:
+		 - trace : dictionnaire de la trace, au format enregistré par show.py --trace.
+	'''
+	aleatoire = random.Random(graine)
+	niveaux = pyramide.index.niveaux()
+	etendues = {n: pyramide.index.etendue(n) or (n, n) for n in niveaux}
+	largeurs = {n: etendues[n][0] for n in niveaux}
+	# Première résolution au moins aussi grande que la zone visible, comme au lancement de show.py.
+	resolution = next((n for n in niveaux if n >= max(fenetre)), niveaux[-1])
+	echelle = 1.0
+	x, y = 0.0, 0.0
+	images = []
+	t = 0.0
+
+	def ajouter(duree):
+		# Enregistre la vue courante si elle diffère de la précédente.
+		nonlocal t
+		image = _image_trace(t + duree, resolution, echelle, x, y, fenetre, etendues[resolution])
+		if images and all(image[cle] == images[-1][cle] for cle in ('resolution', 'echelle', 'zone')):
+			return
+		t += duree
+		image['t'] = round(t, 4)
+		images.append(image)
+
+	while len(images) < nombre:
+		if aleatoire.random() < 0.4:
+			# Série de crans de molette dans un même sens.
+			sens = DELTA if aleatoire.random() < 0.6 else 1 / DELTA
+			for _ in range(aleatoire.randint(1, 6)):
+				largeur_affichee = largeurs[resolution] * echelle * sens
+				cible = choisir_resolution(largeurs, largeur_affichee)
+				echelle_cible = largeur_affichee / largeurs[cible]
+				affichee = _taille_affichee(etendues[cible], echelle_cible)
+				# Limites de zoom de show.py : le cran de molette est alors ignoré. Un zoom arrière
+				# s'arrête aussi avant que l'image ne devienne plus petite que la zone visible.
+				if ((sens > 1 and min(fenetre) < echelle) or (cible == niveaux[0] and echelle_cible < DELTA / 15)
+						or (sens < 1 and (affichee[0] < fenetre[0] or affichee[1] < fenetre[1]))):
+					break
+				# Zoom centré sur la zone visible, dans la résolution choisie.
+				x, y = (x + fenetre[0] / 2) * sens - fenetre[0] / 2, (y + fenetre[1] / 2) * sens - fenetre[1] / 2
+				resolution, echelle = cible, echelle_cible
+				x, y = _borner(x, y, affichee, fenetre)
+				ajouter(0.05)
+		else:
+			# Glissement de la souris, une image par mouvement, renvoyé par les bords de l'image.
+			vitesse = aleatoire.uniform(2, 60)
+			angle = aleatoire.uniform(0, 2 * math.pi)
+			vx, vy = vitesse * math.cos(angle), vitesse * math.sin(angle)
+			affichee = _taille_affichee(etendues[resolution], echelle)
+			for _ in range(aleatoire.randint(5, 40)):
+				x, vx = _rebondir(x + vx, vx, max(affichee[0] - fenetre[0], 0.0))
+				y, vy = _rebondir(y + vy, vy, max(affichee[1] - fenetre[1], 0.0))
+				ajouter(1 / 60)
+	return {'fenetre': list(fenetre), 'images': images[:nombre]}
+
+
+def _taille_affichee(etendue, echelle):
+	''' Renvoie la taille (largeur, hauteur) de l'image complète à l'affichage. '''
+	return (etendue[0] * echelle, etendue[1] * echelle)
+
+
+def _borner(x, y, taille, fenetre):
+	''' Maintient la zone visible dans l'image complète, de taille (largeur, hauteur). '''
+	return (min(max(x, 0.0), max(taille[0] - fenetre[0], 0.0)), min(max(y, 0.0), max(taille[1] - fenetre[1], 0.0)))
+
+
+def _rebondir(position, vitesse, maximum):
+	''' Renvoie dans [0, maximum] une position qui en sort, en inversant sa vitesse.
+
+		Returns:
+		 - (position, vitesse) : position réfléchie sur le bord franchi, et vitesse après le rebond.
+	'''
+	if position < 0:
+		position, vitesse = -position, -vitesse
+	elif position > maximum:
+		position, vitesse = 2 * maximum - position, -vitesse
+	return min(max(position, 0.0), maximum), vitesse
+
+
+def _image_trace(t, resolution, echelle, x, y, fenetre, etendue):
+	''' Décrit une image d'une trace. '''
+	largeur, hauteur = _taille_affichee(etendue, echelle)
+	return {'t': round(t, 4), 'resolution': resolution, 'echelle': echelle,
+			'zone': [x, y, min(x + fenetre[0], largeur), min(y + fenetre[1], hauteur)]}
+
+
+class CompteurDecodages:
+	''' Enveloppe d'une pyramide comptant les tuiles décodées.
+		Doit envelopper la source des tuiles, sous un éventuel cache disque : une tuile relue dans le
+		cache disque n'est pas décodée.
+	'''
+
+	def __init__(self, pyramide):
+		self.pyramide = pyramide
+		self.index = pyramide.index
+		self.decodages = 0
+		# Les threads de préchargement décodent en même temps que le rendu.
+		self._verrou = threading.Lock()
+
+	def ouvrir_tuile(self, resolution, x, y, reduction=1):
+		with self._verrou:
+			self.decodages += 1
+		return self.pyramide.ouvrir_tuile(resolution, x, y, reduction)
+
+	def octets_tuile(self, resolution, x, y):
+		return self.pyramide.octets_tuile(resolution, x, y)
+
+	def signature_tuile(self, resolution, x, y):
+		return self.pyramide.signature_tuile(resolution, x, y)
+
+	def taille_tuile(self, resolution):
+		return self.pyramide.taille_tuile(resolution)
+
+
+def centiles(durees):
+	''' Résume une liste de durées en millisecondes. '''
+	if not durees:
+		return {cle: 0.0 for cle in ('p50', 'p90', 'p95', 'p99', 'max', 'moyenne')}
+	tableau = np.array(durees)
+	return {'p50': float(np.percentile(tableau, 50)), 'p90': float(np.percentile(tableau, 90)),
+			'p95': float(np.percentile(tableau, 95)), 'p99': float(np.percentile(tableau, 99)),
+			'max': float(tableau.max()), 'moyenne': float(tableau.mean())}
+
+
+def rejouer(trace, pyramide, cache_mo=256, prechargement=False, qualite='qualite', chrono=None, threads=4,
+			incremental=True, compteur=None):
+	''' Rejoue une trace à travers le moteur de rendu, sans écran.
+
+		Args:
+		 - trace : dictionnaire de la trace ;
+		 - pyramide : pyramide à afficher ;
+		 - cache_mo : budget du cache de tuiles, en Mo ;
+		 - prechargement : active le préchargement en arrière-plan (résultats moins reproductibles) ;
+		 - qualite : filtre de redimensionnement, 'rapide' ou 'qualite' (voir moteur.FILTRES) ;
+		 - chrono : chronomètre mesurant les étapes du rendu (voir instrumentation.py), ou None ;
+		 - threads : nombre de threads de préchargement ;
+		 - incremental : décale l'image précédente lors d'une translation (voir MoteurRendu.bandes_exposees) ;
+		 - compteur : CompteurDecodages enveloppant la source des tuiles de la pyramide, sous son cache
+		   disque ; par défaut, la pyramide elle-même est enveloppée.
+
+		Returns:
+		 - rapport : dictionnaire des mesures.
+	'''
+	if compteur is None:
+		compteur = pyramide = CompteurDecodages(pyramide)
+	cache = CacheTuiles(cache_mo * 1024 * 1024)
+	moteur = MoteurRendu(pyramide, cache, chrono=chrono)
+	moteur.incremental = incremental
+	if prechargement:
+		moteur.prechargeur = Prechargeur(cache, moteur.lire_tuile, pyramide.index.dimensions,
+			nb_threads=threads, present=moteur.est_a_jour, voisines=pyramide.index.voisines)
+	durees = []
+	changements = 0
+	precedente = None
+	cadre = None
+	for image in trace['images']:
+		if precedente is not None and image['resolution'] != precedente:
+			changements += 1
+		precedente = image['resolution']
+		moteur.chrono.debut_image()
+		debut = time.perf_counter()
+		cadre = moteur.rendre(image['resolution'], tuple(image['zone']), image['echelle'], qualite=qualite, cadre=cadre)
+		durees.append((time.perf_counter() - debut) * 1000)
+		moteur.chrono.fin_image()
+		# Vide la file des tuiles préchargées, comme show.py (Zoom_Advanced.surveiller_prechargement).
+		if moteur.prechargeur is not None:
+			moteur.prechargeur.recuperer()
+	if moteur.prechargeur is not None:
+		moteur.prechargeur.arreter()
+
+	rapport = centiles(durees)
+	rapport.update({'images': len(durees), 'changements_resolution': changements,
+					'decodages': compteur.decodages, 'cache': cache.statistiques(),
+					# ru_maxrss est exprimé en kilo-octets sous Linux et en octets sous macOS.
+					'rss_max_mo': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+						/ (1024 * 1024 if sys.platform == 'darwin' else 1024)})
+	return rapport
+
+
+def comparer(reference, nouveau, seuil):
+	''' Compare deux rapports.
+
+		Args:
+		 - reference, nouveau : rapports de rejeu ;
+		 - seuil : augmentation relative tolérée, en pourcentage.
+
+		Returns:
+		 - lignes : description de chaque indicateur ;
+		 - regressions : indicateurs ayant augmenté de plus du seuil.
+	'''
+	lignes = []
+	regressions = []
+	for cle in INDICATEURS:
+		avant, apres = reference.get(cle), nouveau.get(cle)
+		if avant is None or apres is None:
+			continue
+		variation = (apres - avant) / avant * 100 if avant else 0.0
+		lignes.append("%-12s %12.2f %12.2f %+8.1f %%" % (cle, avant, apres, variation))
+		if variation > seuil:
+			regressions.append(cle)
+	return lignes, regressions
+
+
+def main(args=None):
+	parser = argparse.ArgumentParser(description="Banc d'essai de la navigation dans une pyramide.")
+	commandes = parser.add_subparsers(dest='commande', required=True)
+
+	generer = commandes.add_parser('generer', help="Génère des pyramides synthétiques.")
+	generer.add_argument('destination', help="Répertoire accueillant les pyramides.")
+	generer.add_argument('--tailles', type=int, nargs='+', default=[8192], help="Côtés de la résolution la plus haute.")
+	generer.add_argument('--tuiles', type=int, nargs='+', default=[512], help="Côtés des tuiles.")
+	generer.add_argument('--formats', nargs='+', default=['jpg'], choices=sorted(FORMATS) + ['brut'],
+						 help="Formats des tuiles ; brut crée un conteneur à fichier unique.")
+	generer.add_argument('--processus', type=int, default=None, help="Nombre de processus.")
+
+	trace = commandes.add_parser('trace', help="Crée une trace synthétique de navigation.")
+	trace.add_argument('pyramide', help="Pyramide parcourue.")
+	trace.add_argument('sortie', help="Fichier JSON de la trace.")
+	trace.add_argument('--images', type=int, default=500, help="Nombre d'images (500 par défaut).")
+	trace.add_argument('--fenetre', type=int, nargs=2, default=[700, 700], help="Taille de la zone visible.")
+	trace.add_argument('--graine', type=int, default=0, help="Graine du générateur aléatoire.")
+
+	rejeu = commandes.add_parser('rejouer', help="Rejoue une trace sans écran.")
+	rejeu.add_argument('trace', help="Fichier JSON de la trace.")
+	rejeu.add_argument('--pyramide', help="Pyramide à utiliser, par défaut celle enregistrée dans la trace.")
+	rejeu.add_argument('--cache', type=int, default=256, help="Budget du cache de tuiles, en Mo.")
+	rejeu.add_argument('--cache-disque', help="Répertoire du cache disque des tuiles décodées.")
+	rejeu.add_argument('--cache-disque-mo', type=int, default=4096, help="Budget du cache disque, en Mo.")
+	rejeu.add_argument('--decodage', default='thread', choices=MODES_DECODAGE,
+					   help="Décodage des tuiles dans le thread demandeur ou dans un groupe de processus (voir decodage.py).")
+	rejeu.add_argument('--processus', type=int, default=None, help="Nombre de processus de décodage.")
+	rejeu.add_argument('--prechargement', action='store_true', help="Active le préchargement en arrière-plan.")
+	rejeu.add_argument('--qualite', default='qualite', choices=['rapide', 'qualite'],
+					   help="Filtre de redimensionnement ('qualite' par défaut).")
+	rejeu.add_argument('--complet', action='store_true',
+					   help="Recompose toute la zone à chaque image, même lors d'une translation.")
+	rejeu.add_argument('--profil', help="Fichier JSON où exporter la durée des étapes du rendu (format Trace Event de Chrome).")
+	rejeu.add_argument('--rapport', help="Fichier JSON où écrire le rapport.")
+
+	comparaison = commandes.add_parser('comparer', help="Compare deux rapports de rejeu.")
+	comparaison.add_argument('reference', help="Rapport de référence.")
+	comparaison.add_argument('nouveau', help="Nouveau rapport.")
+	comparaison.add_argument('--seuil', type=float, default=10.0, help="Augmentation tolérée, en pourcentage (10 par défaut).")
+
+	arguments = parser.parse_args(args)
+
+	if arguments.commande == 'generer':
+		for format in arguments.formats:
+			for taille in arguments.tailles:
+				for taille_tuile in arguments.tuiles:
+					destination = os.path.join(arguments.destination, "%s_%d_%d" % (format, taille, taille_tuile))
+					if format == 'brut':
+						destination += '.pappl'
+					debut = time.perf_counter()
+					generer_pyramide(destination, taille, taille_tuile, format, processus=arguments.processus)
+					print(destination, ": %.1f s" % (time.perf_counter() - debut))
+
+	elif arguments.commande == 'trace':
+		trace = generer_trace(ouvrir_pyramide(arguments.pyramide), arguments.images, tuple(arguments.fenetre), arguments.graine)
+		trace['pyramide'] = arguments.pyramide
+		with open(arguments.sortie, 'w') as fichier:
+			json.dump(trace, fichier)
+
+	elif arguments.commande == 'rejouer':
+		with open(arguments.trace) as fichier:
+			trace = json.load(fichier)
+		chemin = arguments.pyramide or trace['pyramide']
+		chrono = Chronometre(enregistrer=True) if arguments.profil else None
+		pyramide = ouvrir_pyramide(chemin)
+		decodeur = None
+		threads = 4
+		if arguments.decodage == 'processus':
+			decodeur = pyramide = PyramideProcessus(pyramide, chemin, arguments.processus)
+			threads = max(threads, decodeur.processus)
+		# Les tuiles relues dans le cache disque ne sont pas comptées comme décodées.
+		compteur = pyramide = CompteurDecodages(pyramide)
+		if arguments.cache_disque:
+			cache_disque = CacheDisque(arguments.cache_disque, arguments.cache_disque_mo * 1024 * 1024)
+			pyramide = PyramideCacheDisque(pyramide, cache_disque)
+		rapport = rejouer(trace, pyramide, arguments.cache, arguments.prechargement, arguments.qualite, chrono, threads,
+			not arguments.complet, compteur)
+		if decodeur is not None:
+			decodeur.fermer()
+		if arguments.cache_disque:
+			rapport['cache_disque'] = cache_disque.statistiques()
+		if chrono is not None:
+			chrono.exporter(arguments.profil)
+		rapport.update({'trace': arguments.trace, 'pyramide': chemin, 'decodage': arguments.decodage})
+		print(json.dumps(rapport, indent=1))
+		if arguments.rapport:
+			with open(arguments.rapport, 'w') as fichier:
+				json.dump(rapport, fichier, indent=1)
+
+	elif arguments.commande == 'comparer':
+		with open(arguments.reference) as fichier:
+			reference = json.load(fichier)
+		with open(arguments.nouveau) as fichier:
+			nouveau = json.load(fichier)
+		lignes, regressions = comparer(reference, nouveau, arguments.seuil)
+		print("%-12s %12s %12s %10s" % ('indicateur', 'reference', 'nouveau', 'variation'))
+		print("\n".join(lignes))
+		if regressions:
+			print("Régressions au-delà de %.1f %% :" % arguments.seuil, ", ".join(regressions))
+			return 1
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
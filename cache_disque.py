@@ -0,0 +1,229 @@
+'''
+Cache disque des tuiles décodées, conservé d'une session à l'autre.
+
+Chaque tuile décodée est enregistrée sous forme de tableau numpy non compressé (fichier .npy), relu
+par projection en mémoire : une tuile déjà décodée lors d'une session précédente est lue sans
+décodage ni copie. Une tuile est identifiée par le chemin, la date de modification et la taille de
+son fichier d'origine, ainsi que par son facteur de réduction : une tuile modifiée n'est jamais lue
+depuis le cache.
+
+Les fichiers les moins récemment utilisés (date de modification, mise à jour à chaque lecture) sont
+supprimés lorsque la taille totale dépasse le budget fixé. Plusieurs processus peuvent partager le
+même répertoire : chaque fichier est écrit sous un nom temporaire puis renommé, un fichier incomplet
+est ignoré et supprimé, et un fichier supprimé par un autre processus est simplement considéré comme
+absent.
+
+'''
+
+import hashlib
+import os
+import threading
+
+import numpy as np
+from PIL import Image
+
+# Proportion du budget occupée après une éviction, afin de ne pas parcourir le répertoire à chaque
+# écriture.
+REMPLISSAGE_APRES_EVICTION = 0.9
+
+# Modes enregistrés tels quels ; les autres sont convertis en RGB.
+MODES_ENREGISTRES = ('L', 'LA', 'RGB', 'RGBA')
+
+
+def vers_tableau(tuile):
+	''' Renvoie les pixels d'une tuile décodée sous forme de tableau numpy. '''
+	if isinstance(tuile, Image.Image):
+		if tuile.mode not in MODES_ENREGISTRES:
+			tuile = tuile.convert('RGB')
+		return np.asarray(tuile)
+	return tuile
+
+
+class CacheDisque:
+	''' Répertoire de tuiles décodées, limité par un budget en octets et partageable entre processus. '''
+
+	def __init__(self, repertoire, budget):
+		''' Ouvre le cache, en créant le répertoire si besoin.
+
+			Args:
+			 - repertoire : répertoire du cache ;
+			 - budget : taille maximale, en octets, de l'ensemble des fichiers du cache.
+		'''
+		os.makedirs(repertoire, exist_ok=True)
+		self.repertoire = repertoire
+		self.budget = budget
+		self.succes = 0
+		self.echecs = 0
+		self.evictions = 0
+		self._verrou = threading.Lock()
+		# Taille estimée du cache, recalculée à chaque éviction pour tenir compte des autres processus.
+		self.taille = sum(taille for _, taille, _ in self._fichiers())
+
+
+	def chemin(self, signature):
+		''' Renvoie le fichier associé à une signature de tuile. '''
+		empreinte = hashlib.sha1(repr(signature).encode('utf-8')).hexdigest()
+		return os.path.join(self.repertoire, empreinte[:2], empreinte + '.npy')
+
+
+	def lire(self, signature):
+		''' Lit une tuile par projection en mémoire et la marque comme récemment utilisée.
+
+			Args:
+			 - signature : identifiant de la tuile (voir pyramide.PyramideRepertoire.signature_tuile),
+			   complété du facteur de réduction.
+
+			Returns:
+			 - tableau : tableau numpy en lecture seule projeté en mémoire, ou None si la tuile est
+			   absente du cache.
+		'''
+		chemin = self.chemin(signature)
+		try:
+			tableau = np.load(chemin, mmap_mode='r')
+			os.utime(chemin)
+		except FileNotFoundError:
+			tableau = None
+		except (OSError, ValueError):
+			# Fichier incomplet ou illisible : il sera réécrit.
+			self._supprimer(chemin)
+			tableau = None
+		with self._verrou:
+			if tableau is None:
+				self.echecs += 1
+			else:
+				self.succes += 1
+		return tableau
+
+
+	def ecrire(self, signature, tableau):
+		''' Enregistre une tuile décodée puis évince les fichiers les plus anciens si besoin.
+
+			Args:
+			 - signature : identifiant de la tuile, complété du facteur de réduction ;
+			 - tableau : pixels de la tuile.
+		'''
+		chemin = self.chemin(signature)
+		os.makedirs(os.path.dirname(chemin), exist_ok=True)
+		temporaire = '%s.%d.%d.tmp' % (chemin, os.getpid(), threading.get_ident())
+		try:
+			with open(temporaire, 'wb') as fichier:
+				np.save(fichier, np.ascontiguousarray(tableau))
+			taille = os.path.getsize(temporaire)
+			os.replace(temporaire, chemin)
+		except OSError:
+			# Disque plein ou répertoire supprimé : la tuile n'est simplement pas mise en cache.
+			self._supprimer(temporaire)
+			return
+		with self._verrou:
+			self.taille += taille
+			depassement = self.taille > self.budget
+		if depassement:
+			self.evincer()
+
+
+	def evincer(self):
+		''' Supprime les fichiers les moins récemment utilisés jusqu'à revenir sous le budget. '''
+		fichiers = sorted(self._fichiers())
+		taille = sum(taille for _, taille, _ in fichiers)
+		cible = self.budget * REMPLISSAGE_APRES_EVICTION
+		evictions = 0
+		for _, taille_fichier, chemin in fichiers:
+			if taille <= cible:
+				break
+			if self._supprimer(chemin):
+				evictions += 1
+			taille -= taille_fichier
+		with self._verrou:
+			self.taille = taille
+			self.evictions += evictions
+
+
+	def statistiques(self):
+		''' Renvoie l'état du cache et ses compteurs, dans le même format que CacheTuiles.statistiques(). '''
+		with self._verrou:
+			demandes = self.succes + self.echecs
+			return {'taille': self.taille, 'budget': self.budget, 'succes': self.succes,
+					'echecs': self.echecs, 'evictions': self.evictions,
+					'taux_succes': self.succes / demandes if demandes else 0.0}
+
+
+	def _fichiers(self):
+		''' Renvoie la liste des fichiers du cache, triables par date : (date, taille, chemin). '''
+		fichiers = []
+		for sous_repertoire in os.scandir(self.repertoire):
+			if not sous_repertoire.is_dir():
+				continue
+			for entree in os.scandir(sous_repertoire.path):
+				if not entree.name.endswith('.npy'):
+					continue
+				try:
+					etat = entree.stat()
+				except FileNotFoundError:
+					continue
+				fichiers.append((etat.st_mtime_ns, etat.st_size, entree.path))
+		return fichiers
+
+
+	@staticmethod
+	def _supprimer(chemin):
+		''' Supprime un fichier, sans erreur s'il a déjà été supprimé par un autre processus. '''
+		try:
+			os.remove(chemin)
+			return True
+		except OSError:
+			return False
+
+
+class PyramideCacheDisque:
+	''' Enveloppe d'une pyramide lisant ses tuiles décodées dans un cache disque.
+		S'utilise à la place de la pyramide enveloppée (voir pyramide.ouvrir_pyramide).
+	'''
+
+	def __init__(self, pyramide, cache):
+		''' Initialise l'enveloppe.
+
+			Args:
+			 - pyramide : pyramide de tuiles (voir pyramide.ouvrir_pyramide) ;
+			 - cache : cache disque (CacheDisque).
+		'''
+		self.pyramide = pyramide
+		self.index = pyramide.index
+		self.cache = cache
+
+
+	def ouvrir_tuile(self, resolution, x, y, reduction=1):
+		''' Lit une tuile dans le cache disque, ou la décode et l'y enregistre.
+			Peut être appelée depuis plusieurs threads.
+
+			Returns:
+			 - tuile : tableau numpy projeté en mémoire, image PIL pour une tuile réduite (voir
+			   pyramide.decoder_reduit), ou None si la tuile est absente.
+		'''
+		signature = self.pyramide.signature_tuile(resolution, x, y)
+		if signature is None:
+			return self.pyramide.ouvrir_tuile(resolution, x, y, reduction)
+		signature += (reduction,)
+
+		tableau = self.cache.lire(signature)
+		if tableau is None:
+			tuile = self.pyramide.ouvrir_tuile(resolution, x, y, reduction)
+			if tuile is not None:
+				self.cache.ecrire(signature, vers_tableau(tuile))
+			return tuile
+		if reduction > 1:
+			image = Image.fromarray(tableau)
+			image.info['reduction'] = reduction
+			return image
+		return tableau
+
+
+	def octets_tuile(self, resolution, x, y):
+		return self.pyramide.octets_tuile(resolution, x, y)
+
+
+	def signature_tuile(self, resolution, x, y):
+		return self.pyramide.signature_tuile(resolution, x, y)
+
+
+	def taille_tuile(self, resolution):
+		return self.pyramide.taille_tuile(resolution)
@@ -0,0 +1,144 @@
+'''
+Cache mémoire des tuiles décodées.
+
+Les tuiles sont identifiées par le triplet (résolution, x, y). Les tuiles les moins récemment
+utilisées sont évincées dès que la taille totale des tuiles décodées dépasse le budget fixé.
+
+'''
+
+import threading
+from collections import OrderedDict
+
+# Nombre d'octets occupés par un pixel en mémoire, selon le mode de l'image.
+# Pillow stocke les images RGB, YCbCr, LAB et HSV sur quatre octets par pixel.
+OCTETS_PAR_PIXEL = {'1': 1, 'L': 1, 'P': 1, 'LA': 4, 'PA': 4, 'La': 4, 'I;16': 2, 'I;16B': 2,
+					'I;16L': 2, 'I': 4, 'F': 4, 'RGB': 4, 'RGBA': 4, 'RGBa': 4, 'RGBX': 4,
+					'CMYK': 4, 'YCbCr': 4, 'LAB': 4, 'HSV': 4}
+
+
+def taille_image(image):
+	''' Estime la mémoire occupée par une image décodée.
+
+		Args:
+		 - image : image PIL ou tableau numpy.
+
+		Returns:
+		 - taille : nombre d'octets occupés par les pixels de l'image.
+	'''
+	if hasattr(image, 'nbytes'):
+		return image.nbytes
+	octets = OCTETS_PAR_PIXEL.get(image.mode, len(image.getbands()))
+	return image.size[0] * image.size[1] * octets
+
+
+class CacheTuiles:
+	''' Cache LRU des tuiles décodées, limité par un budget en octets.
+		Compte les succès, les échecs et les évictions afin de dimensionner le budget.
+		Peut être partagé entre plusieurs threads.
+	'''
+
+	def __init__(self, budget, mesurer=taille_image):
+		''' Initialise le cache.
+
+			Args:
+			 - budget : taille maximale, en octets, de l'ensemble des tuiles conservées ;
+			 - mesurer : fonction renvoyant la taille, en octets, d'une valeur conservée.
+		'''
+		self.budget = budget
+		self.mesurer = mesurer
+		self.taille = 0
+		self.succes = 0
+		self.echecs = 0
+		self.evictions = 0
+		self._tuiles = OrderedDict()
+		self._verrou = threading.Lock()
+
+
+	def __len__(self):
+		return len(self._tuiles)
+
+
+	def __contains__(self, cle):
+		with self._verrou:
+			return cle in self._tuiles
+
+
+	def obtenir(self, cle, charger=None):
+		''' Renvoie la tuile associée à une clé et la marque comme la plus récemment utilisée.
+			En cas d'absence, charge la tuile avec la fonction fournie et l'ajoute au cache.
+
+			Args:
+			 - cle : triplet (résolution, x, y) de la tuile ;
+			 - charger : fonction sans argument renvoyant la tuile décodée, ou None.
+
+			Returns:
+			 - image : tuile décodée, ou None si elle est absente et qu'aucune fonction n'est fournie.
+		'''
+		with self._verrou:
+			if cle in self._tuiles:
+				self._tuiles.move_to_end(cle)
+				self.succes += 1
+				return self._tuiles[cle][0]
+			self.echecs += 1
+		if charger is None:
+			return None
+		# Le décodage s'effectue hors du verrou pour ne pas bloquer les autres threads.
+		image = charger()
+		self.ajouter(cle, image)
+		return image
+
+
+	def consulter(self, cle):
+		''' Renvoie la tuile associée à une clé, ou None, sans modifier l'ordre d'éviction ni les
+			compteurs.
+		'''
+		with self._verrou:
+			entree = self._tuiles.get(cle)
+			return None if entree is None else entree[0]
+
+
+	def ajouter(self, cle, image):
+		''' Ajoute une tuile décodée au cache puis évince les tuiles les plus anciennes si besoin.
+
+			Args:
+			 - cle : triplet (résolution, x, y) de la tuile ;
+			 - image : tuile décodée.
+		'''
+		taille = self.mesurer(image)
+		with self._verrou:
+			if cle in self._tuiles:
+				self.taille -= self._tuiles.pop(cle)[1]
+			self._tuiles[cle] = (image, taille)
+			self.taille += taille
+			# La tuile ajoutée est conservée même si elle dépasse à elle seule le budget.
+			while self.taille > self.budget and len(self._tuiles) > 1:
+				_, (_, ancienne) = self._tuiles.popitem(last=False)
+				self.taille -= ancienne
+				self.evictions += 1
+
+
+	def retirer(self, cle):
+		''' Retire une tuile du cache si elle y figure. '''
+		with self._verrou:
+			if cle in self._tuiles:
+				self.taille -= self._tuiles.pop(cle)[1]
+
+
+	def vider(self):
+		''' Retire toutes les tuiles du cache sans remettre les compteurs à zéro. '''
+		with self._verrou:
+			self._tuiles.clear()
+			self.taille = 0
+
+
+	def statistiques(self):
+		''' Renvoie l'état du cache et ses compteurs.
+
+			Returns:
+			 - stats : dictionnaire des compteurs, de la taille occupée et du taux de succès.
+		'''
+		with self._verrou:
+			demandes = self.succes + self.echecs
+			return {'tuiles': len(self._tuiles), 'taille': self.taille, 'budget': self.budget,
+					'succes': self.succes, 'echecs': self.echecs, 'evictions': self.evictions,
+					'taux_succes': self.succes / demandes if demandes else 0.0}
@@ -0,0 +1,436 @@
+'''
+Construction d'une pyramide de tuiles à partir d'une image source de très grande taille.
+
+Les tuiles sont écrites sous la forme nom_<résolution>_<x>_<y>.ext, format lu par show.py.
+Deux modes de remplissage :
+ - 'carre' (par défaut) : l'image source est complétée en un carré dont le côté est la taille des
+   tuiles multipliée par une puissance du facteur de réduction ; chaque résolution est exactement la
+   réduction de la suivante par ce facteur, toutes les tuiles ont la même taille et la résolution la
+   plus faible tient dans une seule tuile ;
+ - 'aucun' : chaque résolution conserve les proportions de l'image source, sans remplissage ; les
+   tuiles de la dernière colonne et de la dernière ligne sont plus petites, et la résolution est le
+   plus grand côté de l'image complète, dont la taille est inscrite dans le manifeste.
+
+La résolution la plus haute est lue par bandes horizontales, sans jamais charger toute l'image source
+en mémoire ; une image source qui ne se lit pas par bandes (PNG, JPEG, TIFF compressé d'un seul bloc)
+est refusée, sauf option --complete. Chaque résolution inférieure est ensuite calculée à partir des tuiles de la résolution
+supérieure. Le travail est réparti entre plusieurs processus. Les tuiles déjà présentes sont
+conservées, ce qui permet de reprendre une construction interrompue.
+
+Arguments:
+ - Image source (tout format lu par Pillow, ou tableau numpy .npy) ;
+ - Répertoire de destination des tuiles.
+
+Exemple:
+ python construction_pyramide.py scan.tif pyramide/ --nom scan --taille-tuile 512 --processus 8
+
+'''
+
+import argparse
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+from PIL import Image
+
+from pyramide import IndexPyramide, ecrire_manifeste
+
+# Modes de remplissage de l'image source (voir plan_niveaux).
+REMPLISSAGES = ('carre', 'aucun')
+
+# Les images traitées dépassent largement la limite de Pillow contre les bombes de décompression ;
+# la mémoire est maîtrisée par la lecture par bandes.
+Image.MAX_IMAGE_PIXELS = None
+
+# Formats d'écriture reconnus, associés à leur nom pour Pillow.
+FORMATS = {'jpg': 'JPEG', 'jpeg': 'JPEG', 'png': 'PNG', 'webp': 'WEBP', 'tif': 'TIFF', 'bmp': 'BMP'}
+
+# Nombre d'octets par pixel des modes bruts dont la lecture partielle est possible.
+OCTETS_BRUTS = {'1': None, 'L': 1, 'P': 1, 'LA': 2, 'RGB': 3, 'BGR': 3, 'RGBA': 4, 'RGBX': 4,
+				'BGRA': 4, 'BGRX': 4, 'I;16': 2, 'I;16B': 2, 'I;16L': 2, 'I': 4, 'F': 4}
+
+
+class LecteurBandes:
+	''' Lecture d'une image source par bandes horizontales.
+
+		Les tableaux numpy .npy sont projetés en mémoire. Pour les autres formats, seules les parties
+		du fichier couvrant la bande sont décodées lorsque l'image est stockée sans compression ou
+		par bandes indépendantes (PPM, BMP, TIFF par bandes ou par tuiles) ; sinon l'image est
+		décodée entièrement.
+	'''
+
+	def __init__(self, chemin):
+		''' Ouvre l'image source et lit ses seules métadonnées.
+
+			Args:
+			 - chemin : chemin de l'image source.
+		'''
+		self.chemin = chemin
+		self.tableau = None
+		self._complete = None
+		if chemin.lower().endswith('.npy'):
+			self.tableau = np.load(chemin, mmap_mode='r')
+			self.size = (self.tableau.shape[1], self.tableau.shape[0])
+			self.mode = 'L' if self.tableau.ndim == 2 else {3: 'RGB', 4: 'RGBA'}[self.tableau.shape[2]]
+			self.partielle = True
+		else:
+			with Image.open(chemin) as image:
+				self.size = image.size
+				self.mode = image.mode
+				self._tuiles = list(image.tile)
+			self.partielle = len(self._tuiles) > 1 or self._decoupage_brut(0, 1) is not None
+
+
+	def lire(self, y0, y1):
+		''' Lit les lignes y0 à y1 (exclue) de l'image source.
+
+			Returns:
+			 - bande : image PIL de la largeur de la source et de hauteur y1 - y0.
+		'''
+		if self.tableau is not None:
+			return Image.fromarray(np.ascontiguousarray(self.tableau[y0:y1]))
+		if not self.partielle:
+			# Décodage complet, conservé pour les bandes suivantes.
+			if self._complete is None:
+				self._complete = Image.open(self.chemin)
+				self._complete.load()
+			return self._complete.crop((0, y0, self.size[0], y1))
+
+		# Sélection des seules parties du fichier couvrant la bande.
+		if len(self._tuiles) > 1:
+			ry0, ry1, tuiles = self._decoupage_tuiles(y0, y1)
+		else:
+			ry0, ry1, tuiles = y0, y1, self._decoupage_brut(y0, y1)
+		image = Image.open(self.chemin)
+		image._size = (self.size[0], ry1 - ry0)
+		image.tile = tuiles
+		image.load()
+		if (ry0, ry1) != (y0, y1):
+			image = image.crop((0, y0 - ry0, self.size[0], y1 - ry0))
+		return image
+
+
+	def _decoupage_tuiles(self, y0, y1):
+		''' Sélectionne les tuiles ou bandes d'un fichier découpé (TIFF) couvrant les lignes y0 à y1.
+
+			Returns:
+			 - ry0, ry1 : lignes réellement décodées, alignées sur les bandes du fichier ;
+			 - tuiles : tuiles à décoder, décalées de ry0 lignes.
+		'''
+		ry0, ry1 = y0, y1
+		while True:
+			selection = [t for t in self._tuiles if t[1][1] < ry1 and t[1][3] > ry0]
+			debut = min(t[1][1] for t in selection)
+			fin = max(t[1][3] for t in selection)
+			if debut >= ry0 and fin <= ry1:
+				break
+			ry0, ry1 = min(ry0, debut), max(ry1, fin)
+		tuiles = [t._replace(extents=(t[1][0], t[1][1] - ry0, t[1][2], t[1][3] - ry0))
+				  if hasattr(t, '_replace') else (t[0], (t[1][0], t[1][1] - ry0, t[1][2], t[1][3] - ry0), t[2], t[3])
+				  for t in selection]
+		return ry0, ry1, tuiles
+
+
+	def _decoupage_brut(self, y0, y1):
+		''' Construit la tuile à décoder pour lire les lignes y0 à y1 d'une image stockée sans
+			compression en un seul bloc (PPM, BMP, TIFF non compressé d'une seule bande).
+
+			Returns:
+			 - tuiles : liste d'une tuile à décoder, ou None si la lecture partielle est impossible.
+		'''
+		if len(self._tuiles) != 1:
+			return None
+		tuile = self._tuiles[0]
+		decodeur, boite, decalage, args = tuile[0], tuile[1], tuile[2], tuile[3]
+		if decodeur != 'raw' or tuple(boite) != (0, 0) + self.size:
+			return None
+		if isinstance(args, str):
+			args = (args,)
+		mode_brut = args[0]
+		pas = args[1] if len(args) > 1 else 0
+		orientation = args[2] if len(args) > 2 else 1
+		if not pas:
+			octets = OCTETS_BRUTS.get(mode_brut)
+			if octets is None:
+				return None
+			pas = self.size[0] * octets
+		# Les lignes d'une image stockée de bas en haut (orientation -1) sont parcourues à l'envers.
+		ligne = y0 if orientation > 0 else self.size[1] - y1
+		args = (mode_brut, pas, orientation)
+		boite = (0, 0, self.size[0], y1 - y0)
+		if hasattr(tuile, '_replace'):
+			return [tuile._replace(extents=boite, offset=decalage + ligne * pas, args=args)]
+		return [(decodeur, boite, decalage + ligne * pas, args)]
+
+
+def plan_pyramide(largeur, hauteur, taille_tuile, facteur=2):
+	''' Détermine les résolutions d'une pyramide carrée.
+
+		Args:
+		 - largeur, hauteur : dimensions de l'image source ;
+		 - taille_tuile : côté des tuiles, en pixels ;
+		 - facteur : facteur de réduction entre deux résolutions voisines.
+
+		Returns:
+		 - resolutions : côtés des résolutions, de la plus haute à la plus faible ; la plus faible
+		   est égale à la taille des tuiles.
+	'''
+	niveaux = 1
+	while taille_tuile * facteur ** (niveaux - 1) < max(largeur, hauteur):
+		niveaux += 1
+	return [taille_tuile * facteur ** k for k in reversed(range(niveaux))]
+
+
+def plan_niveaux(largeur, hauteur, taille_tuile, facteur=2, carre=True):
+	''' Détermine les résolutions de la pyramide et la taille de leur image complète.
+
+		Args:
+		 - largeur, hauteur : dimensions de l'image source ;
+		 - taille_tuile : côté des tuiles, en pixels ;
+		 - facteur : facteur de réduction entre deux résolutions voisines ;
+		 - carre : complète l'image source en un carré (voir plan_pyramide) ; sinon chaque résolution
+		   mesure la précédente divisée par le facteur, arrondie au pixel supérieur.
+
+		Returns:
+		 - niveaux : liste de (résolution, (largeur, hauteur)), de la plus haute résolution à la plus
+		   faible, qui tient dans une seule tuile.
+	'''
+	if carre:
+		return [(resolution, (resolution, resolution))
+				for resolution in plan_pyramide(largeur, hauteur, taille_tuile, facteur)]
+	niveaux = [(max(largeur, hauteur), (largeur, hauteur))]
+	while max(largeur, hauteur) > taille_tuile:
+		largeur, hauteur = -(-largeur // facteur), -(-hauteur // facteur)
+		niveaux.append((max(largeur, hauteur), (largeur, hauteur)))
+	return niveaux
+
+
+def grille(parametres, niveau):
+	''' Renvoie le nombre de colonnes et de rangées de tuiles d'une résolution. '''
+	largeur, hauteur = parametres['etendues'][niveau]
+	taille = parametres['taille_tuile']
+	return -(-largeur // taille), -(-hauteur // taille)
+
+
+def taille_tuile_grille(parametres, niveau, tx, ty):
+	''' Renvoie la taille d'une tuile : celles de la dernière colonne et de la dernière rangée
+		peuvent être plus petites que les autres.
+	'''
+	largeur, hauteur = parametres['etendues'][niveau]
+	taille = parametres['taille_tuile']
+	return min(taille, largeur - tx * taille), min(taille, hauteur - ty * taille)
+
+
+def nom_tuile(parametres, resolution, x, y):
+	''' Renvoie le chemin d'une tuile de la pyramide. '''
+	return os.path.join(parametres['destination'],
+		"%s_%d_%d_%d.%s" % (parametres['nom'], resolution, x, y, parametres['extension']))
+
+
+def enregistrer_tuile(parametres, tuile, chemin):
+	''' Enregistre une tuile par écriture dans un fichier temporaire puis renommage, afin qu'une
+		construction interrompue ne laisse aucune tuile incomplète.
+	'''
+	format = FORMATS[parametres['extension']]
+	if format == 'JPEG' and tuile.mode not in ('L', 'RGB'):
+		tuile = tuile.convert('RGB')
+	options = {'quality': parametres['qualite']} if format in ('JPEG', 'WEBP') else {}
+	temporaire = chemin + '.partiel'
+	tuile.save(temporaire, format=format, **options)
+	os.replace(temporaire, chemin)
+
+
+def construire_bande(parametres, ty, bande=None):
+	''' Construit une rangée de tuiles de la résolution la plus haute.
+
+		Args:
+		 - parametres : paramètres de la construction ;
+		 - ty : indice de la rangée de tuiles ;
+		 - bande : lignes correspondantes de l'image source, lues par le processus s'il vaut None.
+
+		Returns:
+		 - nombre : nombre de tuiles écrites.
+	'''
+	taille = parametres['taille_tuile']
+	resolution = parametres['resolutions'][0]
+	largeur, hauteur = parametres['taille_source']
+	colonnes = grille(parametres, 0)[0]
+	chemins = [nom_tuile(parametres, resolution, tx, ty) for tx in range(colonnes)]
+	a_faire = [tx for tx in range(colonnes) if not os.path.exists(chemins[tx])]
+	if not a_faire:
+		return 0
+
+	y0, y1 = ty * taille, min((ty + 1) * taille, hauteur)
+	if bande is None and y0 < y1:
+		bande = LecteurBandes(parametres['source']).lire(y0, y1)
+	if bande is not None and bande.mode != parametres['mode']:
+		bande = bande.convert(parametres['mode'])
+
+	for tx in a_faire:
+		tuile = Image.new(parametres['mode'], taille_tuile_grille(parametres, 0, tx, ty), parametres['fond'])
+		x0, x1 = tx * taille, min((tx + 1) * taille, largeur)
+		if bande is not None and x0 < x1:
+			tuile.paste(bande.crop((x0, 0, x1, y1 - y0)), (0, 0))
+		enregistrer_tuile(parametres, tuile, chemins[tx])
+	return len(a_faire)
+
+
+def reduire_rangee(parametres, niveau, ty):
+	''' Construit une rangée de tuiles d'une résolution à partir des tuiles de la résolution
+		immédiatement supérieure : chaque tuile est la réduction par le facteur f de f x f tuiles.
+
+		Args:
+		 - parametres : paramètres de la construction ;
+		 - niveau : indice de la résolution à construire dans parametres['resolutions'] ;
+		 - ty : indice de la rangée de tuiles.
+
+		Returns:
+		 - nombre : nombre de tuiles écrites.
+	'''
+	taille = parametres['taille_tuile']
+	facteur = parametres['facteur']
+	resolution = parametres['resolutions'][niveau]
+	superieure = parametres['resolutions'][niveau - 1]
+	colonnes, rangees = grille(parametres, niveau - 1)
+	nombre = 0
+	for tx in range(grille(parametres, niveau)[0]):
+		chemin = nom_tuile(parametres, resolution, tx, ty)
+		if os.path.exists(chemin):
+			continue
+		# Tuiles de la résolution supérieure couvrant la tuile, sans dépasser de la grille.
+		enfants_x = range(facteur * tx, min(facteur * (tx + 1), colonnes))
+		enfants_y = range(facteur * ty, min(facteur * (ty + 1), rangees))
+		largeur = sum(taille_tuile_grille(parametres, niveau - 1, x, enfants_y[0])[0] for x in enfants_x)
+		hauteur = sum(taille_tuile_grille(parametres, niveau - 1, enfants_x[0], y)[1] for y in enfants_y)
+		assemblage = Image.new(parametres['mode'], (largeur, hauteur), parametres['fond'])
+		for dx, x in enumerate(enfants_x):
+			for dy, y in enumerate(enfants_y):
+				with Image.open(nom_tuile(parametres, superieure, x, y)) as enfant:
+					assemblage.paste(enfant.convert(parametres['mode']), (dx * taille, dy * taille))
+		# Image.reduce arrondit au pixel supérieur une taille non divisible par le facteur, comme
+		# plan_niveaux.
+		enregistrer_tuile(parametres, assemblage.reduce(facteur), chemin)
+		nombre += 1
+	return nombre
+
+
+def construire_pyramide(source, destination, nom='image', taille_tuile=512, extension='jpg',
+						qualite=90, processus=None, fond=0, facteur=2, remplissage='carre', complete=False):
+	''' Construit, ou termine, la pyramide de tuiles d'une image source.
+
+		Args:
+		 - source : chemin de l'image source ;
+		 - destination : répertoire des tuiles, créé si besoin ;
+		 - nom : première partie du nom des tuiles ;
+		 - taille_tuile : côté des tuiles, en pixels ;
+		 - extension : format des tuiles (jpg, png, webp, tif ou bmp) ;
+		 - qualite : qualité de compression JPEG ou WebP ;
+		 - processus : nombre de processus, par défaut le nombre de cœurs ;
+		 - fond : couleur de la partie complétée autour de l'image source ;
+		 - facteur : facteur de réduction entier entre deux résolutions voisines ;
+		 - remplissage : 'carre' ou 'aucun' (voir REMPLISSAGES et plan_niveaux) ;
+		 - complete : accepte une image source qui ne se lit pas par bandes, décodée alors entièrement
+		   en mémoire ; sinon, une telle image est refusée.
+
+		Returns:
+		 - resolutions : résolutions construites, de la plus haute à la plus faible.
+	'''
+	if extension not in FORMATS:
+		raise ValueError("Format de tuile inconnu : %s" % extension)
+	if remplissage not in REMPLISSAGES:
+		raise ValueError("Mode de remplissage inconnu : %s" % remplissage)
+	if facteur < 2:
+		raise ValueError("Le facteur de réduction doit être un entier au moins égal à 2 : %s" % facteur)
+	lecteur = LecteurBandes(source)
+	if not lecteur.partielle and not complete:
+		raise ValueError("%s ne peut pas être lu par bandes et devrait être décodé entièrement en mémoire : "
+			"le convertir d'abord en TIFF par bandes ou par tuiles (par exemple vips tiffsave %s source.tif --tile), "
+			"ou accepter ce décodage avec --complete" % (source, source))
+	os.makedirs(destination, exist_ok=True)
+	largeur, hauteur = lecteur.size
+	niveaux = plan_niveaux(largeur, hauteur, taille_tuile, facteur, remplissage == 'carre')
+	parametres = {
+		'source': source,
+		'destination': destination,
+		'nom': nom,
+		'extension': extension,
+		'qualite': qualite,
+		'taille_tuile': taille_tuile,
+		'taille_source': lecteur.size,
+		'mode': lecteur.mode if lecteur.mode in ('L', 'RGB') else 'RGB',
+		'fond': fond,
+		'facteur': facteur,
+		'resolutions': [resolution for resolution, _ in niveaux],
+		'etendues': [etendue for _, etendue in niveaux],
+	}
+	colonnes, rangees = grille(parametres, 0)
+
+	with ProcessPoolExecutor(max_workers=processus) as executeur:
+		# Résolution la plus haute, lue par bandes dans l'image source.
+		if lecteur.partielle:
+			taches = [executeur.submit(construire_bande, parametres, ty) for ty in range(rangees)]
+			ecrites = sum(tache.result() for tache in taches)
+		else:
+			# Image décodée entièrement, à la demande de l'appelant (complete). Au plus une bande en attente par processus : la mémoire occupée par les copies des
+			# bandes transmises reste bornée, quelle que soit la hauteur de l'image.
+			en_vol = processus or os.cpu_count() or 1
+			taches = []
+			ecrites = 0
+			for ty in range(rangees):
+				# Une rangée déjà construite ne nécessite pas de décoder l'image source.
+				if all(os.path.exists(nom_tuile(parametres, parametres['resolutions'][0], tx, ty))
+					   for tx in range(colonnes)):
+					continue
+				y0, y1 = ty * taille_tuile, min((ty + 1) * taille_tuile, hauteur)
+				if len(taches) >= en_vol:
+					terminees, taches = wait(taches, return_when=FIRST_COMPLETED)
+					taches = list(taches)
+					ecrites += sum(tache.result() for tache in terminees)
+				bande = lecteur.lire(y0, y1) if y0 < y1 else None
+				taches.append(executeur.submit(construire_bande, parametres, ty, bande))
+				del bande
+			ecrites += sum(tache.result() for tache in taches)
+		print("Résolution", parametres['resolutions'][0], ":", ecrites, "tuiles écrites")
+
+		# Résolutions inférieures, chacune calculée à partir de la précédente.
+		for niveau in range(1, len(parametres['resolutions'])):
+			rangees = grille(parametres, niveau)[1]
+			ecrites = sum(executeur.map(reduire_rangee, [parametres] * rangees, [niveau] * rangees, range(rangees)))
+			print("Résolution", parametres['resolutions'][niveau], ":", ecrites, "tuiles écrites")
+
+	# Manifeste de la pyramide : la visionneuse l'ouvrira sans lister le répertoire.
+	# Les images complètes rectangulaires y sont décrites par leur taille.
+	etendues = {} if remplissage == 'carre' else dict(niveaux)
+	ecrire_manifeste(destination, IndexPyramide(os.listdir(destination), etendues),
+		{resolution: (min(taille_tuile, etendue[0]), min(taille_tuile, etendue[1])) for resolution, etendue in niveaux})
+	return parametres['resolutions']
+
+
+def main(args=None):
+	parser = argparse.ArgumentParser(description="Construction d'une pyramide de tuiles pour show.py.")
+	parser.add_argument('source', help="Image source (format lu par Pillow, ou tableau numpy .npy).")
+	parser.add_argument('destination', help="Répertoire des tuiles.")
+	parser.add_argument('--nom', default='image', help="Première partie du nom des tuiles.")
+	parser.add_argument('--taille-tuile', type=int, default=512, help="Côté des tuiles, en pixels (512 par défaut).")
+	parser.add_argument('--format', default='jpg', choices=sorted(FORMATS), help="Format des tuiles (jpg par défaut).")
+	parser.add_argument('--qualite', type=int, default=90, help="Qualité JPEG ou WebP (90 par défaut).")
+	parser.add_argument('--processus', type=int, default=None, help="Nombre de processus (nombre de cœurs par défaut).")
+	parser.add_argument('--facteur', type=int, default=2, help="Facteur de réduction entre deux résolutions (2 par défaut).")
+	parser.add_argument('--remplissage', default='carre', choices=REMPLISSAGES,
+						help="'carre' complète l'image en un carré, 'aucun' conserve ses proportions ('carre' par défaut).")
+	parser.add_argument('--complete', action='store_true',
+						help="Accepte une image source qui ne se lit pas par bandes (PNG, JPEG, TIFF compressé "
+							 "d'un seul bloc), décodée alors entièrement en mémoire.")
+	arguments = parser.parse_args(args)
+	try:
+		resolutions = construire_pyramide(arguments.source, arguments.destination, arguments.nom,
+			arguments.taille_tuile, arguments.format, arguments.qualite, arguments.processus,
+			facteur=arguments.facteur, remplissage=arguments.remplissage, complete=arguments.complete)
+	except ValueError as erreur:
+		parser.error(str(erreur))
+	print("Pyramide terminée. Pour l'afficher : python show.py", resolutions[-1], arguments.destination)
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,311 @@
+'''
+Conteneur de pyramide à fichier unique.
+
+Toutes les tuiles d'une pyramide sont regroupées dans un seul fichier, lu par projection en mémoire
+(mmap) : aucune ouverture de fichier n'est nécessaire pour lire une tuile, et la pyramide se copie
+d'une machine à l'autre comme un seul fichier.
+
+Structure du fichier :
+ - en-tête de 24 octets : signature, position et longueur de l'index ;
+ - tuiles, chacune alignée sur 64 octets ;
+ - index JSON décrivant chaque tuile (nom, résolution, indices, position, longueur, codage, mode,
+   largeur et hauteur).
+
+Codages des tuiles :
+ - brut : pixels non compressés, lus sans copie sous forme de tableau numpy ;
+ - zlib : pixels compressés par zlib, décompressés à la lecture ;
+ - copie : fichier d'origine (JPEG, PNG...) recopié tel quel, décodé par Pillow à la lecture.
+
+Arguments (conversion d'un répertoire de tuiles en conteneur):
+ - Répertoire des tuiles ;
+ - Fichier conteneur à écrire.
+
+Exemple:
+ python conteneur.py nomdudossiercontenantlesimages/ pyramide.pappl --codage brut
+
+'''
+
+import argparse
+import io
+import json
+import mimetypes
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+import numpy as np
+from PIL import Image
+
+from pyramide import IndexPyramide, decoder_reduit, etendue_grille, ouvrir_pyramide
+
+# Signature des conteneurs, suivie de la position et de la longueur de l'index.
+SIGNATURE = b'PAPPLC01'
+EN_TETE = struct.Struct('<8sQQ')
+ALIGNEMENT = 64
+
+CODAGES = ('brut', 'zlib', 'copie')
+
+# Nombre de canaux des modes enregistrés sous forme de pixels.
+CANAUX = {'L': 1, 'LA': 2, 'RGB': 3, 'RGBA': 4}
+MODES = {canaux: mode for mode, canaux in CANAUX.items()}
+
+
+def description_tableau(tableau):
+	''' Renvoie le mode, la largeur et la hauteur enregistrés dans l'index pour les pixels d'une tuile. '''
+	return {'mode': MODES[1 if tableau.ndim == 2 else tableau.shape[2]],
+			'largeur': tableau.shape[1], 'hauteur': tableau.shape[0]}
+
+
+class PyramideConteneur:
+	''' Pyramide stockée dans un conteneur à fichier unique, projeté en mémoire. '''
+
+	def __init__(self, chemin):
+		''' Ouvre le conteneur et lit son index.
+
+			Args:
+			 - chemin : chemin du fichier conteneur.
+		'''
+		self.chemin = chemin
+		self._fichier = open(chemin, 'rb')
+		self._memoire = mmap.mmap(self._fichier.fileno(), 0, access=mmap.ACCESS_READ)
+		signature, position, longueur = EN_TETE.unpack_from(self._memoire, 0)
+		if signature != SIGNATURE:
+			raise ValueError("%s n'est pas un conteneur de pyramide" % chemin)
+		entrees = json.loads(self._memoire[position:position + longueur].decode('utf-8'))
+		self._entrees = {(e['resolution'], e['x'], e['y']): e for e in entrees}
+		self.index = IndexPyramide(e['nom'] for e in entrees)
+		self.index.definir_etendues(self.etendues_tuiles())
+		etat = os.fstat(self._fichier.fileno())
+		self._signature = (os.path.abspath(chemin), etat.st_mtime_ns, etat.st_size)
+
+
+	def ouvrir_tuile(self, resolution, x, y, reduction=1):
+		''' Lit une tuile.
+			Peut être appelée depuis plusieurs threads.
+
+			Args:
+			 - resolution, x, y : résolution et indices de la tuile ;
+			 - reduction : facteur de réduction appliqué au décodage (voir pyramide.decoder_reduit).
+
+			Returns:
+			 - tuile : tableau numpy (hauteur, largeur[, canaux]) pour les codages brut et zlib,
+			   le tableau brut étant une vue sans copie du fichier ; image PIL pour le codage copie
+			   ou pour une tuile réduite ; None si la tuile est absente.
+		'''
+		entree = self._entrees.get((resolution, x, y))
+		if entree is None:
+			return None
+		position, longueur = entree['position'], entree['longueur']
+		if entree['codage'] == 'copie':
+			return decoder_reduit(Image.open(io.BytesIO(self._memoire[position:position + longueur])), reduction)
+		forme = (entree['hauteur'], entree['largeur'])
+		if CANAUX[entree['mode']] > 1:
+			forme += (CANAUX[entree['mode']],)
+		if entree['codage'] == 'zlib':
+			donnees = zlib.decompress(self._memoire[position:position + longueur])
+			return decoder_reduit(np.frombuffer(donnees, dtype=np.uint8).reshape(forme), reduction)
+		tableau = np.frombuffer(self._memoire, dtype=np.uint8, count=longueur, offset=position).reshape(forme)
+		return decoder_reduit(tableau, reduction)
+
+
+	def octets_tuile(self, resolution, x, y):
+		''' Lit une tuile sans la décoder, pour le serveur de tuiles (voir serveur_tuiles.py).
+
+			Returns:
+			 - (donnees, type) : fichier d'origine pour le codage copie ; pixels au format .npy de numpy
+			   (type application/x-npy) pour les codages brut et zlib ; None si la tuile est absente.
+		'''
+		entree = self._entrees.get((resolution, x, y))
+		if entree is None:
+			return None
+		if entree['codage'] == 'copie':
+			position, longueur = entree['position'], entree['longueur']
+			return self._memoire[position:position + longueur], mimetypes.guess_type(entree['nom'])[0] or 'application/octet-stream'
+		flux = io.BytesIO()
+		np.save(flux, self.ouvrir_tuile(resolution, x, y))
+		return flux.getvalue(), 'application/x-npy'
+
+
+	def signature_tuile(self, resolution, x, y):
+		''' Identifie le contenu d'une tuile, pour le cache disque (voir cache_disque.py).
+
+			Returns:
+			 - signature : (chemin absolu du conteneur et nom de la tuile, date de modification en ns,
+			   taille) du conteneur ; None si la tuile est absente ou stockée brute, déjà lisible
+			   sans décodage.
+		'''
+		entree = self._entrees.get((resolution, x, y))
+		if entree is None or entree['codage'] == 'brut':
+			return None
+		chemin, date, taille = self._signature
+		return (chemin + '#' + entree['nom'], date, taille)
+
+
+	def taille_tuile(self, resolution):
+		''' Renvoie la taille de la tuile (0, 0) d'une résolution, ou à défaut d'une tuile présente,
+			lue dans l'index.
+		'''
+		entree = self._entrees.get((resolution, 0, 0))
+		if entree is None:
+			x, y = next(iter(self.index.tuiles(resolution)))
+			entree = self._entrees[(resolution, x, y)]
+		return (entree['largeur'], entree['hauteur'])
+
+
+	def etendues_tuiles(self):
+		''' Détermine la taille des images complètes rectangulaires d'après la taille des tuiles
+			enregistrée dans l'index (voir pyramide.etendue_grille).
+		'''
+		etendues = {}
+		for resolution in self.index.niveaux():
+			dimX, dimY = self.index.dimensions(resolution)
+			colonne = self._entrees.get((resolution, dimX, 0))
+			ligne = self._entrees.get((resolution, 0, dimY))
+			if (resolution, 0, 0) not in self._entrees or colonne is None or ligne is None:
+				continue
+			etendue = etendue_grille(resolution, (dimX, dimY), self.taille_tuile(resolution),
+				(colonne['largeur'], ligne['hauteur']))
+			if etendue is not None:
+				etendues[resolution] = etendue
+		return etendues
+
+
+	def entree_tuile(self, resolution, x, y):
+		''' Renvoie la description d'une tuile dans l'index, ou None si la tuile est absente. '''
+		entree = self._entrees.get((resolution, x, y))
+		return None if entree is None else dict(entree)
+
+
+	def fermer(self):
+		''' Ferme le conteneur. Les tableaux bruts renvoyés auparavant ne doivent plus être utilisés. '''
+		self._memoire.close()
+		self._fichier.close()
+
+
+class EcritureConteneur:
+	''' Écriture d'un conteneur tuile par tuile, sous un nom temporaire renommé une fois l'index écrit. '''
+
+	def __init__(self, chemin):
+		''' Crée le fichier temporaire et réserve l'en-tête.
+
+			Args:
+			 - chemin : fichier conteneur à écrire.
+		'''
+		self.chemin = chemin
+		self.temporaire = chemin + '.partiel'
+		self.entrees = []
+		self._fichier = open(self.temporaire, 'wb')
+		self._fichier.write(EN_TETE.pack(SIGNATURE, 0, 0))
+
+
+	def ajouter(self, entree, donnees):
+		''' Ajoute une tuile à la suite des précédentes.
+
+			Args:
+			 - entree : description de la tuile (nom, résolution, indices, codage, mode, largeur et
+			   hauteur), complétée de sa position et de sa longueur ;
+			 - donnees : octets enregistrés de la tuile.
+		'''
+		# Alignement de chaque tuile.
+		self._fichier.write(b'\0' * (-self._fichier.tell() % ALIGNEMENT))
+		entree = dict(entree, position=self._fichier.tell(), longueur=len(donnees))
+		self._fichier.write(donnees)
+		self.entrees.append(entree)
+
+
+	def recopier(self, conteneur, resolution, x, y):
+		''' Recopie une tuile d'un autre conteneur telle qu'enregistrée, sans la décoder.
+
+			Args:
+			 - conteneur : PyramideConteneur contenant la tuile ;
+			 - resolution, x, y : résolution et indices de la tuile.
+		'''
+		entree = conteneur._entrees[(resolution, x, y)]
+		position, longueur = entree['position'], entree['longueur']
+		self.ajouter(entree, conteneur._memoire[position:position + longueur])
+
+
+	def terminer(self):
+		''' Écrit l'index en fin de fichier, met à jour l'en-tête et renomme le fichier.
+
+			Returns:
+			 - nombre : nombre de tuiles écrites.
+		'''
+		index = json.dumps(self.entrees).encode('utf-8')
+		position = self._fichier.tell()
+		self._fichier.write(index)
+		self._fichier.seek(0)
+		self._fichier.write(EN_TETE.pack(SIGNATURE, position, len(index)))
+		self._fichier.close()
+		os.replace(self.temporaire, self.chemin)
+		return len(self.entrees)
+
+
+	def abandonner(self):
+		''' Ferme et supprime le fichier temporaire, sans toucher au conteneur existant. '''
+		self._fichier.close()
+		if os.path.exists(self.temporaire):
+			os.remove(self.temporaire)
+
+
+def ecrire_conteneur(source, chemin, codage='brut', niveau_zlib=1):
+	''' Écrit un conteneur à partir d'une pyramide existante.
+
+		Args:
+		 - source : répertoire de tuiles ou conteneur à convertir ;
+		 - chemin : fichier conteneur à écrire ;
+		 - codage : codage des tuiles (brut, zlib ou copie) ;
+		 - niveau_zlib : niveau de compression du codage zlib, de 1 (rapide) à 9.
+
+		Returns:
+		 - nombre : nombre de tuiles écrites.
+	'''
+	if codage not in CODAGES:
+		raise ValueError("Codage inconnu : %s" % codage)
+	pyramide = ouvrir_pyramide(source)
+	if codage == 'copie' and not os.path.isdir(source):
+		raise ValueError("Le codage copie n'est possible qu'à partir d'un répertoire de tuiles")
+	ecriture = EcritureConteneur(chemin)
+	try:
+		for resolution in pyramide.index.niveaux():
+			for (x, y), nom in sorted(pyramide.index.tuiles(resolution).items()):
+				entree = {'nom': nom, 'resolution': resolution, 'x': x, 'y': y, 'codage': codage}
+				if codage == 'copie':
+					with open(os.path.join(source, nom), 'rb') as tuile:
+						donnees = tuile.read()
+					with Image.open(io.BytesIO(donnees)) as image:
+						entree['mode'] = image.mode
+						entree['largeur'], entree['hauteur'] = image.size
+				else:
+					tuile = pyramide.ouvrir_tuile(resolution, x, y)
+					if isinstance(tuile, Image.Image):
+						if tuile.mode not in CANAUX:
+							tuile = tuile.convert('RGBA' if 'A' in tuile.getbands() else 'RGB')
+						tuile = np.asarray(tuile)
+					entree.update(description_tableau(tuile))
+					donnees = np.ascontiguousarray(tuile, dtype=np.uint8).tobytes()
+					if codage == 'zlib':
+						donnees = zlib.compress(donnees, niveau_zlib)
+				ecriture.ajouter(entree, donnees)
+		return ecriture.terminer()
+	except BaseException:
+		ecriture.abandonner()
+		raise
+
+
+def main(args=None):
+	parser = argparse.ArgumentParser(description="Regroupement d'une pyramide de tuiles dans un conteneur à fichier unique.")
+	parser.add_argument('source', help="Répertoire des tuiles (ou conteneur à réécrire).")
+	parser.add_argument('conteneur', help="Fichier conteneur à écrire.")
+	parser.add_argument('--codage', default='brut', choices=CODAGES,
+						help="Codage des tuiles : brut (par défaut), zlib ou copie des fichiers d'origine.")
+	parser.add_argument('--niveau-zlib', type=int, default=1, help="Niveau de compression zlib (1 par défaut).")
+	arguments = parser.parse_args(args)
+	nombre = ecrire_conteneur(arguments.source, arguments.conteneur, arguments.codage, arguments.niveau_zlib)
+	print(nombre, "tuiles écrites dans", arguments.conteneur)
+
+
+if __name__ == '__main__':
+	sys.exit(main())
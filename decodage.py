@@ -0,0 +1,203 @@
+'''
+Décodage des tuiles dans un groupe de processus.
+
+Pillow ne libère pas le GIL pendant tout le décodage d'une tuile : des threads de décodage n'occupent
+donc pas tous les cœurs lorsqu'un changement de résolution demande plusieurs dizaines de tuiles à la
+fois. PyramideProcessus décode les tuiles dans des processus de travail ; les pixels sont transmis
+par un segment de mémoire partagée (multiprocessing.shared_memory), sans sérialisation ni copie : le
+tableau renvoyé au processus appelant est une vue du segment, libéré quand le tableau l'est. Le
+segment d'une tuile dont le résultat n'est jamais lu (appelant interrompu, arrêt des processus) est
+supprimé à la fin de son décodage ou à la fermeture.
+
+Deux modes de décodage, au choix (option --decodage de show.py et de banc_essai.py rejouer) :
+ - 'thread' : la tuile est décodée dans le thread qui la demande, en général un thread de préchargement ;
+ - 'processus' : la tuile est décodée dans un processus de travail ; le thread qui la demande attend
+   sans retenir le GIL, et plusieurs threads de préchargement occupent ainsi plusieurs cœurs.
+
+'''
+
+import ctypes
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+from PIL import Image
+
+from cache_disque import vers_tableau
+from pyramide import ouvrir_pyramide, reduction_tuile
+
+MODES_DECODAGE = ('thread', 'processus')
+
+# Pyramides ouvertes par chaque processus de travail, une seule fois.
+_pyramides = {}
+
+
+def decoder_tuile(chemin, resolution, x, y, reduction=1):
+	''' Décode une tuile et place ses pixels dans un segment de mémoire partagée.
+		Exécutée dans un processus de travail ; le segment est libéré par lire_segment() ou
+		liberer_segment().
+
+		Args:
+		 - chemin : répertoire, conteneur ou adresse de la pyramide (voir pyramide.ouvrir_pyramide) ;
+		 - resolution, x, y : résolution et indices de la tuile ;
+		 - reduction : facteur de réduction au décodage.
+
+		Returns:
+		 - description : (nom du segment, forme, type des pixels, facteur de réduction obtenu), ou
+		   None si la tuile est absente.
+	'''
+	if chemin not in _pyramides:
+		_pyramides[chemin] = ouvrir_pyramide(chemin)
+	tuile = _pyramides[chemin].ouvrir_tuile(resolution, x, y, reduction)
+	if tuile is None:
+		return None
+	tableau = vers_tableau(tuile)
+	segment = shared_memory.SharedMemory(create=True, size=max(tableau.nbytes, 1))
+	pixels = np.ndarray(tableau.shape, tableau.dtype, buffer=segment.buf)
+	pixels[...] = tableau
+	del pixels
+	segment.close()
+	return segment.name, tableau.shape, tableau.dtype.str, reduction_tuile(tuile)
+
+
+class _VueSegment:
+	''' Expose les pixels d'un segment de mémoire partagée à numpy, en gardant le segment ouvert
+		tant que le tableau qui en est la vue existe.
+	'''
+
+	def __init__(self, segment, forme, type_pixels):
+		self.segment = segment
+		# Adresse des pixels plutôt que segment.buf : numpy garderait alors une référence au seul
+		# memoryview, et la fermeture du segment, à sa destruction, laisserait le tableau sans mémoire.
+		adresse = ctypes.addressof(ctypes.c_char.from_buffer(segment.buf))
+		self.__array_interface__ = {'shape': tuple(forme), 'typestr': type_pixels, 'data': (adresse, False),
+									'version': 3}
+
+
+def lire_segment(description):
+	''' Renvoie les pixels d'un segment de mémoire partagée, sans copie.
+
+		Le nom du segment est supprimé aussitôt : la mémoire n'est plus accessible qu'à travers le
+		tableau, et rendue au système quand il est libéré.
+
+		Args:
+		 - description : valeur renvoyée par decoder_tuile().
+
+		Returns:
+		 - tableau : pixels de la tuile, vue du segment.
+	'''
+	nom, forme, type_pixels, _ = description
+	segment = shared_memory.SharedMemory(name=nom)
+	try:
+		tableau = np.asarray(_VueSegment(segment, forme, type_pixels))
+	except BaseException:
+		segment.close()
+		raise
+	finally:
+		segment.unlink()
+	return tableau
+
+
+def liberer_segment(description):
+	''' Supprime le segment de mémoire partagée d'une tuile dont les pixels ne seront pas lus. '''
+	try:
+		segment = shared_memory.SharedMemory(name=description[0])
+	except FileNotFoundError:
+		return
+	segment.close()
+	segment.unlink()
+
+
+class PyramideProcessus:
+	''' Enveloppe d'une pyramide décodant ses tuiles dans un groupe de processus.
+		S'utilise à la place de la pyramide enveloppée (voir pyramide.ouvrir_pyramide).
+	'''
+
+	def __init__(self, pyramide, chemin, processus=None):
+		''' Initialise l'enveloppe et démarre les processus de travail.
+
+			Les processus sont démarrés dès maintenant, avant la création de la fenêtre et des threads
+			de préchargement, qu'ils n'héritent ainsi pas.
+
+			Args:
+			 - pyramide : pyramide de tuiles, ouverte dans le processus appelant ;
+			 - chemin : répertoire, conteneur ou adresse de la même pyramide, ouverte par chaque processus ;
+			 - processus : nombre de processus, par défaut le nombre de cœurs.
+		'''
+		self.pyramide = pyramide
+		self.index = pyramide.index
+		self.chemin = chemin
+		self.processus = processus or os.cpu_count() or 1
+		# Un seul suivi des segments partagés pour tous les processus : un segment créé par un
+		# processus de travail et libéré par le processus appelant n'est pas signalé comme perdu.
+		resource_tracker.ensure_running()
+		# Décodages dont le segment n'a pas encore été lu ni libéré.
+		self._futurs = set()
+		self._verrou = threading.Lock()
+		self._executeur = ProcessPoolExecutor(max_workers=self.processus)
+		self._executeur.submit(int).result()
+
+
+	def ouvrir_tuile(self, resolution, x, y, reduction=1):
+		''' Décode une tuile dans un processus de travail et attend ses pixels.
+			Peut être appelée depuis plusieurs threads.
+
+			Returns:
+			 - tuile : tableau numpy, image PIL pour une tuile réduite (voir pyramide.decoder_reduit),
+			   ou None si la tuile est absente.
+		'''
+		futur = self._executeur.submit(decoder_tuile, self.chemin, resolution, x, y, reduction)
+		with self._verrou:
+			self._futurs.add(futur)
+		try:
+			description = futur.result()
+		except BaseException:
+			# Attente interrompue ou décodage annulé : le segment est libéré à la fin du décodage.
+			futur.add_done_callback(self._abandonner)
+			raise
+		with self._verrou:
+			if futur not in self._futurs:
+				# Segment déjà libéré par fermer().
+				return None
+			self._futurs.discard(futur)
+		if description is None:
+			return None
+		tableau = lire_segment(description)
+		if description[3] > 1:
+			image = Image.fromarray(tableau)
+			image.info['reduction'] = description[3]
+			return image
+		return tableau
+
+
+	def _abandonner(self, futur):
+		''' Libère le segment d'un décodage terminé dont le résultat ne sera pas lu. '''
+		with self._verrou:
+			if futur not in self._futurs:
+				return
+			self._futurs.discard(futur)
+		if not futur.cancelled() and futur.exception() is None and futur.result() is not None:
+			liberer_segment(futur.result())
+
+
+	def octets_tuile(self, resolution, x, y):
+		return self.pyramide.octets_tuile(resolution, x, y)
+
+
+	def signature_tuile(self, resolution, x, y):
+		return self.pyramide.signature_tuile(resolution, x, y)
+
+
+	def taille_tuile(self, resolution):
+		return self.pyramide.taille_tuile(resolution)
+
+
+	def fermer(self):
+		''' Arrête les processus de travail et libère les segments qui n'ont pas été lus. '''
+		self._executeur.shutdown(wait=True, cancel_futures=True)
+		with self._verrou:
+			futurs = list(self._futurs)
+		for futur in futurs:
+			self._abandonner(futur)
@@ -0,0 +1,227 @@
+'''
+Export d'une région de l'image complète virtuelle d'une résolution.
+
+Seules les tuiles couvrant la région sont lues. La région est composée par bandes horizontales,
+réparties entre plusieurs processus : chaque processus compose sa bande avec le moteur de rendu et
+l'écrit directement à sa place dans le fichier de sortie, projeté en mémoire. La mémoire utilisée
+dépend de la largeur de la région et du nombre de processus, pas de sa hauteur.
+
+Formats de sortie :
+ - .npy (tableau numpy) et .ppm : écrits par bandes, sans jamais contenir l'image entière en mémoire ;
+ - autres formats de Pillow (.png, .tif, .jpg...) : assemblés dans un fichier .npy temporaire puis
+   convertis ; l'image entière est alors chargée en mémoire lors de la conversion.
+
+Une version réduite d'un facteur entier peut être écrite en même temps, à partir des mêmes bandes.
+
+Arguments:
+ - Pyramide : répertoire de tuiles, conteneur ou adresse d'un serveur de tuiles ;
+ - Résolution ;
+ - Rectangle x1 y1 x2 y2, en pixels de la résolution ;
+ - Fichier de sortie.
+
+Options:
+ - --reduction : facteur de réduction de la version réduite ;
+ - --reduite : fichier de la version réduite ;
+ - --processus : nombre de processus (nombre de cœurs par défaut) ;
+ - --hauteur-bande : hauteur des bandes, en pixels ; les bandes commencent aux multiples de cette
+   hauteur (par défaut, aux rangées de tuiles).
+
+Exemple:
+ python export_region.py nomdudossiercontenantlesimages/ 8192 1000 2000 5000 4000 region.png --reduction 8 --reduite apercu.png
+
+'''
+
+import argparse
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from cache_tuiles import CacheTuiles
+from moteur import MoteurRendu, bord_tuile
+from pyramide import ouvrir_pyramide
+
+# Formats écrits par bandes directement dans le fichier de sortie.
+FORMATS_BANDES = ('.npy', '.ppm')
+
+# Budget du cache de tuiles de chaque processus : une rangée de tuiles partagée par plusieurs bandes,
+# moins hautes que les tuiles, n'est lue qu'une fois par chaque processus qui en compose une.
+CACHE_PROCESSUS = 256 * 1024 * 1024
+
+# Pyramides ouvertes par chaque processus, une seule fois.
+_pyramides = {}
+
+
+def fichier_bandes(chemin):
+	''' Renvoie le fichier écrit par bandes pour un fichier de sortie : le fichier lui-même, ou un
+		.npy temporaire si son format ne s'écrit pas par bandes.
+	'''
+	if os.path.splitext(chemin)[1].lower() in FORMATS_BANDES:
+		return chemin
+	return chemin + '.partiel.npy'
+
+
+def creer_sortie(chemin, largeur, hauteur):
+	''' Crée le fichier recevant les pixels RGB de la région, rempli ensuite par bandes.
+
+		Returns:
+		 - destination : dictionnaire (fichier, position des pixels dans le fichier, forme) ;
+		   le fichier est un .npy temporaire si le format de sortie ne s'écrit pas par bandes.
+	'''
+	forme = (hauteur, largeur, 3)
+	fichier = fichier_bandes(chemin)
+	if fichier.lower().endswith('.ppm'):
+		en_tete = b'P6\n%d %d\n255\n' % (largeur, hauteur)
+		with open(fichier, 'wb') as sortie:
+			sortie.write(en_tete)
+			sortie.truncate(len(en_tete) + hauteur * largeur * 3)
+		return {'fichier': fichier, 'position': len(en_tete), 'forme': forme}
+	tableau = np.lib.format.open_memmap(fichier, mode='w+', dtype=np.uint8, shape=forme)
+	position = tableau.offset
+	del tableau
+	return {'fichier': fichier, 'position': position, 'forme': forme}
+
+
+def terminer_sortie(chemin, destination):
+	''' Convertit, si besoin, le fichier temporaire dans le format de sortie demandé. '''
+	if destination['fichier'] == chemin:
+		return
+	tableau = np.load(destination['fichier'], mmap_mode='r')
+	Image.fromarray(np.asarray(tableau)).save(chemin)
+	del tableau
+	os.remove(destination['fichier'])
+
+
+def composer_bande(parametres, y0, y1):
+	''' Compose une bande de la région et l'écrit dans le ou les fichiers de sortie.
+		Exécutée dans un processus de travail.
+
+		Args:
+		 - parametres : dictionnaire décrivant l'export (voir exporter_region) ;
+		 - y0, y1 : lignes de début et de fin de la bande, en pixels de la résolution.
+
+		Returns:
+		 - lignes : nombre de lignes écrites.
+	'''
+	chemin = parametres['pyramide']
+	if chemin not in _pyramides:
+		_pyramides[chemin] = (ouvrir_pyramide(chemin), CacheTuiles(CACHE_PROCESSUS))
+	pyramide, cache = _pyramides[chemin]
+	x1, y_region, x2, _ = parametres['rectangle']
+	bande = MoteurRendu(pyramide, cache).rendre(parametres['resolution'], (x1, y0, x2, y1), 1.0)
+
+	sorties = [(parametres['sortie'], bande, y0 - y_region)]
+	if parametres['reduite'] is not None:
+		reduction = parametres['reduction']
+		sorties.append((parametres['reduite'], bande.reduce(reduction), (y0 - y_region) // reduction))
+	for destination, image, ligne in sorties:
+		pixels = np.memmap(destination['fichier'], dtype=np.uint8, mode='r+',
+			offset=destination['position'], shape=destination['forme'])
+		pixels[ligne:ligne + image.size[1]] = np.asarray(image)
+		pixels.flush()
+		del pixels
+	return y1 - y0
+
+
+def exporter_region(pyramide, resolution, rectangle, sortie, reduction=None, reduite=None,
+					processus=None, hauteur_bande=None):
+	''' Exporte une région d'une résolution dans un fichier image.
+
+		Args:
+		 - pyramide : répertoire de tuiles, conteneur ou adresse d'un serveur de tuiles ;
+		 - resolution : résolution à exporter ;
+		 - rectangle : (x1, y1, x2, y2) en pixels de la résolution, limité à l'image complète ;
+		 - sortie : fichier image à écrire ;
+		 - reduction, reduite : facteur et fichier de la version réduite, facultative ;
+		 - processus : nombre de processus, par défaut le nombre de cœurs ;
+		 - hauteur_bande : hauteur des bandes, par défaut celle des tuiles.
+
+		Returns:
+		 - (largeur, hauteur) : taille de la région exportée.
+	'''
+	source = ouvrir_pyramide(pyramide)
+	if resolution not in source.index:
+		raise ValueError("Résolution %s absente, résolutions disponibles : %s" % (resolution, source.index.niveaux()))
+	largeur_image, hauteur_image = source.index.etendue(resolution) or (resolution, resolution)
+	x1, x2 = (min(max(int(valeur), 0), largeur_image) for valeur in rectangle[0::2])
+	y1, y2 = (min(max(int(valeur), 0), hauteur_image) for valeur in rectangle[1::2])
+	largeur, hauteur = x2 - x1, y2 - y1
+	if largeur <= 0 or hauteur <= 0:
+		raise ValueError("Rectangle vide : %s" % (rectangle,))
+	if (reduite is None) != (reduction is None):
+		raise ValueError("La version réduite demande un facteur de réduction et un fichier")
+
+	# Bandes limitées par les bords des rangées de tuiles, placés comme par le moteur de rendu, ou par
+	# les multiples de hauteur_bande : une rangée de tuiles n'est décodée que par une bande, sauf
+	# bandes moins hautes qu'elle. Pour la version réduite, chaque limite est repoussée sur la grille
+	# du facteur de réduction depuis y1.
+	if hauteur_bande is None:
+		if source.index.etendue(resolution) is not None:
+			hauteur_bande = source.taille_tuile(resolution)[1]
+		else:
+			hauteur_bande = hauteur_image / (source.index.dimensions(resolution)[1] + 1)
+	limites = [y1]
+	rangee = int(y1 // hauteur_bande) + 1
+	while limites[-1] < y2:
+		limite = min(bord_tuile(rangee, hauteur_bande, hauteur_image), y2)
+		if reduction is not None:
+			limite = min(y1 + -(-(limite - y1) // reduction) * reduction, y2)
+		if limite > limites[-1]:
+			limites.append(limite)
+		rangee += 1
+	debuts, fins = limites[:-1], limites[1:]
+
+	for extension in {os.path.splitext(chemin)[1].lower() for chemin in (sortie, reduite) if chemin is not None}:
+		if extension not in FORMATS_BANDES:
+			warnings.warn("Le format %s ne s'écrit pas par bandes : l'image entière sera chargée en mémoire lors de la conversion" % extension)
+
+	sorties = [(sortie, largeur, hauteur)]
+	if reduite is not None:
+		sorties.append((reduite, -(-largeur // reduction), -(-hauteur // reduction)))
+	parametres = {'pyramide': pyramide, 'resolution': resolution, 'rectangle': (x1, y1, x2, y2),
+				  'sortie': None, 'reduction': reduction, 'reduite': None}
+
+	# Fichiers écrits par l'export, supprimés s'il échoue : un fichier incomplet ne doit pas passer
+	# pour un export réussi.
+	ecrits = [fichier_bandes(chemin) for chemin, _, _ in sorties]
+	try:
+		for cle, (chemin, largeur_sortie, hauteur_sortie) in zip(('sortie', 'reduite'), sorties):
+			parametres[cle] = creer_sortie(chemin, largeur_sortie, hauteur_sortie)
+		with ProcessPoolExecutor(max_workers=processus) as executeur:
+			lignes = sum(executeur.map(composer_bande, [parametres] * len(debuts), debuts, fins))
+		if lignes != hauteur:
+			raise RuntimeError("Export incomplet : %d lignes composées sur %d" % (lignes, hauteur))
+		for cle, (chemin, _, _) in zip(('sortie', 'reduite'), sorties):
+			ecrits.append(chemin)
+			terminer_sortie(chemin, parametres[cle])
+	except BaseException:
+		for fichier in ecrits:
+			if os.path.exists(fichier):
+				os.remove(fichier)
+		raise
+	return largeur, hauteur
+
+
+def main(args=None):
+	parser = argparse.ArgumentParser(description="Export d'une région d'une résolution de la pyramide.")
+	parser.add_argument('pyramide', help="Répertoire des tuiles, conteneur ou adresse d'un serveur de tuiles.")
+	parser.add_argument('resolution', type=int, help="Résolution à exporter.")
+	parser.add_argument('rectangle', type=int, nargs=4, metavar=('X1', 'Y1', 'X2', 'Y2'),
+						help="Région à exporter, en pixels de la résolution.")
+	parser.add_argument('sortie', help="Fichier image à écrire (.npy et .ppm écrits par bandes).")
+	parser.add_argument('--reduction', type=int, help="Facteur de réduction de la version réduite.")
+	parser.add_argument('--reduite', help="Fichier de la version réduite.")
+	parser.add_argument('--processus', type=int, default=None, help="Nombre de processus (nombre de cœurs par défaut).")
+	parser.add_argument('--hauteur-bande', type=int, default=None, help="Hauteur des bandes (celle des tuiles par défaut).")
+	arguments = parser.parse_args(args)
+	if (arguments.reduite is None) != (arguments.reduction is None):
+		parser.error("--reduction et --reduite s'utilisent ensemble")
+	largeur, hauteur = exporter_region(arguments.pyramide, arguments.resolution, arguments.rectangle,
+		arguments.sortie, arguments.reduction, arguments.reduite, arguments.processus, arguments.hauteur_bande)
+	print(arguments.sortie, ":", largeur, "x", hauteur, "pixels")
+
+
+if __name__ == '__main__':
+	main()
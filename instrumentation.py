@@ -0,0 +1,128 @@
+'''
+Mesure de la durée des étapes du rendu.
+
+Chaque étape est mesurée par un gestionnaire de contexte :
+
+	with chrono.mesure('redimensionnement'):
+		image = image.resize(taille)
+
+Un chronomètre inactif renvoie toujours le même contexte vide : une mesure ne coûte alors qu'un appel
+de méthode. Actif, il cumule la durée de chaque étape de l'image en cours de rendu, pour l'affichage
+tête haute de show.py, et peut conserver tous les événements afin de les exporter au format
+« Trace Event » de Chrome (chrome://tracing, ui.perfetto.dev).
+
+'''
+
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Contexte renvoyé par un chronomètre inactif.
+_VIDE = contextlib.nullcontext()
+
+
+class _Mesure:
+	''' Mesure d'une étape, notée dans le chronomètre à la sortie du contexte. '''
+
+	__slots__ = ('chrono', 'nom', 'debut')
+
+	def __init__(self, chrono, nom):
+		self.chrono = chrono
+		self.nom = nom
+
+	def __enter__(self):
+		self.debut = time.perf_counter()
+		return self
+
+	def __exit__(self, *exception):
+		self.chrono.noter(self.nom, self.debut, time.perf_counter())
+		return False
+
+
+class Chronometre:
+	''' Mesure des étapes du rendu, image par image. Peut être partagé entre plusieurs threads. '''
+
+	def __init__(self, actif=False, enregistrer=False):
+		''' Initialise le chronomètre.
+
+			Args:
+			 - actif : mesure les étapes ; un chronomètre inactif ne mesure rien ;
+			 - enregistrer : conserve tous les événements pour exporter() (implique actif).
+		'''
+		self.actif = actif or enregistrer
+		self.enregistrer = enregistrer
+		self.evenements = []
+		self.origine = time.perf_counter()
+		# Durées cumulées, en ms, des étapes de l'image en cours puis de la dernière image terminée.
+		self.etapes = {}
+		self.derniere = {}
+		# Instants de fin des dernières images, pour le nombre d'images par seconde.
+		self._fins = deque(maxlen=30)
+		self._debut_image = None
+		self._thread_image = None
+		self._threads = {}
+
+
+	def mesure(self, nom):
+		''' Renvoie le contexte mesurant une étape. '''
+		if not self.actif:
+			return _VIDE
+		return _Mesure(self, nom)
+
+
+	def debut_image(self):
+		''' Marque le début du rendu d'une image : les étapes mesurées ensuite dans le même thread
+			lui sont attribuées.
+		'''
+		if not self.actif:
+			return
+		self.etapes = {}
+		self._thread_image = threading.get_ident()
+		self._debut_image = time.perf_counter()
+
+
+	def fin_image(self):
+		''' Marque la fin du rendu de l'image en cours. '''
+		if not self.actif or self._debut_image is None:
+			return
+		fin = time.perf_counter()
+		self.noter('image', self._debut_image, fin)
+		self.derniere = self.etapes
+		self._fins.append(fin)
+		self._debut_image = None
+		self._thread_image = None
+
+
+	def ips(self):
+		''' Renvoie le nombre d'images par seconde des dernières images rendues. '''
+		if len(self._fins) < 2:
+			return 0.0
+		return (len(self._fins) - 1) / (self._fins[-1] - self._fins[0])
+
+
+	def noter(self, nom, debut, fin):
+		''' Enregistre la durée d'une étape.
+
+			Args:
+			 - nom : nom de l'étape ;
+			 - debut, fin : instants de début et de fin, donnés par time.perf_counter().
+		'''
+		thread = threading.get_ident()
+		if thread == self._thread_image:
+			self.etapes[nom] = self.etapes.get(nom, 0.0) + (fin - debut) * 1000
+		if self.enregistrer:
+			if thread not in self._threads:
+				self._threads[thread] = threading.current_thread().name
+			self.evenements.append({'name': nom, 'ph': 'X', 'pid': os.getpid(), 'tid': thread,
+				'ts': (debut - self.origine) * 1e6, 'dur': (fin - debut) * 1e6})
+
+
+	def exporter(self, chemin):
+		''' Écrit les événements enregistrés au format « Trace Event » de Chrome. '''
+		noms = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': thread, 'args': {'name': nom}}
+				for thread, nom in self._threads.items()]
+		with open(chemin, 'w') as fichier:
+			json.dump({'traceEvents': noms + self.evenements, 'displayTimeUnit': 'ms'}, fichier)
@@ -0,0 +1,483 @@
+'''
+Moteur de rendu indépendant de tkinter.
+
+Le moteur compose la partie visible de l'image complète virtuelle d'une résolution à partir de ses
+tuiles. Il ne dépend d'aucune bibliothèque graphique : show.py l'utilise pour dessiner dans son canvas,
+mais il peut aussi être utilisé sans écran (mesures de performances, rendu par lots).
+
+Conventions de coordonnées :
+ - par défaut, l'image complète de la résolution r est un carré de r pixels de côté, et une tuile
+   mesure r / (dimX + 1) pixels de large et r / (dimY + 1) de haut ;
+ - lorsque l'index connaît l'étendue rectangulaire (largeur, hauteur) d'une résolution (voir
+   pyramide.etendue_grille), les tuiles mesurent la taille de la tuile (0, 0), celles de la dernière
+   colonne et de la dernière ligne pouvant être plus petites ;
+ - la zone affichée est exprimée en pixels d'affichage, c'est-à-dire en pixels de la résolution
+   multipliés par l'échelle, depuis le coin haut-gauche de l'image complète.
+
+Lorsque l'échelle est inférieure ou égale à 1/2, les tuiles sont décodées à taille réduite (facteur
+de réduction puissance de deux, voir pyramide.decoder_reduit) : une tuile JPEG n'est alors jamais
+décodée en entier. Le filtre de redimensionnement dépend de la qualité demandée : un filtre rapide
+pendant les déplacements, un filtre de meilleure qualité une fois l'image immobile.
+
+Lors d'une simple translation (même résolution, même échelle, même filtre, même taille de zone), le
+rendu précédent est décalé dans son cadre et seules les bandes nouvellement visibles sont composées :
+le coût d'une image dépend alors de la vitesse du déplacement et non de la taille de la fenêtre. Un
+pixel étant composé d'après sa seule position dans l'image complète (voir PAS_SOURCE), l'image ainsi
+obtenue est identique à celle d'un rendu complet, à toutes les échelles.
+
+'''
+
+import math
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+from instrumentation import Chronometre
+from pyramide import decouper, reduction_tuile, taille_pixels
+
+# Filtres de redimensionnement selon la qualité demandée au rendu.
+FILTRES = {'rapide': Image.Resampling.BILINEAR, 'qualite': Image.Resampling.LANCZOS}
+
+# Facteur de réduction maximal au décodage, celui de la mise à l'échelle DCT des JPEG.
+REDUCTION_MAX = 8
+
+# Demi-largeur maximale, en pixels source, des filtres de FILTRES (celle de LANCZOS).
+SUPPORT_FILTRE = 3
+
+# Pas, en pixels de la tuile, du nombre de pixels de la tuile par pixel d'affichage. Multiple de ce
+# pas, ce nombre rend exacts les calculs de coordonnées de Image.resize : un pixel d'affichage est
+# calculé de la même façon quelle que soit l'origine de la zone composée.
+PAS_SOURCE = 2 ** -16
+
+# Agrandissement maximal d'une résolution à l'affichage avant de passer à une résolution supérieure.
+ECHELLE_MAX = 1.3
+
+
+def facteur_reduction(echelle):
+	''' Renvoie la plus grande puissance de deux r, au plus REDUCTION_MAX, telle que r * echelle <= 1.
+		Une tuile décodée avec ce facteur est encore réduite, et non agrandie, à l'affichage.
+	'''
+	reduction = 1
+	while reduction < REDUCTION_MAX and echelle * reduction * 2 <= 1:
+		reduction *= 2
+	return reduction
+
+
+def bord_tuile(indice, dimension, fin):
+	''' Renvoie le bord gauche (ou haut) d'une tuile à l'affichage, en pixels entiers ; c'est aussi
+		le bord droit (ou bas) de la tuile précédente.
+
+		Args:
+		 - indice : indice de la tuile dans sa rangée (ou sa colonne) ;
+		 - dimension : largeur (ou hauteur) nominale d'une tuile, en pixels d'affichage ;
+		 - fin : largeur (ou hauteur) de l'image complète, en pixels d'affichage.
+	'''
+	return int(min(indice * dimension, fin))
+
+
+def choisir_resolution(largeurs, largeur_affichee, echelle_max=ECHELLE_MAX):
+	''' Choisit la résolution la moins coûteuse offrant une densité de pixels suffisante à l'affichage.
+
+		Les résolutions sont comparées par la largeur de leur image complète, sans supposer de rapport
+		fixe entre deux résolutions voisines : un zoom important passe directement à la résolution
+		adaptée, quel que soit le nombre de résolutions intermédiaires.
+
+		Args:
+		 - largeurs : dictionnaire {résolution : largeur de l'image complète, en pixels} ;
+		 - largeur_affichee : largeur de l'image complète à l'affichage, en pixels d'affichage ;
+		 - echelle_max : agrandissement maximal toléré d'une résolution.
+
+		Returns:
+		 - resolution : la résolution de plus petite largeur affichée avec une échelle d'au plus
+		   echelle_max, ou la plus grande résolution si aucune ne convient.
+	'''
+	niveaux = sorted(largeurs, key=lambda niveau: largeurs[niveau])
+	for niveau in niveaux:
+		if largeur_affichee <= largeurs[niveau] * echelle_max:
+			return niveau
+	return niveaux[-1]
+
+
+def calculer_vue(bbox_image, bbox_visible):
+	''' Calcule la zone d'interaction et la partie visible de l'image complète.
+
+		Args:
+		 - bbox_image : boîte (x1, y1, x2, y2) de l'image complète, en coordonnées d'affichage,
+		   déjà réduite d'un pixel de chaque côté ;
+		 - bbox_visible : boîte de la zone visible, dans les mêmes coordonnées.
+
+		Returns:
+		 - bbox : zone d'interaction (zone de défilement) ;
+		 - zone : boîte (x1, y1, x2, y2) de la partie visible, relative au coin haut-gauche de l'image ;
+		 - ratios : position (xratio, yratio), entre 0.0 et 1.0, de la partie visible dans la zone d'interaction.
+	'''
+	bbox = [min(bbox_image[0], bbox_visible[0]), min(bbox_image[1], bbox_visible[1]),
+			max(bbox_image[2], bbox_visible[2]), max(bbox_image[3], bbox_visible[3])]
+
+	# Ajustements.
+	if bbox[0] == bbox_visible[0] and bbox[2] == bbox_visible[2]:
+		bbox[0] = bbox_image[0]
+		bbox[2] = bbox_image[2]
+	if bbox[1] == bbox_visible[1] and bbox[3] == bbox_visible[3]:
+		bbox[1] = bbox_image[1]
+		bbox[3] = bbox_image[3]
+
+	x1 = max(bbox_visible[0] - bbox_image[0], 0)
+	y1 = max(bbox_visible[1] - bbox_image[1], 0)
+	x2 = min(bbox_visible[2], bbox_image[2]) - bbox_image[0]
+	y2 = min(bbox_visible[3], bbox_image[3]) - bbox_image[1]
+
+	ratios = (x1 / (bbox[2] - bbox[0]), y1 / (bbox[3] - bbox[1]))
+	return bbox, (x1, y1, x2, y2), ratios
+
+
+class MoteurRendu:
+	''' Composition de la partie visible d'une résolution à partir de ses tuiles. '''
+
+	def __init__(self, pyramide, cache, prechargeur=None, chrono=None):
+		''' Initialise le moteur.
+
+			Args:
+			 - pyramide : pyramide de tuiles (voir pyramide.ouvrir_pyramide) ;
+			 - cache : cache des tuiles décodées (CacheTuiles) ;
+			 - prechargeur : préchargeur des tuiles voisines (Prechargeur), ou None ;
+			 - chrono : chronomètre mesurant les étapes du rendu (voir instrumentation.py), ou None.
+		'''
+		self.pyramide = pyramide
+		self.index = pyramide.index
+		self.cache = cache
+		self.prechargeur = prechargeur
+		self.chrono = chrono if chrono is not None else Chronometre()
+		# Tuiles de la résolution la plus faible, conservées hors du cache (voir charger_vignettes).
+		self.vignettes = {}
+		# Indique si le dernier rendu a utilisé toutes les tuiles de la résolution demandée.
+		self.complet = True
+		# Résolution et échelle du dernier rendu, qui fixent le facteur de réduction des tuiles.
+		self.vue = None
+		# Décale le rendu précédent lors d'une translation plutôt que de recomposer toute la zone.
+		self.incremental = True
+		# Dernier rendu complet : (cadre, résolution, échelle, filtre, origine entière de la zone).
+		self._precedent = None
+
+
+	def reduction_voulue(self, resolution):
+		''' Renvoie le facteur de réduction avec lequel décoder les tuiles d'une résolution, d'après
+			l'échelle du dernier rendu. Les tuiles des résolutions voisines, préchargées, sont décodées
+			pour être affichées à la même taille.
+		'''
+		if self.vue is None:
+			return 1
+		resolution_vue, echelle = self.vue
+		return facteur_reduction(echelle * self.etendue(resolution_vue)[0] / self.etendue(resolution)[0])
+
+
+	def lire_tuile(self, resolution, x, y, reduction=None):
+		''' Lit et décode une tuile de la pyramide, sans passer par le cache.
+			Peut être appelée depuis les threads de préchargement.
+
+			Args:
+			 - resolution, x, y : résolution et indices de la tuile ;
+			 - reduction : facteur de réduction au décodage, par défaut reduction_voulue(resolution).
+
+			Returns:
+			 - image : tuile décodée, image PIL ou tableau numpy ; une tuile absente est remplacée
+			   par une tuile grise.
+		'''
+		if reduction is None:
+			reduction = self.reduction_voulue(resolution)
+		with self.chrono.mesure('decodage'):
+			image = self.pyramide.ouvrir_tuile(resolution, x, y, reduction)
+		if image is None:
+			return Image.new('RGB', self.pyramide.taille_tuile(resolution), (128, 128, 128))
+		return image
+
+
+	def est_a_jour(self, cle):
+		''' Indique si une tuile est dans le cache avec un facteur de réduction suffisant pour
+			l'échelle affichée. Une tuile décodée trop petite, avant un zoom avant, doit être relue.
+		'''
+		tuile = self.cache.consulter(cle)
+		return tuile is not None and reduction_tuile(tuile) <= self.reduction_voulue(cle[0])
+
+
+	def charger_tuile(self, resolution, x, y):
+		''' Renvoie une tuile décodée.
+			La tuile est lue seulement si elle est absente du cache, ou trop réduite, et n'est pas déjà
+			en cours de préchargement.
+		'''
+		cle = (resolution, x, y)
+		if self.prechargeur is not None and not self.est_a_jour(cle):
+			self.prechargeur.attendre(cle)
+		if cle in self.cache and not self.est_a_jour(cle):
+			self.cache.retirer(cle)
+		return self.cache.obtenir(cle, lambda: self.lire_tuile(*cle))
+
+
+	def etendue(self, resolution):
+		''' Renvoie la taille (largeur, hauteur) de l'image complète d'une résolution, en pixels. '''
+		return self.index.etendue(resolution) or (resolution, resolution)
+
+
+	def choisir_resolution(self, largeur_affichee, echelle_max=ECHELLE_MAX):
+		''' Choisit parmi les résolutions de l'index (voir choisir_resolution). '''
+		return choisir_resolution({niveau: self.etendue(niveau)[0] for niveau in self.index.niveaux()},
+			largeur_affichee, echelle_max)
+
+
+	def taille_tuile(self, resolution):
+		''' Renvoie la taille nominale (largeur, hauteur) d'une tuile, en pixels de la résolution. '''
+		if self.index.etendue(resolution) is not None:
+			return self.pyramide.taille_tuile(resolution)
+		dimX, dimY = self.index.dimensions(resolution)
+		return (resolution / (dimX + 1), resolution / (dimY + 1))
+
+
+	def tuiles_visibles(self, resolution, zone, echelle):
+		''' Détermine les indices extrêmes des tuiles couvrant une zone.
+
+			Args:
+			 - resolution : résolution affichée ;
+			 - zone : boîte (x1, y1, x2, y2) en pixels d'affichage ;
+			 - echelle : nombre de pixels d'affichage par pixel de la résolution.
+
+			Returns:
+			 - (tx1, ty1, tx2, ty2) : indices des tuiles haut-gauche et bas-droit.
+		'''
+		dimX, dimY = self.index.dimensions(resolution)
+		largeur, hauteur = self.taille_tuile(resolution)
+		x1, y1, x2, y2 = zone
+		return (max(int(x1 // (largeur * echelle)), 0), max(int(y1 // (hauteur * echelle)), 0),
+				min(int(x2 // (largeur * echelle)), dimX), min(int(y2 // (hauteur * echelle)), dimY))
+
+
+	def charger_vignettes(self, tuiles_max=16, delai=None):
+		''' Charge, une fois pour toutes, les tuiles de la résolution la plus faible.
+			Elles servent de dernier recours au rendu progressif et ne sont jamais évincées.
+
+			Args:
+			 - tuiles_max : nombre de tuiles au-delà duquel la résolution n'est pas chargée ;
+			 - delai : durée maximale, en secondes, du chargement dans le thread appelant ; les
+			   tuiles restantes sont chargées par un thread en arrière-plan. None : aucune limite.
+		'''
+		resolution = self.index.niveaux()[0]
+		restantes = sorted(self.index.tuiles(resolution))
+		if len(restantes) > tuiles_max:
+			return
+		fin = None if delai is None else time.perf_counter() + delai
+		while restantes and (fin is None or time.perf_counter() < fin):
+			x, y = restantes.pop(0)
+			self.vignettes[(resolution, x, y)] = self.lire_tuile(resolution, x, y, 1)
+		if restantes:
+			threading.Thread(target=self._charger_vignettes, args=(resolution, restantes),
+				name='vignettes', daemon=True).start()
+
+
+	def _charger_vignettes(self, resolution, restantes):
+		''' Charge en arrière-plan les vignettes non chargées dans le délai imparti. '''
+		for x, y in restantes:
+			self.vignettes[(resolution, x, y)] = self.lire_tuile(resolution, x, y, 1)
+
+
+	def tuile_disponible(self, resolution, x, y):
+		''' Renvoie une tuile déjà décodée, sans jamais la lire.
+
+			Returns:
+			 - image : tuile du cache ou des vignettes, ou None si elle n'est pas encore décodée.
+		'''
+		cle = (resolution, x, y)
+		if cle in self.cache:
+			return self.cache.obtenir(cle)
+		return self.vignettes.get(cle)
+
+
+	def est_disponible(self, resolution, x, y):
+		''' Indique si une tuile est déjà décodée, dans le cache ou parmi les vignettes. '''
+		cle = (resolution, x, y)
+		return cle in self.cache or cle in self.vignettes
+
+
+	def rendre(self, resolution, zone, echelle, tableau=False, progressif=False, qualite='qualite', cadre=None):
+		''' Compose l'image d'une zone de la résolution donnée.
+
+			En mode progressif, les tuiles absentes du cache ne sont pas attendues : leur chargement
+			est demandé au préchargeur et la zone qu'elles couvrent est remplie à partir de la
+			résolution inférieure déjà décodée la plus proche, agrandie. Une tuile décodée trop réduite
+			pour l'échelle affichée est utilisée en attendant d'être relue. L'attribut complet indique
+			ensuite si toutes les tuiles de la résolution demandée ont été utilisées.
+
+			Args:
+			 - resolution : résolution affichée ;
+			 - zone : boîte (x1, y1, x2, y2) en pixels d'affichage ;
+			 - echelle : nombre de pixels d'affichage par pixel de la résolution ;
+			 - tableau : renvoie un tableau numpy plutôt qu'une image PIL ;
+			 - progressif : n'attend pas le décodage des tuiles absentes du cache ;
+			 - qualite : 'rapide' ou 'qualite', choix du filtre de redimensionnement (voir FILTRES) ;
+			 - cadre : image RGB du rendu précédent, réutilisée si elle a la taille de la zone ; évite
+			   d'allouer une nouvelle image à chaque rendu. Lors d'une translation, son contenu est
+			   décalé et seules les bandes nouvellement visibles sont composées (voir bandes_exposees).
+
+			Returns:
+			 - cadre : image RGB de int(x2) - int(x1) par int(y2) - int(y1) pixels.
+		'''
+		self.vue = (resolution, echelle)
+		filtre = FILTRES[qualite]
+		x1, y1, x2, y2 = zone
+		taille = (max(int(x2) - int(x1), 0), max(int(y2) - int(y1), 0))
+		tx1, ty1, tx2, ty2 = self.tuiles_visibles(resolution, zone, echelle)
+
+		# Précharge les tuiles visibles, leurs voisines et celles des résolutions voisines.
+		if self.prechargeur is not None:
+			self.prechargeur.demander(resolution, tx1, ty1, tx2, ty2)
+
+		origine = (int(x1), int(y1))
+		bandes = self.bandes_exposees(cadre, resolution, echelle, filtre, origine, taille)
+		if bandes is None:
+			if cadre is None or cadre.size != taille or cadre.mode != 'RGB':
+				cadre = Image.new('RGB', taille)
+			else:
+				cadre.paste((0, 0, 0), (0, 0) + taille)
+			bandes = [(0, 0) + taille]
+
+		self.complet = True
+		for gauche, haut, droite, bas in bandes:
+			# Une bande est composée dans sa propre image, puis collée à sa place dans le cadre.
+			bande = cadre if (droite - gauche, bas - haut) == taille else Image.new('RGB', (droite - gauche, bas - haut))
+			self.composer_zone(bande, resolution, (x1 + gauche, y1 + haut, x1 + droite, y1 + bas), echelle,
+				progressif, filtre)
+			if bande is not cadre:
+				cadre.paste(bande, (gauche, haut))
+
+		# Seul un rendu complet peut être décalé lors du rendu suivant.
+		self._precedent = (cadre, resolution, echelle, filtre, origine) if self.complet else None
+
+		if tableau:
+			return np.asarray(cadre)
+		return cadre
+
+
+	def bandes_exposees(self, cadre, resolution, echelle, filtre, origine, taille):
+		''' Décale le rendu précédent d'une translation et renvoie les bandes à composer.
+
+			Args:
+			 - cadre : cadre fourni à rendre() ;
+			 - resolution, echelle, filtre : paramètres du rendu demandé ;
+			 - origine : coin haut-gauche entier de la zone demandée, en pixels d'affichage ;
+			 - taille : taille de la zone demandée.
+
+			Le rendu précédent n'est réutilisé que s'il a été composé avec la même résolution, la même
+			échelle et le même filtre : composer() ne dépendant pas de l'origine de la zone, le cadre
+			décalé et complété est alors identique à un rendu complet.
+
+			Returns:
+			 - bandes : boîtes (gauche, haut, droite, bas) du cadre nouvellement visibles, ou None si
+			   le rendu précédent ne peut pas être réutilisé et que toute la zone doit être composée.
+		'''
+		if not self.incremental or self._precedent is None or cadre is None:
+			return None
+		precedent, resolution_precedente, echelle_precedente, filtre_precedent, (px, py) = self._precedent
+		largeur, hauteur = taille
+		dx, dy = origine[0] - px, origine[1] - py
+		if (precedent is not cadre or cadre.size != taille or resolution != resolution_precedente
+				or echelle != echelle_precedente or filtre != filtre_precedent
+				or abs(dx) >= largeur or abs(dy) >= hauteur):
+			return None
+
+		# Partie commune aux deux rendus, en coordonnées du nouveau cadre.
+		gauche, haut = max(-dx, 0), max(-dy, 0)
+		droite, bas = min(largeur - dx, largeur), min(hauteur - dy, hauteur)
+		if dx or dy:
+			with self.chrono.mesure('defilement'):
+				commune = cadre.crop((gauche + dx, haut + dy, droite + dx, bas + dy))
+				cadre.paste(commune, (gauche, haut))
+
+		bandes = []
+		if dx:
+			bandes.append((droite, 0, largeur, hauteur) if dx > 0 else (0, 0, gauche, hauteur))
+		if dy:
+			bandes.append((gauche, bas, droite, hauteur) if dy > 0 else (gauche, 0, droite, haut))
+		return bandes
+
+
+	def composer_zone(self, cadre, resolution, zone, echelle, progressif, filtre):
+		''' Compose une zone de la résolution demandée, en attendant ou non les tuiles absentes du
+			cache (voir rendre()). Met à jour l'attribut complet.
+		'''
+		tx1, ty1, tx2, ty2 = self.tuiles_visibles(resolution, zone, echelle)
+		if not progressif or self.prechargeur is None:
+			self.composer(cadre, resolution, zone, echelle, self.charger_tuile, filtre)
+			return
+		absentes = [(tx, ty) for tx in range(tx1, tx2 + 1) for ty in range(ty1, ty2 + 1)
+					if not self.est_a_jour((resolution, tx, ty)) and (resolution, tx, ty) not in self.vignettes]
+		if absentes:
+			self.complet = False
+			# Fond provisoire : résolution inférieure la plus proche dont les tuiles sont décodées.
+			for inferieure in reversed([n for n in self.index.niveaux() if n < resolution]):
+				echelle_inferieure = echelle * self.etendue(resolution)[0] / self.etendue(inferieure)[0]
+				bx1, by1, bx2, by2 = self.tuiles_visibles(inferieure, zone, echelle_inferieure)
+				if all(self.est_disponible(inferieure, tx, ty)
+					   for tx in range(bx1, bx2 + 1) for ty in range(by1, by2 + 1)):
+					self.composer(cadre, inferieure, zone, echelle_inferieure, self.tuile_disponible, filtre)
+					break
+		self.composer(cadre, resolution, zone, echelle, self.tuile_disponible, filtre)
+
+
+	def composer(self, cadre, resolution, zone, echelle, obtenir, filtre=FILTRES['qualite']):
+		''' Dessine dans un cadre les tuiles d'une résolution couvrant une zone.
+
+			Les bords des tuiles à l'affichage sont arrondis par une même fonction : le bord droit d'une
+			tuile est le bord gauche de sa voisine, sans espace entre elles. Une partie de tuile, même
+			plus étroite qu'un pixel de la tuile, est toujours dessinée. Chaque pixel du cadre est
+			calculé d'après sa seule position dans l'image complète, et non d'après l'origine de la
+			zone : composer une zone par bandes donne le même résultat que la composer en entier.
+
+			Args:
+			 - cadre : image de la taille de la zone, modifiée sur place ;
+			 - resolution, zone, echelle : voir rendre() ;
+			 - obtenir : fonction (résolution, x, y) renvoyant une tuile, ou None pour la laisser de côté ;
+			 - filtre : filtre de redimensionnement de Pillow.
+		'''
+		x1, y1, x2, y2 = zone
+		tx1, ty1, tx2, ty2 = self.tuiles_visibles(resolution, zone, echelle)
+		origine = (int(x1), int(y1))
+
+		# Taille des tuiles et de l'image complète à l'affichage.
+		largeur, hauteur = self.taille_tuile(resolution)
+		titleDimX = largeur * echelle
+		titleDimY = hauteur * echelle
+		finX, finY = (cote * echelle for cote in self.etendue(resolution))
+
+		for tx in range(tx1, tx2 + 1):
+			# Bords de la tuile, puis de sa partie visible, en pixels d'affichage entiers.
+			gx1, gx2 = bord_tuile(tx, titleDimX, finX), bord_tuile(tx + 1, titleDimX, finX)
+			vx1, vx2 = max(gx1, origine[0]), min(gx2, int(x2))
+			if vx2 <= vx1:
+				continue
+			for ty in range(ty1, ty2 + 1):
+				gy1, gy2 = bord_tuile(ty, titleDimY, finY), bord_tuile(ty + 1, titleDimY, finY)
+				vy1, vy2 = max(gy1, origine[1]), min(gy2, int(y2))
+				if vy2 <= vy1:
+					continue
+
+				tuile = obtenir(resolution, tx, ty)
+				if tuile is None:
+					continue
+				# Partie de la tuile à afficher, en pixels de la tuile décodée (éventuellement réduite) :
+				# la tuile entière occupe ses bords arrondis, au pas PAS_SOURCE près.
+				largeur_tuile, hauteur_tuile = taille_pixels(tuile)
+				sx = math.floor(largeur_tuile / (gx2 - gx1) / PAS_SOURCE) * PAS_SOURCE
+				sy = math.floor(hauteur_tuile / (gy2 - gy1) / PAS_SOURCE) * PAS_SOURCE
+				boite = ((vx1 - gx1) * sx, (vy1 - gy1) * sy, (vx2 - gx1) * sx, (vy2 - gy1) * sy)
+				# Seuls les pixels lus par le filtre sont découpés : la boîte, d'au moins un pixel,
+				# élargie du support du filtre.
+				marge_x, marge_y = int(SUPPORT_FILTRE * max(sx, 1)) + 1, int(SUPPORT_FILTRE * max(sy, 1)) + 1
+				partie = (max(int(boite[0]) - marge_x, 0), max(int(boite[1]) - marge_y, 0),
+					min(int(boite[2]) + 1 + marge_x, largeur_tuile), min(int(boite[3]) + 1 + marge_y, hauteur_tuile))
+				with self.chrono.mesure('decoupage'):
+					image = decouper(tuile, partie)
+				with self.chrono.mesure('redimensionnement'):
+					image = image.resize((vx2 - vx1, vy2 - vy1), filtre,
+						box=(boite[0] - partie[0], boite[1] - partie[1], boite[2] - partie[0], boite[3] - partie[1]))
+				with self.chrono.mesure('collage'):
+					cadre.paste(image, (vx1 - origine[0], vy1 - origine[1]))
@@ -0,0 +1,158 @@
+'''
+Préchargement en arrière-plan des tuiles voisines de la zone affichée.
+
+Un groupe de threads décode, avant qu'elles ne soient visibles, les tuiles entourant la zone affichée
+ainsi que les tuiles correspondantes des résolutions voisines (par défaut double et moitié, sinon
+celles qui précèdent et suivent la résolution affichée dans l'index). Les tuiles décodées
+sont placées dans le cache partagé ; le thread principal est prévenu par une file qu'il vide lui-même,
+aucun objet tkinter n'est manipulé par les threads de préchargement.
+
+'''
+
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Prechargeur:
+	''' Groupe de threads chargeant les tuiles proches de la zone affichée dans le cache. '''
+
+	def __init__(self, cache, charger, dimensions, nb_threads=4, marge=1, present=None, voisines=None):
+		''' Initialise le préchargeur.
+
+			Args:
+			 - cache : cache des tuiles décodées (CacheTuiles) ;
+			 - charger : fonction (résolution, x, y) renvoyant la tuile décodée ;
+			 - dimensions : fonction (résolution) renvoyant les indices maximaux (dimX, dimY)
+			   de la matrice des tuiles, ou None si la résolution n'existe pas ;
+			 - nb_threads : nombre de threads de décodage ;
+			 - marge : nombre de tuiles à précharger autour de la zone affichée ;
+			 - present : fonction (clé) indiquant si une tuile du cache convient, par défaut sa seule
+			   présence dans le cache ;
+			 - voisines : fonction (résolution) renvoyant les résolutions voisines à précharger, par
+			   défaut le double et la moitié de la résolution.
+		'''
+		self.cache = cache
+		self.charger = charger
+		self.dimensions = dimensions
+		self.marge = marge
+		self.present = present if present is not None else cache.__contains__
+		self.voisines = voisines if voisines is not None else lambda resolution: (resolution * 2, resolution // 2)
+		# Tuiles décodées, en attente d'être signalées au thread principal.
+		self.terminees = queue.Queue()
+		self._executeur = ThreadPoolExecutor(max_workers=nb_threads, thread_name_prefix='prechargement')
+		self._demandes = {}
+		self._verrou = threading.Lock()
+
+
+	def demander(self, resolution, tx1, ty1, tx2, ty2):
+		''' Demande le préchargement des tuiles autour d'une zone affichée.
+			Les demandes précédentes qui ne sont plus utiles et qui n'ont pas commencé sont annulées.
+
+			Args:
+			 - resolution : résolution affichée ;
+			 - tx1, ty1, tx2, ty2 : indices des tuiles haut-gauche et bas-droit affichées.
+		'''
+		voulues = self.tuiles_voisines(resolution, tx1, ty1, tx2, ty2)
+		with self._verrou:
+			# Annule les demandes devenues inutiles.
+			for cle in list(self._demandes):
+				if cle not in voulues and self._demandes[cle].cancel():
+					del self._demandes[cle]
+			# L'ordre de soumission donne la priorité aux tuiles de la résolution affichée.
+			for cle in voulues:
+				if cle in self._demandes or self.present(cle):
+					continue
+				self._demandes[cle] = self._executeur.submit(self._charger, cle)
+
+
+	def tuiles_voisines(self, resolution, tx1, ty1, tx2, ty2):
+		''' Détermine les tuiles à précharger, par ordre de priorité.
+
+			Args:
+			 - resolution : résolution affichée ;
+			 - tx1, ty1, tx2, ty2 : indices des tuiles haut-gauche et bas-droit affichées.
+
+			Returns:
+			 - voulues : dictionnaire ordonné des clés (résolution, x, y) à précharger.
+		'''
+		voulues = {}
+		dimensions = self.dimensions(resolution)
+		if dimensions is None:
+			return voulues
+		dimX, dimY = dimensions
+
+		# Tuiles affichées en premier, pour le rendu progressif, puis couronne autour de la zone affichée.
+		for x in range(tx1, tx2 + 1):
+			for y in range(ty1, ty2 + 1):
+				voulues[(resolution, x, y)] = None
+		for x in range(max(tx1 - self.marge, 0), min(tx2 + self.marge, dimX) + 1):
+			for y in range(max(ty1 - self.marge, 0), min(ty2 + self.marge, dimY) + 1):
+				voulues[(resolution, x, y)] = None
+
+		# Tuiles couvrant la même zone dans les résolutions voisines.
+		for voisine in self.voisines(resolution):
+			dim = self.dimensions(voisine)
+			if dim is None:
+				continue
+			# Passage par la position relative dans l'image complète virtuelle.
+			rx = (dim[0] + 1) / (dimX + 1)
+			ry = (dim[1] + 1) / (dimY + 1)
+			for x in range(int(tx1 * rx), min(int((tx2 + 1) * rx - 1e-9), dim[0]) + 1):
+				for y in range(int(ty1 * ry), min(int((ty2 + 1) * ry - 1e-9), dim[1]) + 1):
+					voulues[(voisine, x, y)] = None
+		return voulues
+
+
+	def _charger(self, cle):
+		''' Décode une tuile dans un thread de préchargement et la place dans le cache. '''
+		try:
+			if not self.present(cle):
+				self.cache.ajouter(cle, self.charger(*cle))
+			self.terminees.put(cle)
+		finally:
+			with self._verrou:
+				self._demandes.pop(cle, None)
+
+
+	def attendre(self, cle):
+		''' Attend la fin du chargement d'une tuile en cours de préchargement.
+			Évite de décoder deux fois la même tuile dans le thread principal.
+
+			Args:
+			 - cle : triplet (résolution, x, y) de la tuile.
+
+			Returns:
+			 - True : la tuile était en cours de chargement et se trouve maintenant dans le cache ;
+			 - False : la tuile n'était pas demandée ou sa demande a été annulée.
+		'''
+		with self._verrou:
+			demande = self._demandes.get(cle)
+			# Une demande qui n'a pas commencé est annulée : le thread principal la chargera lui-même.
+			if demande is None or demande.cancel():
+				self._demandes.pop(cle, None)
+				return False
+		try:
+			demande.result()
+		except Exception:
+			return False
+		return True
+
+
+	def recuperer(self):
+		''' Vide la file des tuiles préchargées. À appeler depuis le thread principal.
+
+			Returns:
+			 - cles : liste des clés (résolution, x, y) des tuiles chargées depuis le dernier appel.
+		'''
+		cles = []
+		while True:
+			try:
+				cles.append(self.terminees.get_nowait())
+			except queue.Empty:
+				return cles
+
+
+	def arreter(self):
+		''' Annule les demandes en attente et arrête les threads de préchargement. '''
+		self._executeur.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,488 @@
+'''
+Index de la pyramide d'images.
+
+Les tuiles d'une pyramide sont nommées nom_<résolution>_<x>_<y>.ext. L'index est construit une seule
+fois à partir de la liste des fichiers du répertoire ; il associe à chaque résolution la grille de ses
+tuiles, ce qui permet de retrouver une tuile sans parcourir de nouveau le répertoire.
+
+Une pyramide peut être stockée dans un répertoire, à raison d'un fichier par tuile, ou dans un
+conteneur à fichier unique (voir conteneur.py) ; ouvrir_pyramide() renvoie dans les deux cas un objet
+offrant les mêmes méthodes.
+
+Un répertoire de tuiles est accompagné d'un manifeste (fichier pyramide.json) décrivant ses
+résolutions, la grille et la taille des tuiles de chacune : une pyramide déjà ouverte une fois est
+rouverte sans lister le répertoire ni ouvrir de tuile, ce qui compte sur un partage réseau. Le
+manifeste est écrit à la première ouverture, par construction_pyramide.py ou par ce script, et
+ignoré dès que le répertoire a été modifié après son écriture (tuile ajoutée, supprimée ou renommée),
+ou que l'une des tuiles dont il tire la taille des tuiles et des images complètes (tuile (0, 0),
+dernières tuiles de la première ligne et de la première colonne) a été réécrite depuis. Une autre
+tuile réécrite sur place ne modifie ni le répertoire ni le manifeste, dont le contenu reste exact.
+
+L'image complète d'une résolution est, par convention, un carré dont le côté est la résolution. Une
+pyramide peut aussi décrire des images complètes rectangulaires, de taille quelconque : les tuiles de
+la dernière colonne et de la dernière ligne sont alors plus petites, et l'index associe à chaque
+résolution la taille de son image complète (voir etendue_grille).
+
+Arguments (écriture du manifeste):
+ - Répertoire des tuiles.
+
+Exemple:
+ python pyramide.py nomdudossiercontenantlesimages/
+
+'''
+
+import argparse
+import json
+import mimetypes
+import os
+
+import numpy as np
+from PIL import Image
+
+
+# Nom du manifeste d'un répertoire de tuiles.
+MANIFESTE = 'pyramide.json'
+VERSION_MANIFESTE = 1
+
+
+def analyser_nom(nom):
+	''' Extrait la résolution et les indices d'une tuile à partir de son nom.
+
+		Args:
+		 - nom : nom du fichier, de la forme nom_<résolution>_<x>_<y>.ext.
+
+		Returns:
+		 - (resolution, x, y) : entiers extraits du nom, ou None si le nom ne suit pas ce format.
+	'''
+	split = os.path.splitext(nom)[0].rsplit('_', 3)
+	if len(split) != 4:
+		return None
+	try:
+		return int(split[1]), int(split[2]), int(split[3])
+	except ValueError:
+		return None
+
+
+def etendue_grille(resolution, dimensions, taille, derniere):
+	''' Calcule la taille de l'image complète d'une résolution à partir de la taille de ses tuiles.
+
+		Args:
+		 - resolution : résolution ;
+		 - dimensions : indices maximaux (dimX, dimY) de la grille ;
+		 - taille : taille (largeur, hauteur) de la tuile (0, 0) ;
+		 - derniere : largeur des tuiles de la dernière colonne et hauteur de celles de la dernière ligne.
+
+		Returns:
+		 - (largeur, hauteur) : taille de l'image complète, ou None pour une grille de tuiles
+		   identiques couvrant le carré de côté la résolution (convention par défaut).
+	'''
+	dimX, dimY = dimensions
+	largeur = taille[0] * dimX + derniere[0]
+	hauteur = taille[1] * dimY + derniere[1]
+	if (abs(derniere[0] - taille[0]) <= 1 and abs(derniere[1] - taille[1]) <= 1
+			and abs(largeur - resolution) <= dimX + 1 and abs(hauteur - resolution) <= dimY + 1):
+		return None
+	return (largeur, hauteur)
+
+
+class IndexPyramide:
+	''' Index des tuiles d'une pyramide, par résolution puis par indices (x, y). '''
+
+	def __init__(self, images, etendues=None):
+		''' Construit l'index.
+
+			Args:
+			 - images : noms des fichiers de la pyramide ; les fichiers dont le nom ne suit pas
+			   le format nom_<résolution>_<x>_<y>.ext sont ignorés ;
+			 - etendues : dictionnaire {résolution: (largeur, hauteur)} de la taille des images
+			   complètes qui ne sont pas le carré de côté la résolution.
+		'''
+		self._etendues = {int(resolution): tuple(etendue) for resolution, etendue in (etendues or {}).items()}
+		self._tuiles = {}
+		self._dimensions = {}
+		for image in images:
+			analyse = analyser_nom(image)
+			if analyse is None:
+				continue
+			resolution, x, y = analyse
+			self._tuiles.setdefault(resolution, {})[(x, y)] = image
+			dimX, dimY = self._dimensions.get(resolution, (0, 0))
+			self._dimensions[resolution] = (max(dimX, x), max(dimY, y))
+		self._niveaux = sorted(self._tuiles)
+
+
+	@classmethod
+	def depuis_repertoire(cls, repertoire):
+		''' Construit l'index à partir du contenu d'un répertoire. '''
+		return cls(os.listdir(repertoire))
+
+
+	def __contains__(self, resolution):
+		return resolution in self._tuiles
+
+
+	def niveaux(self):
+		''' Renvoie la liste croissante des résolutions disponibles. '''
+		return list(self._niveaux)
+
+
+	def voisines(self, resolution):
+		''' Renvoie les résolutions qui précèdent et suivent une résolution dans l'index, quel que
+			soit le rapport entre elles.
+		'''
+		if resolution not in self._tuiles:
+			return []
+		i = self._niveaux.index(resolution)
+		return self._niveaux[i + 1:i + 2] + self._niveaux[max(i - 1, 0):i]
+
+
+	def dimensions(self, resolution):
+		''' Renvoie les indices maximaux (dimX, dimY) de la grille d'une résolution.
+
+			Returns:
+			 - (dimX, dimY) : la grille compte dimX + 1 colonnes et dimY + 1 lignes ;
+			 - None : la résolution n'existe pas.
+		'''
+		return self._dimensions.get(resolution)
+
+
+	def etendue(self, resolution):
+		''' Renvoie la taille (largeur, hauteur) de l'image complète d'une résolution, ou None si
+			elle suit la convention par défaut (carré de côté la résolution).
+		'''
+		return self._etendues.get(resolution)
+
+
+	def definir_etendues(self, etendues):
+		''' Enregistre la taille des images complètes rectangulaires, déterminée après la construction
+			de l'index (voir PyramideRepertoire.etendues_tuiles).
+		'''
+		self._etendues = {int(resolution): tuple(etendue) for resolution, etendue in etendues.items()}
+
+
+	def etendues(self):
+		''' Renvoie le dictionnaire {résolution: (largeur, hauteur)} des images complètes qui ne
+			suivent pas la convention par défaut.
+		'''
+		return dict(self._etendues)
+
+
+	def tuile(self, resolution, x, y):
+		''' Renvoie le nom du fichier d'une tuile.
+
+			Returns:
+			 - nom : nom du fichier, ou None si la tuile est absente.
+		'''
+		return self._tuiles.get(resolution, {}).get((x, y))
+
+
+	def tuiles(self, resolution):
+		''' Renvoie le dictionnaire {(x, y): nom} des tuiles présentes à une résolution. '''
+		return dict(self._tuiles.get(resolution, {}))
+
+
+	def manquantes(self, resolution):
+		''' Renvoie la liste des indices (x, y) absents de la grille d'une résolution. '''
+		if resolution not in self._dimensions:
+			return []
+		dimX, dimY = self._dimensions[resolution]
+		grille = self._tuiles[resolution]
+		return [(x, y) for x in range(dimX + 1) for y in range(dimY + 1) if (x, y) not in grille]
+
+
+def lire_manifeste(repertoire):
+	''' Lit le manifeste d'un répertoire de tuiles.
+
+		Returns:
+		 - (index, tailles) : index de la pyramide et dictionnaire {résolution: (largeur, hauteur)}
+		   de la taille de ses tuiles ; None si le manifeste est absent, illisible ou plus ancien
+		   que la dernière modification du répertoire ou que l'une des tuiles dont il tire la taille
+		   des tuiles et des images complètes.
+	'''
+	chemin = os.path.join(repertoire, MANIFESTE)
+	try:
+		date = os.stat(chemin).st_mtime_ns
+		if os.stat(repertoire).st_mtime_ns > date:
+			return None
+		with open(chemin, 'r') as fichier:
+			manifeste = json.load(fichier)
+	except (OSError, ValueError):
+		return None
+	if manifeste.get('version') != VERSION_MANIFESTE:
+		return None
+
+	noms = []
+	tailles = {}
+	etendues = {}
+	for resolution, niveau in manifeste['niveaux'].items():
+		resolution = int(resolution)
+		tailles[resolution] = tuple(niveau['taille_tuile'])
+		if 'etendue' in niveau:
+			etendues[resolution] = tuple(niveau['etendue'])
+		if 'noms' in niveau:
+			noms.extend(niveau['noms'])
+			continue
+		# Grille régulière : noms reconstitués à partir du préfixe et de l'extension.
+		dimX, dimY = niveau['dimensions']
+		manquantes = {tuple(indices) for indices in niveau['manquantes']}
+		modele = "%s_%d_%%d_%%d%s" % (niveau['prefixe'], resolution, niveau['extension'])
+		noms.extend(modele % (x, y) for x in range(dimX + 1) for y in range(dimY + 1) if (x, y) not in manquantes)
+	index = IndexPyramide(noms, etendues)
+
+	# Une tuile réécrite sur place ne modifie pas la date du répertoire : les tuiles qui fixent la
+	# taille des tuiles et des images complètes sont vérifiées une à une.
+	for resolution in index.niveaux():
+		dimX, dimY = index.dimensions(resolution)
+		for x, y in {(0, 0), (dimX, 0), (0, dimY)}:
+			nom = index.tuile(resolution, x, y)
+			try:
+				if nom is not None and os.stat(os.path.join(repertoire, nom)).st_mtime_ns > date:
+					return None
+			except OSError:
+				return None
+	return index, tailles
+
+
+def ecrire_manifeste(repertoire, index, tailles):
+	''' Écrit le manifeste d'un répertoire de tuiles.
+
+		Args:
+		 - repertoire : répertoire des tuiles ;
+		 - index : index de la pyramide (IndexPyramide) ;
+		 - tailles : dictionnaire {résolution: (largeur, hauteur)} de la taille des tuiles.
+	'''
+	niveaux = {}
+	for resolution in index.niveaux():
+		tuiles = index.tuiles(resolution)
+		niveau = {'dimensions': list(index.dimensions(resolution)), 'taille_tuile': list(tailles[resolution])}
+		if index.etendue(resolution) is not None:
+			niveau['etendue'] = list(index.etendue(resolution))
+		# Une grille dont les noms suivent tous le même modèle est décrite sans lister ses tuiles.
+		formes = {(os.path.splitext(nom)[0].rsplit('_', 3)[0], os.path.splitext(nom)[1]) for nom in tuiles.values()}
+		if len(formes) == 1:
+			prefixe, extension = formes.pop()
+			if all(nom == "%s_%d_%d_%d%s" % (prefixe, resolution, x, y, extension) for (x, y), nom in tuiles.items()):
+				niveau.update({'prefixe': prefixe, 'extension': extension,
+							   'manquantes': [list(indices) for indices in index.manquantes(resolution)]})
+		if 'prefixe' not in niveau:
+			niveau['noms'] = sorted(tuiles.values())
+		niveaux[str(resolution)] = niveau
+
+	chemin = os.path.join(repertoire, MANIFESTE)
+	temporaire = chemin + '.tmp'
+	with open(temporaire, 'w') as fichier:
+		json.dump({'version': VERSION_MANIFESTE, 'niveaux': niveaux}, fichier)
+	os.replace(temporaire, chemin)
+	# Le renommage modifie le répertoire : le manifeste doit rester plus récent que lui.
+	os.utime(chemin)
+
+
+def decouper(tuile, partie):
+	''' Extrait une partie d'une tuile, qu'elle soit une image PIL ou un tableau numpy.
+		Pour un tableau, seule la partie extraite est copiée.
+
+		Args:
+		 - tuile : image PIL ou tableau numpy (hauteur, largeur[, canaux]) ;
+		 - partie : boîte (x1, y1, x2, y2) en pixels de la tuile.
+
+		Returns:
+		 - image : image PIL de la taille de la boîte ; ce qui dépasse de la tuile est noir.
+	'''
+	if isinstance(tuile, Image.Image):
+		return tuile.crop(partie)
+	x1, y1, x2, y2 = partie
+	image = Image.fromarray(np.ascontiguousarray(tuile[max(y1, 0):y2, max(x1, 0):x2]))
+	if image.size != (x2 - x1, y2 - y1):
+		complete = Image.new(image.mode, (x2 - x1, y2 - y1))
+		complete.paste(image, (max(-x1, 0), max(-y1, 0)))
+		image = complete
+	return image
+
+
+def decoder_reduit(image, reduction=1):
+	''' Décode une tuile en divisant ses dimensions par un facteur de réduction.
+		Une image JPEG est décodée directement à taille réduite (mise à l'échelle DCT de Image.draft) ;
+		les autres images, ainsi que les tableaux numpy, sont décodées puis réduites par Image.reduce.
+
+		Args:
+		 - image : image PIL ouverte et pas encore chargée, ou tableau numpy ;
+		 - reduction : facteur de réduction, puissance de deux.
+
+		Returns:
+		 - tuile : tuile décodée ; une tuile réduite est une image PIL dont image.info['reduction']
+		   contient le facteur appliqué.
+	'''
+	if not isinstance(image, Image.Image):
+		if reduction == 1:
+			return image
+		image = Image.fromarray(np.ascontiguousarray(image))
+	largeur = image.size[0]
+	if reduction > 1 and image.format == 'JPEG':
+		image.draft(image.mode, (-(-image.size[0] // reduction), -(-image.size[1] // reduction)))
+	image.load()
+	# Réduction restant à appliquer après le décodage.
+	reste = reduction * image.size[0] // largeur
+	if reste > 1:
+		if image.mode not in ('L', 'LA', 'RGB', 'RGBA', 'I', 'F'):
+			image = image.convert('RGB')
+		image = image.reduce(reste)
+	if reduction > 1:
+		image.info['reduction'] = reduction
+	return image
+
+
+def reduction_tuile(tuile):
+	''' Renvoie le facteur de réduction appliqué au décodage d'une tuile. '''
+	if isinstance(tuile, Image.Image):
+		return tuile.info.get('reduction', 1)
+	return 1
+
+
+def taille_pixels(tuile):
+	''' Renvoie la taille (largeur, hauteur) d'une tuile, image PIL ou tableau numpy. '''
+	if isinstance(tuile, Image.Image):
+		return tuile.size
+	return (tuile.shape[1], tuile.shape[0])
+
+
+class PyramideRepertoire:
+	''' Pyramide stockée sous forme d'un fichier par tuile dans un répertoire. '''
+
+	def __init__(self, repertoire, manifeste=True, relire=False):
+		''' Ouvre la pyramide et construit son index, lu dans le manifeste s'il est à jour.
+
+			Args:
+			 - repertoire : répertoire contenant les tuiles ;
+			 - manifeste : écrit le manifeste s'il est absent ou périmé (ignoré si le répertoire est
+			   en lecture seule) ;
+			 - relire : parcourt le répertoire même si le manifeste semble à jour.
+		'''
+		self.chemin = repertoire
+		lu = None if relire else lire_manifeste(repertoire)
+		if lu is not None:
+			self.index, self._tailles = lu
+			return
+		self.index = IndexPyramide.depuis_repertoire(repertoire)
+		self._tailles = {}
+		self.index.definir_etendues(self.etendues_tuiles())
+		if manifeste:
+			try:
+				ecrire_manifeste(repertoire, self.index, {n: self.taille_tuile(n) for n in self.index.niveaux()})
+			except OSError:
+				pass
+
+
+	def ouvrir_tuile(self, resolution, x, y, reduction=1):
+		''' Lit et décode une tuile.
+			Peut être appelée depuis plusieurs threads.
+
+			Args:
+			 - resolution, x, y : résolution et indices de la tuile ;
+			 - reduction : facteur de réduction appliqué au décodage (voir decoder_reduit).
+
+			Returns:
+			 - image : tuile décodée, ou None si la tuile est absente.
+		'''
+		nom = self.index.tuile(resolution, x, y)
+		if nom is None:
+			return None
+		return decoder_reduit(Image.open(os.path.join(self.chemin, nom)), reduction)
+
+
+	def octets_tuile(self, resolution, x, y):
+		''' Lit une tuile sans la décoder, pour le serveur de tuiles (voir serveur_tuiles.py).
+
+			Returns:
+			 - (donnees, type) : contenu du fichier de la tuile et son type MIME, ou None si la tuile
+			   est absente.
+		'''
+		nom = self.index.tuile(resolution, x, y)
+		if nom is None:
+			return None
+		with open(os.path.join(self.chemin, nom), 'rb') as fichier:
+			donnees = fichier.read()
+		return donnees, mimetypes.guess_type(nom)[0] or 'application/octet-stream'
+
+
+	def signature_tuile(self, resolution, x, y):
+		''' Identifie le contenu d'une tuile, pour le cache disque (voir cache_disque.py).
+
+			Returns:
+			 - signature : (chemin absolu, date de modification en ns, taille) du fichier de la tuile,
+			   ou None si la tuile est absente.
+		'''
+		nom = self.index.tuile(resolution, x, y)
+		if nom is None:
+			return None
+		chemin = os.path.abspath(os.path.join(self.chemin, nom))
+		etat = os.stat(chemin)
+		return (chemin, etat.st_mtime_ns, etat.st_size)
+
+
+	def taille_tuile(self, resolution):
+		''' Renvoie la taille de la tuile (0, 0) d'une résolution, ou à défaut d'une tuile présente,
+			lue dans le manifeste ou dans l'en-tête de la tuile.
+		'''
+		if resolution not in self._tailles:
+			nom = self.index.tuile(resolution, 0, 0) or next(iter(self.index.tuiles(resolution).values()))
+			with Image.open(os.path.join(self.chemin, nom)) as image:
+				self._tailles[resolution] = image.size
+		return self._tailles[resolution]
+
+
+	def etendues_tuiles(self):
+		''' Détermine la taille des images complètes rectangulaires d'après l'en-tête de la première
+			tuile et des tuiles de la dernière colonne et de la dernière ligne (voir etendue_grille).
+		'''
+		etendues = {}
+		for resolution in self.index.niveaux():
+			dimX, dimY = self.index.dimensions(resolution)
+			noms = (self.index.tuile(resolution, dimX, 0), self.index.tuile(resolution, 0, dimY))
+			if self.index.tuile(resolution, 0, 0) is None or None in noms:
+				continue
+			with Image.open(os.path.join(self.chemin, noms[0])) as colonne, \
+					Image.open(os.path.join(self.chemin, noms[1])) as ligne:
+				derniere = (colonne.size[0], ligne.size[1])
+			etendue = etendue_grille(resolution, (dimX, dimY), self.taille_tuile(resolution), derniere)
+			if etendue is not None:
+				etendues[resolution] = etendue
+		return etendues
+
+
+def ouvrir_pyramide(chemin):
+	''' Ouvre une pyramide : répertoire de tuiles, conteneur à fichier unique ou serveur de tuiles.
+
+		Args:
+		 - chemin : répertoire des tuiles, fichier conteneur ou adresse http(s):// d'un serveur de
+		   tuiles (voir serveur_tuiles.py).
+
+		Returns:
+		 - pyramide : objet fournissant l'index des tuiles (attribut index) et les méthodes
+		   ouvrir_tuile(resolution, x, y, reduction=1), octets_tuile(resolution, x, y),
+		   signature_tuile(resolution, x, y) et taille_tuile(resolution).
+	'''
+	if os.path.isdir(chemin):
+		return PyramideRepertoire(chemin)
+	if chemin.startswith(('http://', 'https://')):
+		from serveur_tuiles import PyramideHTTP
+		return PyramideHTTP(chemin)
+	from conteneur import PyramideConteneur
+	return PyramideConteneur(chemin)
+
+
+def main(args=None):
+	parser = argparse.ArgumentParser(description="Écriture du manifeste d'un répertoire de tuiles. Le manifeste est "
+		"réécrit automatiquement lorsqu'une tuile est ajoutée ou supprimée, ou que la tuile (0, 0) ou la dernière "
+		"tuile de la première ligne ou colonne d'une résolution est réécrite ; après toute autre modification "
+		"des tuiles, relancer ce script.")
+	parser.add_argument('repertoire', help="Répertoire des tuiles.")
+	arguments = parser.parse_args(args)
+	# Le manifeste existant n'est pas relu : il peut sembler à jour après une modification des tuiles.
+	pyramide = PyramideRepertoire(arguments.repertoire, manifeste=False, relire=True)
+	index = pyramide.index
+	ecrire_manifeste(arguments.repertoire, index, {n: pyramide.taille_tuile(n) for n in index.niveaux()})
+	print(os.path.join(arguments.repertoire, MANIFESTE), ":", len(index.niveaux()), "résolutions")
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,387 @@
+'''
+Serveur HTTP de tuiles, et pyramide lue depuis un tel serveur.
+
+Le serveur expose une pyramide (répertoire de tuiles ou conteneur) à des postes qui n'en ont pas de
+copie. Il traite de nombreuses connexions simultanées avec asyncio ; les lectures de fichiers et les
+rendus sont confiés à un groupe de threads. Les tuiles les plus demandées sont conservées en mémoire.
+
+Routes :
+ - GET /index.json : noms des tuiles, taille des tuiles et des images complètes rectangulaires de
+   chaque résolution ;
+ - GET /tuile/<résolution>/<x>/<y> : tuile telle qu'enregistrée (JPEG, PNG...) ou, pour les tuiles
+   brutes d'un conteneur, pixels au format .npy de numpy ;
+ - GET /vue?resolution=R&echelle=E&x1=..&y1=..&x2=..&y2=..[&format=jpg|png] : partie visible d'une
+   résolution, composée par le moteur de rendu comme dans show.py ; l'échelle doit être positive, la
+   zone compter au plus PIXELS_VUE_MAX pixels, et la résolution ne pas dépasser celle que choisirait
+   show.py pour une vue deux fois plus grande (sinon 400).
+
+Les réponses portent un en-tête ETag (une requête If-None-Match correspondante reçoit 304) et un
+en-tête Cache-Control. Les connexions HTTP/1.1 sont maintenues ouvertes entre deux requêtes.
+
+La classe PyramideHTTP lit une pyramide depuis un serveur, par un groupe de connexions persistantes ;
+show.py l'utilise lorsque le répertoire donné est une adresse http:// (voir pyramide.ouvrir_pyramide).
+
+Arguments (serveur):
+ - Pyramide à servir, répertoire de tuiles ou conteneur.
+
+Options:
+ - --hote : adresse d'écoute (127.0.0.1 par défaut) ;
+ - --port : port d'écoute (8000 par défaut) ;
+ - --cache : budget, en Mo, des tuiles conservées en mémoire ;
+ - --threads : nombre de threads de lecture et de rendu.
+
+Exemple:
+ python serveur_tuiles.py nomdudossiercontenantlesimages/ --hote 0.0.0.0 --port 8000
+ python show.py 8192 http://serveur:8000/
+
+'''
+
+import argparse
+import asyncio
+import hashlib
+import http.client
+import io
+import json
+import math
+import queue
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import numpy as np
+from PIL import Image
+
+from cache_tuiles import CacheTuiles
+from moteur import MoteurRendu
+from pyramide import IndexPyramide, decoder_reduit, ouvrir_pyramide
+
+# Durée de validité annoncée aux clients et aux relais, en secondes.
+DUREE_TUILE = 86400
+DUREE_VUE = 60
+
+STATUTS = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found',
+		   405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+FORMATS_VUE = {'jpg': ('JPEG', 'image/jpeg'), 'png': ('PNG', 'image/png')}
+
+# Nombre maximal de pixels d'une vue : une requête ne peut pas faire allouer une image arbitraire.
+PIXELS_VUE_MAX = 4096 * 4096
+
+# Tolérance sur la résolution d'une vue : elle peut dépasser celle que choisirait show.py (voir
+# moteur.choisir_resolution) pour l'échelle demandée, mais pas celle d'une vue deux fois plus grande.
+MARGE_RESOLUTION = 2
+
+
+def etiquette(donnees):
+	''' Calcule l'en-tête ETag d'un contenu. '''
+	return '"%s"' % hashlib.sha1(donnees).hexdigest()
+
+
+class ServeurTuiles:
+	''' Serveur HTTP asynchrone des tuiles et des vues d'une pyramide. '''
+
+	def __init__(self, pyramide, cache_mo=256, threads=8):
+		''' Initialise le serveur.
+
+			Args:
+			 - pyramide : pyramide à servir (voir pyramide.ouvrir_pyramide) ;
+			 - cache_mo : budget, en Mo, des tuiles conservées en mémoire ; la moitié est consacrée aux
+			   tuiles telles qu'envoyées, l'autre aux tuiles décodées pour les vues ;
+			 - threads : nombre de threads de lecture et de rendu.
+		'''
+		self.pyramide = pyramide
+		budget = cache_mo * 1024 * 1024 // 2
+		# Réponses (données, type, ETag) des tuiles, mesurées par la taille des données.
+		self.tuiles = CacheTuiles(budget, mesurer=lambda reponse: len(reponse[0]))
+		self.decodees = CacheTuiles(budget)
+		self.executeur = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='serveur')
+		index = pyramide.index
+		self.index = json.dumps({'tuiles': [nom for n in index.niveaux() for nom in index.tuiles(n).values()],
+								 'tailles': {n: pyramide.taille_tuile(n) for n in index.niveaux()},
+								 'etendues': index.etendues()}).encode('utf-8')
+
+
+	async def servir(self, hote, port):
+		''' Accepte les connexions jusqu'à l'arrêt de la boucle asyncio. '''
+		serveur = await asyncio.start_server(self.connexion, hote, port)
+		async with serveur:
+			await serveur.serve_forever()
+
+
+	async def connexion(self, lecteur, ecrivain):
+		''' Traite les requêtes successives d'une connexion. '''
+		try:
+			while True:
+				ligne = await lecteur.readline()
+				if not ligne:
+					break
+				methode, cible, version = ligne.decode('latin-1').split()
+				entetes = {}
+				while True:
+					ligne = await lecteur.readline()
+					if ligne in (b'\r\n', b'\n', b''):
+						break
+					nom, _, valeur = ligne.decode('latin-1').partition(':')
+					entetes[nom.strip().lower()] = valeur.strip()
+				if int(entetes.get('content-length', 0)):
+					await lecteur.readexactly(int(entetes['content-length']))
+
+				connexion = entetes.get('connection', '').lower()
+				persistante = connexion == 'keep-alive' or (version == 'HTTP/1.1' and connexion != 'close')
+				statut, corps, supplementaires = await self.repondre(methode, cible, entetes)
+
+				lignes = ['HTTP/1.1 %d %s' % (statut, STATUTS[statut]), 'Content-Length: %d' % len(corps),
+						  'Connection: %s' % ('keep-alive' if persistante else 'close')]
+				lignes += ['%s: %s' % entete for entete in supplementaires.items()]
+				ecrivain.write(('\r\n'.join(lignes) + '\r\n\r\n').encode('latin-1'))
+				if methode != 'HEAD':
+					ecrivain.write(corps)
+				await ecrivain.drain()
+				if not persistante:
+					break
+		except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+			pass
+		finally:
+			ecrivain.close()
+
+
+	async def repondre(self, methode, cible, entetes):
+		''' Prépare la réponse à une requête.
+
+			Returns:
+			 - (statut, corps, entetes) : code HTTP, contenu et en-têtes supplémentaires de la réponse.
+		'''
+		if methode not in ('GET', 'HEAD'):
+			return 405, b'', {'Allow': 'GET, HEAD'}
+		adresse = urlsplit(cible)
+		parties = adresse.path.strip('/').split('/')
+		boucle = asyncio.get_running_loop()
+		try:
+			if parties == ['index.json']:
+				donnees, type, etag, duree = self.index, 'application/json', etiquette(self.index), 0
+			elif len(parties) == 4 and parties[0] == 'tuile':
+				cle = tuple(int(partie) for partie in parties[1:])
+				if self.pyramide.index.tuile(*cle) is None:
+					return 404, b'', {}
+				# Les tuiles conservées en mémoire sont envoyées sans passer par les threads. Une tuile
+				# absente est lue par un thread, sans être comptée une seconde fois par le cache.
+				reponse = self.tuiles.obtenir(cle)
+				if reponse is None:
+					reponse = await boucle.run_in_executor(self.executeur, self.lire_tuile, *cle)
+				(donnees, type, etag), duree = reponse, DUREE_TUILE
+			elif parties == ['vue']:
+				parametres = {nom: valeurs[0] for nom, valeurs in parse_qs(adresse.query).items()}
+				donnees, type = await boucle.run_in_executor(self.executeur, self.rendre_vue, parametres)
+				etag, duree = etiquette(donnees), DUREE_VUE
+			else:
+				return 404, b'', {}
+		except (KeyError, ValueError):
+			return 400, b'', {}
+		except OSError:
+			return 500, b'', {}
+		except Exception:
+			# Une erreur imprévue ne doit pas fermer la connexion sans réponse.
+			traceback.print_exc()
+			return 500, b'', {}
+
+		supplementaires = {'ETag': etag, 'Cache-Control': 'public, max-age=%d' % duree if duree else 'no-cache'}
+		if entetes.get('if-none-match') == etag:
+			return 304, b'', supplementaires
+		supplementaires['Content-Type'] = type
+		return 200, donnees, supplementaires
+
+
+	def lire_tuile(self, resolution, x, y):
+		''' Lit une tuile présente sans la décoder et la conserve en mémoire. Appelée dans un thread
+			du serveur.
+
+			Returns:
+			 - reponse : (données, type, ETag).
+		'''
+		donnees, type = self.pyramide.octets_tuile(resolution, x, y)
+		donnees = bytes(donnees)
+		reponse = donnees, type, etiquette(donnees)
+		self.tuiles.ajouter((resolution, x, y), reponse)
+		return reponse
+
+
+	def rendre_vue(self, parametres):
+		''' Compose une vue avec le moteur de rendu. Appelée dans un thread du serveur.
+
+			Args:
+			 - parametres : paramètres de la requête (resolution, echelle, x1, y1, x2, y2, format).
+
+			Returns:
+			 - (donnees, type) : image encodée et son type MIME.
+		'''
+		resolution = int(parametres['resolution'])
+		if resolution not in self.pyramide.index:
+			raise ValueError("Résolution absente : %d" % resolution)
+		zone = tuple(float(parametres[nom]) for nom in ('x1', 'y1', 'x2', 'y2'))
+		echelle = float(parametres['echelle'])
+		if not all(math.isfinite(valeur) for valeur in zone + (echelle,)):
+			raise ValueError("Paramètres non finis")
+		if echelle <= 0:
+			raise ValueError("Échelle négative ou nulle : %s" % echelle)
+		# La zone est en pixels d'affichage : sa taille est celle de l'image renvoyée.
+		if max(zone[2] - zone[0], 0) * max(zone[3] - zone[1], 0) > PIXELS_VUE_MAX:
+			raise ValueError("Vue de plus de %d pixels" % PIXELS_VUE_MAX)
+		format, type = FORMATS_VUE[parametres.get('format', 'jpg')]
+		# Un moteur par vue : les tuiles décodées sont partagées, pas l'état du dernier rendu.
+		moteur = MoteurRendu(self.pyramide, self.decodees)
+		# Une échelle minuscule ferait décoder toutes les tuiles de la résolution pour une vue de
+		# quelques pixels : une résolution plus faible doit alors être demandée.
+		choisie = moteur.choisir_resolution(moteur.etendue(resolution)[0] * echelle * MARGE_RESOLUTION)
+		if moteur.etendue(choisie)[0] < moteur.etendue(resolution)[0]:
+			raise ValueError("Échelle trop faible pour la résolution %d, demander la résolution %d" % (resolution, choisie))
+		cadre = moteur.rendre(resolution, zone, echelle)
+		flux = io.BytesIO()
+		cadre.save(flux, format)
+		return flux.getvalue(), type
+
+
+class PyramideHTTP:
+	''' Pyramide lue depuis un serveur de tuiles, par un groupe de connexions persistantes. '''
+
+	def __init__(self, adresse, connexions=8, delai=30):
+		''' Se connecte au serveur et lit l'index de la pyramide.
+
+			Args:
+			 - adresse : adresse http:// ou https:// du serveur ;
+			 - connexions : nombre maximal de connexions simultanées ;
+			 - delai : délai d'attente d'une réponse, en secondes.
+		'''
+		parties = urlsplit(adresse)
+		self.chemin = adresse
+		self._hote = parties.netloc
+		self._base = parties.path.rstrip('/')
+		self._classe = http.client.HTTPSConnection if parties.scheme == 'https' else http.client.HTTPConnection
+		self._delai = delai
+		self._libres = queue.LifoQueue()
+		self._places = threading.BoundedSemaphore(connexions)
+
+		statut, corps, _ = self.requete('/index.json')
+		if statut != 200:
+			raise OSError("%s : index illisible (HTTP %d)" % (adresse, statut))
+		donnees = json.loads(corps)
+		self.index = IndexPyramide(donnees['tuiles'], donnees.get('etendues'))
+		self._tailles = {int(resolution): tuple(taille) for resolution, taille in donnees['tailles'].items()}
+
+
+	def requete(self, chemin):
+		''' Envoie une requête GET sur l'une des connexions persistantes.
+			Peut être appelée depuis plusieurs threads.
+
+			Returns:
+			 - (statut, corps, type) : code HTTP, contenu et type MIME de la réponse.
+		'''
+		with self._places:
+			try:
+				connexion = self._libres.get_nowait()
+			except queue.Empty:
+				connexion = self._classe(self._hote, timeout=self._delai)
+			try:
+				try:
+					connexion.request('GET', self._base + chemin)
+					reponse = connexion.getresponse()
+				except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+					# Connexion persistante fermée par le serveur : une seule nouvelle tentative.
+					connexion.close()
+					connexion.request('GET', self._base + chemin)
+					reponse = connexion.getresponse()
+				corps = reponse.read()
+			except Exception:
+				connexion.close()
+				raise
+			if reponse.will_close:
+				connexion.close()
+			self._libres.put(connexion)
+			return reponse.status, corps, reponse.getheader('Content-Type')
+
+
+	def ouvrir_tuile(self, resolution, x, y, reduction=1):
+		''' Télécharge et décode une tuile.
+			Peut être appelée depuis plusieurs threads.
+
+			Args:
+			 - resolution, x, y : résolution et indices de la tuile ;
+			 - reduction : facteur de réduction appliqué au décodage (voir pyramide.decoder_reduit).
+
+			Returns:
+			 - tuile : tuile décodée, ou None si la tuile est absente.
+		'''
+		statut, corps, type = self.requete('/tuile/%d/%d/%d' % (resolution, x, y))
+		if statut == 404:
+			return None
+		if statut != 200:
+			raise OSError("%s : tuile %d/%d/%d illisible (HTTP %d)" % (self.chemin, resolution, x, y, statut))
+		if type == 'application/x-npy':
+			return decoder_reduit(np.load(io.BytesIO(corps)), reduction)
+		return decoder_reduit(Image.open(io.BytesIO(corps)), reduction)
+
+
+	def octets_tuile(self, resolution, x, y):
+		''' Télécharge une tuile sans la décoder.
+
+			Returns:
+			 - (donnees, type) : contenu et type MIME de la tuile, ou None si elle est absente.
+		'''
+		statut, corps, type = self.requete('/tuile/%d/%d/%d' % (resolution, x, y))
+		if statut == 404:
+			return None
+		return corps, type
+
+
+	def vue(self, resolution, zone, echelle, format='jpg'):
+		''' Demande au serveur de composer une vue (voir MoteurRendu.rendre).
+
+			Returns:
+			 - image : image PIL de la vue.
+		'''
+		x1, y1, x2, y2 = zone
+		statut, corps, _ = self.requete('/vue?' + urlencode({'resolution': resolution, 'echelle': echelle,
+			'x1': x1, 'y1': y1, 'x2': x2, 'y2': y2, 'format': format}))
+		if statut != 200:
+			raise OSError("%s : vue illisible (HTTP %d)" % (self.chemin, statut))
+		return Image.open(io.BytesIO(corps))
+
+
+	def signature_tuile(self, resolution, x, y):
+		''' Les tuiles distantes ne sont pas conservées dans le cache disque. '''
+		return None
+
+
+	def taille_tuile(self, resolution):
+		''' Renvoie la taille d'une tuile d'une résolution, lue dans l'index du serveur. '''
+		return self._tailles[resolution]
+
+
+	def fermer(self):
+		''' Ferme les connexions inutilisées. '''
+		while True:
+			try:
+				self._libres.get_nowait().close()
+			except queue.Empty:
+				return
+
+
+def main(args=None):
+	parser = argparse.ArgumentParser(description="Serveur HTTP des tuiles d'une pyramide.")
+	parser.add_argument('pyramide', help="Répertoire des tuiles ou conteneur à servir.")
+	parser.add_argument('--hote', default='127.0.0.1', help="Adresse d'écoute (127.0.0.1 par défaut).")
+	parser.add_argument('--port', type=int, default=8000, help="Port d'écoute (8000 par défaut).")
+	parser.add_argument('--cache', type=int, default=256, help="Budget des tuiles conservées en mémoire, en Mo (256 par défaut).")
+	parser.add_argument('--threads', type=int, default=8, help="Nombre de threads de lecture et de rendu (8 par défaut).")
+	arguments = parser.parse_args(args)
+
+	serveur = ServeurTuiles(ouvrir_pyramide(arguments.pyramide), arguments.cache, arguments.threads)
+	print("Pyramide %s servie sur http://%s:%d/" % (arguments.pyramide, arguments.hote, arguments.port))
+	try:
+		asyncio.run(serveur.servir(arguments.hote, arguments.port))
+	except KeyboardInterrupt:
+		pass
+
+
+if __name__ == '__main__':
+	main()
@@ -4,48 +4,141 @@ Script permettant d'ouvrir une famille d'image de résolutions différentes dans
 Les images d'une même résolution sont mises bout à bout pour simuler l'image complète.
 
 La transition entre les différentes résolution s'effectue en zoomant ou dézoomant grâce à la souris.
+Elle ne bloque pas la fenêtre : l'image courante reste affichée pendant le chargement, en arrière-plan,
+des tuiles de la nouvelle résolution, et l'avancement est indiqué dans le canvas.
 La translation au sein d'une image complète virtuelle s'effectue en glissant la souris, ou en utilisant
 les barres de défilement.
 
 Arguments:
  - Première résolution à afficher ;
- - Répertoire de la famille d'images.
+ - Répertoire de la famille d'images, ou conteneur à fichier unique (voir conteneur.py) ;
+ - Fichier de sauvegarde de la position (facultatif).
+
+Options:
+ - --cache : budget mémoire du cache de tuiles décodées, en Mo ;
+ - --cache-disque : répertoire du cache disque des tuiles décodées, conservé d'une session à l'autre ;
+ - --cache-disque-mo : budget de ce cache disque, en Mo ;
+ - --decodage : décodage des tuiles dans les threads de préchargement ('thread') ou dans un groupe
+   de processus ('processus', voir decodage.py) ;
+ - --processus : nombre de processus de décodage ;
+ - --trace : fichier où enregistrer la session de navigation, rejouable par banc_essai.py ;
+ - --ips : nombre maximal d'images dessinées par seconde pendant un déplacement ;
+ - --delai-qualite : durée d'immobilité, en ms, avant de redessiner l'image avec le filtre de qualité ;
+ - --hud : affiche dès le lancement le nombre d'images par seconde et la durée de chaque étape du rendu ;
+ - --profil : fichier où exporter la durée des étapes du rendu, au format « Trace Event » de Chrome ;
+ - --signets : fichier des signets nommés ;
+ - --signet : nom du signet à afficher au lancement ;
+ - --annotations : fichier .npz des annotations affichées au-dessus de l'image (voir annotations.py),
+   créé s'il n'existe pas et enregistré à la fermeture s'il a été modifié.
+
+Raccourcis:
+ - F2 : affiche ou masque le nombre d'images par seconde et la durée de chaque étape du rendu ;
+ - Ctrl+S : enregistre la position affichée sous un nom de signet ;
+ - menu Signets : retour à une position enregistrée ;
+ - Ctrl+clic : ajoute une annotation au point cliqué (option --annotations) ;
+ - F3 : affiche ou masque les annotations.
 
 '''
 
-import random, warnings
+import argparse
 import tkinter as tk
-from tkinter import ttk
-from PIL import Image, ImageTk
+from tkinter import ttk, simpledialog
+from PIL import ImageTk
 import os
-import threading
-import sys
 import numpy as np
-import timeit
-import copy
+import json
+import time
+from annotations import Annotations
+from cache_tuiles import CacheTuiles
+from cache_disque import CacheDisque, PyramideCacheDisque
+from decodage import MODES_DECODAGE, PyramideProcessus
+from instrumentation import Chronometre
+from prechargement import Prechargeur
+from pyramide import ouvrir_pyramide
+from moteur import MoteurRendu, calculer_vue
+from signets import SauvegardeDifferee, Signets, lire_position
+
+parser = argparse.ArgumentParser(description="Navigation dans une image très haute définition.")
+parser.add_argument('resolution', help="Première résolution à afficher.")
+parser.add_argument('repertoire', help="Répertoire de la famille d'images, ou conteneur à fichier unique.")
+parser.add_argument('sauvegarde', nargs='?', help="Fichier de sauvegarde de la position à reprendre.")
+parser.add_argument('--cache', type=int, default=256,
+					help="Budget mémoire du cache de tuiles décodées, en Mo (256 par défaut).")
+parser.add_argument('--cache-disque', help="Répertoire du cache disque des tuiles décodées, partagé entre les sessions.")
+parser.add_argument('--cache-disque-mo', type=int, default=4096,
+					help="Budget du cache disque des tuiles décodées, en Mo (4096 par défaut).")
+parser.add_argument('--decodage', default='thread', choices=MODES_DECODAGE,
+					help="Décodage des tuiles dans les threads de préchargement ou dans un groupe de processus ('thread' par défaut).")
+parser.add_argument('--processus', type=int, default=None,
+					help="Nombre de processus de décodage (nombre de cœurs par défaut).")
+parser.add_argument('--trace', help="Fichier JSON où enregistrer la session de navigation (voir banc_essai.py).")
+parser.add_argument('--ips', type=float, default=60,
+					help="Nombre maximal d'images dessinées par seconde pendant un déplacement (60 par défaut).")
+parser.add_argument('--delai-qualite', type=int, default=200,
+					help="Durée d'immobilité, en ms, avant de redessiner l'image avec le filtre de qualité (200 par défaut).")
+parser.add_argument('--hud', action='store_true',
+					help="Affiche le nombre d'images par seconde et la durée des étapes du rendu (touche F2).")
+parser.add_argument('--profil', help="Fichier JSON où exporter la durée des étapes du rendu (format Trace Event de Chrome).")
+parser.add_argument('--signets', default="Signets.json", help="Fichier des signets nommés (Signets.json par défaut).")
+parser.add_argument('--signet', help="Nom du signet à afficher au lancement.")
+parser.add_argument('--annotations', help="Fichier .npz des annotations affichées au-dessus de l'image.")
+arguments = parser.parse_args()
 
 #Résolution à afficher en premier.
-resolution = sys.argv[1]
+resolution = arguments.resolution
 #Répertoire de la famille d'images.
-repertoire = str(sys.argv[2]) + "/"
-
-#Chargement des information de la sauvegarde si une sauvegarde est chargée
-if len(sys.argv) == 4:
-	Save_file = open(sys.argv[3],"r")
-	f1 = Save_file.readlines()
-	i = 0
-	Infos = [0 for i in range(4)]
-	for x in f1:
-		x1 = x.replace("\n","")
-		Infos[i] = float(x1)
-		i = i+1
-	Save_file.close()
-	Infos[1] = int(Infos[1])
+repertoire = str(arguments.repertoire)
+
+#Annotations affichées au-dessus de l'image, lues en bloc au lancement.
+annotations = None
+if arguments.annotations:
+	annotations = Annotations.lire(arguments.annotations) if os.path.exists(arguments.annotations) else Annotations()
+
+#Signets nommés.
+signets = Signets(arguments.signets)
+
+#Chargement des information de la sauvegarde si une sauvegarde ou un signet est chargé
+Infos = None
+if arguments.signet is not None:
+	Infos = signets.obtenir(arguments.signet)
+	if Infos is None:
+		parser.error("signet inconnu : %s (signets disponibles : %s)" % (arguments.signet, ", ".join(signets.noms())))
+elif arguments.sauvegarde is not None:
+	Infos = lire_position(arguments.sauvegarde)
+if Infos is not None:
 	resolution = Infos[1]
 	print(Infos)
 
-#Référence au répertoire de travail.
-imgs = os.listdir(repertoire)
+#Pyramide de travail, répertoire ou conteneur, et index de ses tuiles construit une seule fois.
+pyramide = ouvrir_pyramide(repertoire)
+imgs = pyramide.index
+
+#Décodage des tuiles dans un groupe de processus, facultatif : chaque thread de préchargement attend
+#le décodage d'une tuile par un processus, et les tuiles d'un changement de résolution sont décodées
+#sur tous les cœurs.
+decodeur = None
+threads_prechargement = 4
+if arguments.decodage == 'processus':
+	decodeur = pyramide = PyramideProcessus(pyramide, repertoire, arguments.processus)
+	threads_prechargement = max(threads_prechargement, decodeur.processus)
+
+#Cache disque des tuiles décodées, facultatif : les tuiles décodées lors des sessions précédentes
+#sont relues sans décodage.
+cache_disque = None
+if arguments.cache_disque:
+	cache_disque = CacheDisque(arguments.cache_disque, arguments.cache_disque_mo * 1024 * 1024)
+	pyramide = PyramideCacheDisque(pyramide, cache_disque)
+
+#Durée maximale, en secondes, d'attente des tuiles lors d'un changement de résolution.
+DELAI_TRANSITION = 2.0
+
+#Durée maximale, en secondes, du chargement des vignettes avant la première image ; les tuiles de la
+#résolution affichée sont chargées ensuite en arrière-plan.
+DELAI_PREMIERE_IMAGE = 0.3
+
+#Étapes du rendu affichées par l'affichage tête haute, dans cet ordre.
+ETAPES = ('image', 'configuration', 'rendu', 'defilement', 'decodage', 'decoupage', 'redimensionnement',
+		  'collage', 'annotations', 'photoimage', 'canvas', 'sauvegarde')
 
 class AutoScrollbar(ttk.Scrollbar):
 	''' Classe d'une barre de défilement, se plaçant à gauche et / ou en bas de la fenêtre si nécessaire.
@@ -88,6 +181,9 @@ class Zoom_Advanced(ttk.Frame):
 								xscrollcommand=hbar.set, yscrollcommand=vbar.set)
 		self.canvas.grid(row=0, column=0, sticky='nswe')
 		self.canvas.update()
+		# Taille de la zone visible, conservée pour l'enregistrement de la trace : le canvas n'existe
+		# plus une fois la fenêtre fermée.
+		self.fenetre = (self.canvas.winfo_width(), self.canvas.winfo_height())
 
 		# Lie le canvas et les barres de défilement.
 		vbar.configure(command=self.scroll_y)
@@ -98,7 +194,7 @@ class Zoom_Advanced(ttk.Frame):
 		self.master.columnconfigure(0, weight=1)
 
 		# Inputs.
-		self.canvas.bind('<Configure>', self.show_image)
+		self.canvas.bind('<Configure>', self.redimensionner)
 		self.canvas.bind('<ButtonPress-1>', self.move_from)
 		self.canvas.bind('<B1-Motion>',     self.move_to)
 		self.canvas.bind('<MouseWheel>', self.wheel)
@@ -109,6 +205,61 @@ class Zoom_Advanced(ttk.Frame):
 		# Résolution actuelle.
 		self.resolution = Infos[1]
 
+		# Position affichée, enregistrée en arrière-plan dans SauvegardePosition.txt.
+		self.position = list(Infos)
+
+		# Mesure des étapes du rendu, active si l'affichage tête haute ou l'export sont demandés.
+		self.hud = arguments.hud
+		self.chrono = Chronometre(actif=self.hud, enregistrer=arguments.profil is not None)
+		self.master.bind('<F2>', self.basculer_hud)
+
+		self.sauvegarde = SauvegardeDifferee("SauvegardePosition.txt", chrono=self.chrono)
+
+		# Menu des signets.
+		menu = tk.Menu(self.master)
+		self.menu_signets = tk.Menu(menu, tearoff=0)
+		menu.add_cascade(label='Signets', menu=self.menu_signets)
+		self.master.config(menu=menu)
+		self.actualiser_signets()
+		self.master.bind('<Control-s>', self.ajouter_signet)
+
+		# Couche des annotations.
+		self.afficher_annotations = annotations is not None
+		if annotations is not None:
+			self.canvas.bind('<Control-Button-1>', self.annoter)
+			self.master.bind('<F3>', self.basculer_annotations)
+
+		# Rendu différé : un seul rendu prévu à la fois, au plus arguments.ips par seconde.
+		self.rendu_prevu = None
+		self.dernier_rendu = 0.0
+		# Rendu avec le filtre de qualité, prévu une fois l'image immobile.
+		self.rendu_qualite = None
+
+		# Changement de résolution en cours (voir changer_resolution), ou None.
+		self.transition = None
+
+		# Image composée, PhotoImage et élément du canvas, conservés d'un rendu à l'autre : chaque
+		# rendu remplit la même image puis la recopie dans la même PhotoImage.
+		self.cadre = None
+		self.imagetk = None
+		self.image_canvas = None
+
+		# Images affichées, enregistrées si l'option --trace est utilisée.
+		self.trace = []
+		self.debut_trace = time.perf_counter()
+
+		# Cache des tuiles décodées, partagé par toutes les résolutions.
+		self.cache = CacheTuiles(arguments.cache * 1024 * 1024)
+
+		# Moteur de rendu, indépendant de tkinter, et préchargement en arrière-plan des tuiles
+		# voisines de la zone affichée.
+		self.moteur = MoteurRendu(pyramide, self.cache, chrono=self.chrono)
+		self.prechargeur = Prechargeur(self.cache, self.moteur.lire_tuile, imgs.dimensions,
+			nb_threads=threads_prechargement, present=self.moteur.est_a_jour, voisines=imgs.voisines)
+		self.moteur.prechargeur = self.prechargeur
+		self.moteur.charger_vignettes(delai=DELAI_PREMIERE_IMAGE)
+		self.surveiller_prechargement()
+
 		# Configuration du canvas.
 		self.configurate_canvas(resolution,imgs,Infos)
 
@@ -121,47 +272,38 @@ class Zoom_Advanced(ttk.Frame):
 			Args:
 			 - nom : première partie du nom des images ;
 			 - resolution : résolution à utiliser ;
-			 - images : ensemble des images du répertoire ;
+			 - images : index des images du répertoire ;
 			 - xmove : entre 0.0 et 1.0, indique la position x initiale dans l'image complète virtuelle ;
 			 - ymove : entre 0.0 et 1.0, indique la position y initiale dans l'image complète virtuelle.
 		'''
-		# Supprime tous les éléments du canvas (permet de faire le ménage).
-		self.canvas.delete("all")
-		# Sélectionne les images à utiliser et les place dans une matrice.
-		resolution = str(resolution)
-		self.images = self.selection_images(resolution,images)
-
-		# Initialise le tableau des quatre images flottantes.
-		self.image00 = Image.open(repertoire + self.images[0][0])
-		if self.dimX > 0:
-			self.image10 = Image.open(repertoire + self.images[1][0])
-		if self.dimY > 0:
-			self.image01 = Image.open(repertoire + self.images[0][1])
-		if self.dimX > 0 and self.dimY > 0:
-			self.image11 = Image.open(repertoire + self.images[1][1])
-
-		self.tuple00 = (0,0)
-		self.tuple10 = (1,0)
-		self.tuple01 = (0,1)
-		self.tuple11 = (1,1)
-
-		# Largeur et longueur de l'image complète.
-		self.width = self.image00.size[0] * 2
-		self.height = self.image00.size[1] * 2
-
-		# Echelle
-		self.imscale = Infos[0]
-		# Magnitude du zoom
-		self.delta = 1.3
-
-		# Crée un canvas de taille équivalente à la résolution de l'image complète.
-		self.container = self.canvas.create_rectangle(0, 0, resolution, resolution, width=0)
-		self.canvas.configure(scrollregion=(1,1,int(resolution)-1,int(resolution)-1))
-
-		# Sélectionne la partie du canvas à afficher.
-		self.canvas.xview_moveto(Infos[2])
-		self.canvas.yview_moveto(Infos[3])
-		self.canvas.update()
+		# Mise en place du cadre, mesurée par le chronomètre.
+		with self.chrono.mesure('configuration'):
+			# Supprime tous les éléments du canvas (permet de faire le ménage).
+			self.canvas.delete("all")
+			self.image_canvas = None
+			# Sélectionne les images à utiliser et les place dans une matrice.
+			resolution = str(resolution)
+			self.resolution = resolution
+			self.images = self.selection_images(resolution,images)
+
+			# Largeur et longueur de l'image complète, lues dans l'index sans décoder de tuile.
+			self.width, self.height = self.moteur.etendue(int(resolution))
+
+			# Echelle
+			self.imscale = Infos[0]
+			# Magnitude du zoom
+			self.delta = 1.3
+
+			# Crée un canvas de la taille de l'image complète, à l'échelle courante afin qu'une position
+			# sauvegardée avec une échelle quelconque soit restituée.
+			largeur, hauteur = self.width * self.imscale, self.height * self.imscale
+			self.container = self.canvas.create_rectangle(0, 0, largeur, hauteur, width=0)
+			self.canvas.configure(scrollregion=(1,1,largeur-1,hauteur-1))
+
+			# Sélectionne la partie du canvas à afficher.
+			self.canvas.xview_moveto(Infos[2])
+			self.canvas.yview_moveto(Infos[3])
+			self.canvas.update()
 
 		# Initialise l'image affichée.
 		self.initial_show_image()
@@ -171,43 +313,26 @@ class Zoom_Advanced(ttk.Frame):
 		''' Sélectionne les images à utiliser pour une résolution donnée.
 
 			Args:
-			 - nom : première partie du nom des images à utiliser ;
 			 - resolution : résolution à utiliser ;
-			 - images : ensemble des images du répertoire.
+			 - images : index des images du répertoire.
 
 			Returns:
-			 - matrice : matrice des images à utiliser.
+			 - matrice : matrice des images à utiliser, None pour les tuiles absentes.
 		'''
-		# Initialise ou remet à zéro les dimensions de la classe.
-		self.dimX = 0
-		self.dimY = 0
-
-		# Variables utiles localement.
-		count= 0
-		split = []
-
-		# Détermine les dimensions de la matrice des images à utiliser.
-		for image in images:
-			split = image.split('.')[0]
-			split = split.split('_')
-			if len(split)>=2 and split[1]==resolution:
-				count += 1
-				if int(split[2]) > self.dimX:
-					self.dimX = int(split[2])
-				if int(split[3]) > self.dimY:
-					self.dimY = int(split[3])
-
-		# Initialisation de la matrice des images à utiliser.
-		matrice = np.zeros((self.dimX + 1,self.dimY + 1),dtype = object)
-
-		# Sélectionne les images à utiliser en effectuant des tests sur leur nom.
-		for image in images:
-			split = image.split('.')[0]
-			split = split.split('_')
-			if len(split)>=2 and split[1]==resolution:
-				matrice[int(split[2])][int(split[3])] = image
-
-		print(matrice)
+		# Dimensions de la matrice des images à utiliser, lues dans l'index.
+		if int(resolution) not in images:
+			raise ValueError("Résolution %s absente du répertoire, résolutions disponibles : %s"
+				% (resolution, images.niveaux()))
+		self.dimX, self.dimY = images.dimensions(int(resolution))
+
+		# Remplit la matrice avec les seules tuiles de cette résolution.
+		matrice = np.full((self.dimX + 1,self.dimY + 1), None, dtype = object)
+		for (x, y), image in images.tuiles(int(resolution)).items():
+			matrice[x][y] = image
+
+		manquantes = images.manquantes(int(resolution))
+		if manquantes:
+			print("Tuiles absentes à la résolution", resolution, ":", manquantes)
 		return(matrice)
 
 
@@ -215,21 +340,14 @@ class Zoom_Advanced(ttk.Frame):
 		''' Vérifie que le passage à une nouvelle résolution est possible.
 
 			Args:
-			 - nom : première partie du nom des images à utiliser ;
 			 - resolution : résolution à utiliser ;
-			 - images : ensemble des images du répertoire.
+			 - images : index des images du répertoire.
 
 			Returns:
 			 - True : le changement est possible.
 			 - False : le changement est impossible.
 		'''
-		# Effectue un test sur le nom des images pour vérifier que le changement est possible.
-		for image in images:
-			split = image.split('.')[0]
-			split = split.split('_')
-			if len(split)>=2 and split[1]==resolution:
-				return True
-		return False
+		return int(resolution) in images
 
 
 	def scroll_y(self, *args, **kwargs):
@@ -237,13 +355,13 @@ class Zoom_Advanced(ttk.Frame):
 		# Défilement vertical.
 		self.canvas.yview(*args, **kwargs)
 		# Redessine l'image.
-		self.show_image()
+		self.demander_rendu()
 
 
 	def scroll_x(self, *args, **kwargs):
 		''' Défile horizontalement le canvas et redessine l'image. '''
 		self.canvas.xview(*args, **kwargs)  # Défilement horizontal.
-		self.show_image()  # Redessine l'image.
+		self.demander_rendu()  # Redessine l'image.
 
 
 	def move_from(self, event):
@@ -254,128 +372,246 @@ class Zoom_Advanced(ttk.Frame):
 	def move_to(self, event):
 		''' Translate le canvas jusqu'à la nouvelle position et redessine l'image. '''
 		self.canvas.scan_dragto(event.x, event.y, gain=1)
-		self.show_image()  # Redessine l'image.
+		self.demander_rendu()  # Redessine l'image.
 
 
-	def change_image(self,intx,inty,newx,newy):
-		''' Change une des images du tableau des quatre images flottantes.
+	def redimensionner(self, event):
+		''' Enregistre la nouvelle taille de la zone visible et redessine l'image. '''
+		self.fenetre = (event.width, event.height)
+		self.demander_rendu()
 
-			Args:
-			 - intx, inty : indices dans le tableau de l'image à changer.
-			 - newx, newy : indices dans la matrice complète de l'image à utiliser.
+
+	def demander_rendu(self, event=None):
+		''' Demande que l'image soit redessinée.
+			Les demandes reçues avant le rendu sont regroupées en un seul rendu, effectué une fois
+			les événements en attente traités et au plus arguments.ips fois par seconde : les
+			positions intermédiaires d'un glissement rapide ne sont jamais dessinées.
+			Ces rendus utilisent le filtre rapide ; l'image est redessinée avec le filtre de qualité
+			après arguments.delai_qualite ms sans nouvelle demande.
 		'''
-		if intx == 0:
-			if inty == 0:
-				self.tuple00 = (newx,newy)
-				self.image00 = Image.open(repertoire + self.images[newx][newy])
-			else:
-				self.tuple01 = (newx,newy)
-				self.image01 = Image.open(repertoire + self.images[newx][newy])
+		if self.rendu_prevu is not None:
+			return
+		attente = self.dernier_rendu + 1 / arguments.ips - time.perf_counter()
+		if attente > 0:
+			self.rendu_prevu = self.after(int(attente * 1000) + 1, self.rendu_differe)
 		else:
-			if inty == 0:
-				self.tuple10 = (newx,newy)
-				self.image10 = Image.open(repertoire + self.images[newx][newy])
-			else:
-				self.tuple11 = (newx,newy)
-				self.image11 = Image.open(repertoire + self.images[newx][newy])
+			self.rendu_prevu = self.after_idle(self.rendu_differe)
 
 
-	def wheel(self, event):
-		''' Zoom.
-			Change la résolution de l'image affichée en fonction de la nouvelle échelle.
-			'''
+	def rendu_differe(self):
+		''' Dessine l'image à la position courante du canvas. '''
+		self.rendu_prevu = None
+		self.dernier_rendu = time.perf_counter()
+		self.show_image(qualite='rapide')
+		if self.rendu_qualite is not None:
+			self.after_cancel(self.rendu_qualite)
+		self.rendu_qualite = self.after(arguments.delai_qualite, self.rendu_immobile)
 
-		bbox1 = self.canvas.bbox(self.container)
 
-		sizex = np.abs(bbox1[2] - bbox1[0])
-		sizey = np.abs(bbox1[3] - bbox1[1])
-		titleDimX = sizex//(self.dimX+1)
-		titleDimY = sizey//(self.dimY+1)
-		bbox1 = (bbox1[0] + 1, bbox1[1] + 1, bbox1[2] - 1, bbox1[3] - 1)
+	def rendu_immobile(self):
+		''' Redessine l'image immobile avec le filtre de qualité. '''
+		self.rendu_qualite = None
+		self.show_image(qualite='qualite')
 
-		bbox2 = (self.canvas.canvasx(0),
-				 self.canvas.canvasy(0),
-				 self.canvas.canvasx(self.canvas.winfo_width()),
-				 self.canvas.canvasy(self.canvas.winfo_height()))
 
-		bbox = [min(bbox1[0], bbox2[0]), min(bbox1[1], bbox2[1]),
-				max(bbox1[2], bbox2[2]), max(bbox1[3], bbox2[3])]
+	def actualiser_signets(self):
+		''' Reconstruit le menu des signets. '''
+		self.menu_signets.delete(0, 'end')
+		self.menu_signets.add_command(label='Ajouter un signet...', accelerator='Ctrl+S', command=self.ajouter_signet)
+		if signets.noms():
+			self.menu_signets.add_separator()
+		for nom in signets.noms():
+			self.menu_signets.add_command(label=nom, command=lambda nom=nom: self.aller_signet(nom))
 
-		if bbox[0] == bbox2[0] and bbox[2] == bbox2[2]:
-			bbox[0] = bbox1[0]
-			bbox[2] = bbox1[2]
-		if bbox[1] == bbox2[1] and bbox[3] == bbox2[3]:
-			bbox[1] = bbox1[1]
-			bbox[3] = bbox1[3]
-		self.canvas.configure(scrollregion=bbox)
-		x1 = max(bbox2[0] - bbox1[0], 0)
-		y1 = max(bbox2[1] - bbox1[1], 0)
-		x2 = min(bbox2[2], bbox1[2]) - bbox1[0]
-		y2 = min(bbox2[3], bbox1[3]) - bbox1[1]
 
-		xratio = x1 / (bbox[2]-bbox[0])
-		yratio = y1 / (bbox[3]-bbox[1])
+	def ajouter_signet(self, event=None):
+		''' Enregistre la position affichée sous un nom choisi par l'utilisateur. '''
+		nom = simpledialog.askstring('Signet', 'Nom du signet :', parent=self.master)
+		if nom:
+			signets.ajouter(nom, self.position)
+			self.actualiser_signets()
+
 
-		if np.abs(x2 - x1)*self.delta > 2 * titleDimX or np.abs(y2 - y1)*self.delta > 2 * titleDimY:
+	def aller_signet(self, nom):
+		''' Affiche la position enregistrée dans un signet. '''
+		position = signets.obtenir(nom)
+		if position is None or not self.detect_resolution(position[1], imgs):
 			return
-		else:
+		self.changer_resolution(position, 0)
+
+
+	def annoter(self, event):
+		''' Ajoute une annotation au point cliqué, en coordonnées relatives à l'image complète. '''
+		bbox1, _ = self.zones_canvas()
+		x = (self.canvas.canvasx(event.x) - bbox1[0]) / (self.width * self.imscale)
+		y = (self.canvas.canvasy(event.y) - bbox1[1]) / (self.height * self.imscale)
+		if 0 <= x < 1 and 0 <= y < 1:
+			annotations.ajouter(x, y)
+			self.demander_rendu()
+
+
+	def basculer_annotations(self, event=None):
+		''' Affiche ou masque les annotations. '''
+		self.afficher_annotations = not self.afficher_annotations
+		self.demander_rendu()
+
+
+	def changer_resolution(self, position, sens):
+		''' Démarre le passage à une autre position, dans une autre résolution, sans bloquer la
+			boucle principale.
+			Les tuiles de la résolution cible couvrant la future zone visible sont chargées par le
+			préchargeur ; l'image courante reste affichée jusqu'à ce qu'elles soient prêtes, ou au plus
+			DELAI_TRANSITION secondes, puis configurate_canvas() installe la nouvelle résolution.
+
+			Args:
+			 - position : position cible [échelle, résolution, xratio, yratio] ;
+			 - sens : 1 pour un zoom avant, -1 pour un zoom arrière, 0 pour un saut (signet).
+		'''
+		echelle, resolution_cible = position[0], int(position[1])
+		# Zone visible après la transition, en pixels d'affichage de la résolution cible.
+		largeur, hauteur = (cote * echelle for cote in self.moteur.etendue(resolution_cible))
+		x1 = position[2] * largeur
+		y1 = position[3] * hauteur
+		zone = (x1, y1, min(x1 + self.canvas.winfo_width(), largeur), min(y1 + self.canvas.winfo_height(), hauteur))
+		tuiles = self.moteur.tuiles_visibles(resolution_cible, zone, echelle)
+
+		self.transition = {'position': list(position), 'sens': sens, 'tuiles': tuiles,
+			'debut': time.perf_counter()}
+		self.suivre_transition()
+
+
+	def suivre_transition(self):
+		''' Vérifie régulièrement si les tuiles de la résolution cible sont prêtes.
+			Redemande leur chargement à chaque passage : un rendu de la résolution courante peut avoir
+			annulé les demandes en attente.
+		'''
+		transition = self.transition
+		if transition is None:
+			return
+		resolution_cible = int(transition['position'][1])
+		tx1, ty1, tx2, ty2 = transition['tuiles']
+		cles = [(resolution_cible, tx, ty) for tx in range(tx1, tx2 + 1) for ty in range(ty1, ty2 + 1)]
+		pretes = sum(1 for cle in cles if self.moteur.est_a_jour(cle))
+
+		if pretes < len(cles) and time.perf_counter() - transition['debut'] < DELAI_TRANSITION:
+			self.prechargeur.demander(resolution_cible, tx1, ty1, tx2, ty2)
+			self.afficher_progression("Chargement de la résolution %d : %d / %d tuiles"
+				% (resolution_cible, pretes, len(cles)))
+			self.after(30, self.suivre_transition)
+			return
+
+		# Tuiles prêtes, ou délai dépassé : les tuiles manquantes seront dessinées progressivement.
+		self.transition = None
+		self.configurate_canvas(resolution_cible, imgs, transition['position'])
+
+
+	def annuler_transition(self):
+		''' Abandonne le changement de résolution en cours ; l'image courante reste affichée. '''
+		self.transition = None
+		self.canvas.delete('progression')
+
+
+	def afficher_progression(self, texte):
+		''' Affiche un message dans le coin haut-gauche de la zone visible du canvas. '''
+		self.canvas.delete('progression')
+		self.etiquette(texte, self.canvas.canvasx(10), self.canvas.canvasy(10), 'nw', 'white', 'progression')
 
-			x = self.canvas.canvasx(event.x)
-			y = self.canvas.canvasy(event.y)
-			bbox = self.canvas.bbox(self.container)
-			if bbox[0] < x < bbox[2] and bbox[1] < y < bbox[3]: pass
-			else: return
-			scale = 1.0
-
-			if event.num == 5 or event.delta <= 0:  # dézooom
-				i = min(self.width, self.height)
-				self.imscale /= self.delta
-				scale        /= self.delta
-
-				if self.imscale < (self.delta / 4): # Chargement de la résolution inférieure
-					if self.detect_resolution(str(int(self.resolution) // 2),imgs):
-						self.wait=WaitThread()
-						self.wait.start()
-						self.canvas.delete('r')
-						self.resolution = str(int(self.resolution) // 2)
-						self.configurate_canvas(self.resolution,imgs,[1,0,xratio,yratio])
-						self.wait.destroy()
-						return
-					else:
-						if self.dimX == 0 and self.dimY == 0 :
-							if self.imscale < (self.delta / 15):
-								self.imscale = self.imscale * self.delta
-								return
-						else:
-							self.imscale = self.imscale * self.delta
-							return
-				else:
-					self.canvas.delete('r')
-
-			if event.num == 4 or event.delta > 0:  # zoom
-				i = min(self.canvas.winfo_width(), self.canvas.winfo_height())
-				if i < self.imscale: return
-				self.imscale *= self.delta
-				scale        *= self.delta
-
-				if self.imscale > (self.delta*3): # Chargement de la résolution supérieure
-					if self.detect_resolution(str(int(self.resolution) * 2),imgs):
-						self.wait=WaitThread()
-						self.wait.start()
-						self.canvas.delete('r')
-						self.resolution = str(int(self.resolution) * 2)
-						self.configurate_canvas(self.resolution,imgs,[1,0,xratio,yratio])
-						self.wait.destroy()
-						return
-					else:
-						self.imscale = self.imscale / self.delta
-						return
-				else:
-					self.canvas.delete('r')
 
-			# Redimensionne les objets du canvas
-			self.canvas.scale('all', x, y, scale, scale)
-			self.show_image()
+	def etiquette(self, texte, x, y, ancre, couleur, tag):
+		''' Dessine un texte sur fond noir au-dessus de l'image, aux coordonnées du canvas données. '''
+		texteid = self.canvas.create_text(x, y, text=texte, anchor=ancre, fill=couleur,
+			font='TkFixedFont', tags=tag)
+		x1, y1, x2, y2 = self.canvas.bbox(texteid)
+		fond = self.canvas.create_rectangle(x1 - 6, y1 - 4, x2 + 6, y2 + 4, fill='black', outline='', tags=tag)
+		self.canvas.tag_lower(fond, texteid)
+
+
+	def basculer_hud(self, event=None):
+		''' Affiche ou masque l'affichage tête haute. '''
+		self.hud = not self.hud
+		self.chrono.actif = self.hud or self.chrono.enregistrer
+		self.afficher_hud()
+
+
+	def afficher_hud(self):
+		''' Affiche, dans le coin haut-droit de la zone visible, le nombre d'images par seconde et la
+			durée de chaque étape de la dernière image.
+		'''
+		self.canvas.delete('hud')
+		if not self.hud:
+			return
+		derniere = self.chrono.derniere
+		lignes = ["%6.1f ips" % self.chrono.ips()]
+		lignes += ["%-17s %6.1f ms" % (etape, derniere[etape]) for etape in ETAPES if etape in derniere]
+		self.etiquette("\n".join(lignes), self.canvas.canvasx(self.canvas.winfo_width() - 16),
+			self.canvas.canvasy(14), 'ne', 'yellow', 'hud')
+
+
+	def surveiller_prechargement(self):
+		''' Récupère régulièrement, dans le thread principal, les tuiles préchargées.
+			Si la dernière image affichée était provisoire, elle est redessinée dès qu'une tuile de
+			la résolution affichée est prête.
+		'''
+		pretes = self.prechargeur.recuperer()
+		if not self.moteur.complet and any(cle[0] == int(self.resolution) for cle in pretes):
+			self.demander_rendu()
+		self.after(30, self.surveiller_prechargement)
+
+
+	def wheel(self, event):
+		''' Zoom.
+			Choisit, d'après la nouvelle échelle, la résolution la moins coûteuse qui offre encore une
+			densité de pixels suffisante (voir moteur.choisir_resolution) : un zoom important passe
+			directement à cette résolution, quel que soit le rapport entre les résolutions de l'index.
+			Le point situé sous la souris reste en place lors d'un changement de résolution.
+			Pendant un changement de résolution, un cran dans le même sens est absorbé par la
+			transition en cours et un cran en sens inverse l'annule.
+			'''
+		sens = 1 if event.num == 4 or (event.num != 5 and event.delta > 0) else -1
+		if self.transition is not None:
+			if sens * self.transition['sens'] < 0:
+				self.annuler_transition()
+			return
+
+		bbox = calculer_vue(*self.zones_canvas())[0]
+		self.canvas.configure(scrollregion=bbox)
+
+		x = self.canvas.canvasx(event.x)
+		y = self.canvas.canvasy(event.y)
+		bbox = self.canvas.bbox(self.container)
+		if bbox[0] < x < bbox[2] and bbox[1] < y < bbox[3]: pass
+		else: return
+
+		if sens > 0:  # zoom
+			i = min(self.canvas.winfo_width(), self.canvas.winfo_height())
+			if i < self.imscale: return
+			scale = self.delta
+		else:  # dézoom
+			scale = 1.0 / self.delta
+		imscale = self.imscale * scale
+
+		# Résolution adaptée à la largeur de l'image complète à la nouvelle échelle.
+		largeur_affichee = self.width * imscale
+		resolution_cible = self.moteur.choisir_resolution(largeur_affichee)
+		echelle_cible = largeur_affichee / self.moteur.etendue(resolution_cible)[0]
+		if resolution_cible == imgs.niveaux()[0] and echelle_cible < self.delta / 15:
+			return
+
+		if resolution_cible != int(self.resolution):
+			# L'image courante reste affichée pendant le chargement de la résolution cible. Position
+			# relative du point sous la souris, ramenée au coin haut-gauche de la future zone visible.
+			largeur_cible, hauteur_cible = (cote * echelle_cible for cote in self.moteur.etendue(resolution_cible))
+			px = (x - bbox[0]) / (bbox[2] - bbox[0])
+			py = (y - bbox[1]) / (bbox[3] - bbox[1])
+			xratio = min(max(px * largeur_cible - event.x, 0) / largeur_cible, 1.0)
+			yratio = min(max(py * hauteur_cible - event.y, 0) / hauteur_cible, 1.0)
+			self.changer_resolution([echelle_cible, resolution_cible, xratio, yratio], sens)
+			return
+
+		# Redimensionne les objets du canvas
+		self.imscale = imscale
+		self.canvas.scale('all', x, y, scale, scale)
+		self.demander_rendu()
 
 
 	def initial_show_image(self, event=None):
@@ -389,236 +625,105 @@ class Zoom_Advanced(ttk.Frame):
 		self.show_image()
 
 
-	def show_image(self, event=None):
-		''' Dessine l'image dans le canvas. '''
-		# Zone du container.
-		bbox1 = self.canvas.bbox(self.container)
-
-		# Taille du container et taille actuelle des images utilisées.
-		sizex = np.abs(bbox1[2] - bbox1[0])
-		sizey = np.abs(bbox1[3] - bbox1[1])
-		titleDimX = sizex//(self.dimX+1)
-		titleDimY = sizey//(self.dimY+1)
+	def zones_canvas(self):
+		''' Renvoie la zone de l'image complète et la zone visible, en coordonnées du canvas.
 
-		# Enlève un pixel de chaque côté.
+			Returns:
+			 - bbox1 : zone du container, réduite d'un pixel de chaque côté ;
+			 - bbox2 : zone visible du canvas.
+		'''
+		bbox1 = self.canvas.bbox(self.container)
 		bbox1 = (bbox1[0] + 1, bbox1[1] + 1, bbox1[2] - 1, bbox1[3] - 1)
-
-		# Zone visible du canvas.
 		bbox2 = (self.canvas.canvasx(0),
 				 self.canvas.canvasy(0),
 				 self.canvas.canvasx(self.canvas.winfo_width()),
 				 self.canvas.canvasy(self.canvas.winfo_height()))
+		return bbox1, bbox2
 
-		# Détermination de la zone d'interaction.
-		bbox = [min(bbox1[0], bbox2[0]), min(bbox1[1], bbox2[1]),
-				max(bbox1[2], bbox2[2]), max(bbox1[3], bbox2[3])]
 
-		# Ajustements.
-		if bbox[0] == bbox2[0] and bbox[2] == bbox2[2]:
-			bbox[0] = bbox1[0]
-			bbox[2] = bbox1[2]
-		if bbox[1] == bbox2[1] and bbox[3] == bbox2[3]:
-			bbox[1] = bbox1[1]
-			bbox[3] = bbox1[3]
+	def show_image(self, event=None, qualite='qualite'):
+		''' Dessine l'image dans le canvas.
+			La composition de l'image est confiée au moteur de rendu.
 
-		# Configuration de la zone d'interaction.
-		self.canvas.configure(scrollregion=bbox)
+			Args:
+			 - qualite : 'rapide' pendant les déplacements, 'qualite' une fois l'image immobile
+			   (voir moteur.FILTRES).
+		'''
+		self.chrono.debut_image()
 
-		# Coordonnées de l'ensemble des images affichées.
-		x1 = max(bbox2[0] - bbox1[0], 0)
-		y1 = max(bbox2[1] - bbox1[1], 0)
-		x2 = min(bbox2[2], bbox1[2]) - bbox1[0]
-		y2 = min(bbox2[3], bbox1[3]) - bbox1[1]
-
-		xratio = x1 / (bbox[2]-bbox[0])
-		yratio = y1 / (bbox[3]-bbox[1])
-
-		zoom = copy.deepcopy(self.imscale)
-		reso = copy.deepcopy(self.resolution)
-
-		xratiof = copy.deepcopy(xratio)
-		yratiof = copy.deepcopy(yratio)
-
-		f= open("SauvegardePosition.txt","w+")
-		f.write(str(zoom) + "\n" + str(reso) + "\n" + str(xratiof) + "\n" + str(yratiof) + "\n")
-		f.close()
-
-		# Indices des images affichées dans la matrice.
-		tx1 = int(x1 // titleDimX)
-		ty1 = int(y1 // titleDimY)
-		tx2 = int(x2 // titleDimX)
-		ty2 = int(y2 // titleDimY)
-
-		# Partie de l'image haut-gauche à afficher.
-		qx1 = x1 % titleDimX
-		qy1 = y1 % titleDimY
-		if tx1 < 0:
-			tx1 = 0
-			qx1 = 0
-		if ty1 < 0:
-			ty1 = 0
-			qy1 = 0
-
-		# Partie de l'image bas-droit à afficher.
-		qx2 = x2 % titleDimX
-		qy2 = y2 % titleDimY
-
-		if tx2 > self.dimX:
-			tx2 = self.dimX
-			qx2 = 0
-		if ty2 > self.dimY:
-			ty2 = self.dimY
-			qy2 = 0
-
-		# Test sur l'image haut-gauche pour déterminer si la référence est la bonne, changement de référence
-		# sinon.
-		if (tx1,ty1) != self.tuple00:
-			self.change_image(0,0,int(tx1),int(ty1))
-		# Partie de l'image en haut à gauche de la partie à afficher.
-		xt = self.tuple00[0] * titleDimX
-		yt = self.tuple00[1] * titleDimY
-
-
-		if tx1 == tx2 :
-			# Une seule image à afficher.
-			if ty1 == ty2 :
-				image00 = self.image00.crop((int((x1 - xt)/ self.imscale), int((y1 - yt)/ self.imscale),
-					int((x2 -xt)/ self.imscale),int((y2 -yt)/ self.imscale)))
-				imagetk00 = ImageTk.PhotoImage(image00.resize((int(x2 - x1), int(y2 - y1))))
-				imageid00 = self.canvas.create_image(max(bbox2[0], bbox1[0]), max(bbox2[1], bbox1[1]),
-					anchor='nw', image=imagetk00, tags ='r')
-
-				self.canvas.lower(imageid00)
-				# Référence pour éviter des suppressions inutiles.
-				self.canvas.imagetk00 = imagetk00
-
-			else:
-				# Deux images à afficher : haut-gauche et bas-gauche.
-				if(tx1,ty2) != self.tuple01:
-					self.change_image(0,1,int(tx1),int(ty2))
-
-				image00 = self.image00.crop((int((x1 -xt)/ self.imscale), int((y1 -yt)/ self.imscale),
-					int((x2 -xt)/ self.imscale),int((titleDimY)/ self.imscale)))
-				imagetk00 = ImageTk.PhotoImage(image00.resize((int(x2 - x1), int(titleDimY - y1 + yt))))
-				imageid00 = self.canvas.create_image(max(bbox2[0], bbox1[0]), max(bbox2[1], bbox1[1]),
-					anchor='nw', image=imagetk00, tags ='r')
-				self.canvas.lower(imageid00)
-				# Référence pour éviter des suppressions inutiles.
-				self.canvas.imagetk00 = imagetk00
-
-				# Test pour déterminer si la bordure du bas se trouve sur la limite entre les deux images.
-				if qy2 > 0:
-
-					image01 = self.image01.crop((int((x1 -xt)/ self.imscale),0,
-						int((x2 -xt)/ self.imscale),int(qy2 / self.imscale)))
-					imagetk01 = ImageTk.PhotoImage(image01.resize((int(x2 - x1), int(qy2))))
-					imageid01 = self.canvas.create_image(max(bbox2[0], bbox1[0]),max(bbox2[1], bbox1[1])+int(titleDimY - y1 + yt),
-						anchor='nw', image=imagetk01, tags = 'r')
-					self.canvas.lower(imageid01)
-					# Référence pour éviter des suppressions inutiles.
-					self.canvas.imagetk01 = imagetk01
+		# Zone de l'image complète et zone visible du canvas.
+		bbox1, bbox2 = self.zones_canvas()
 
-		else:
-			if ty1 == ty2:
-				# Deux images à afficher : haut-gauche et haut-droit.
-				if(tx2,ty1) != self.tuple10:
-					self.change_image(1,0,int(tx2),int(ty1))
-
-				image00 = self.image00.crop((int((x1 -xt)/ self.imscale), int((y1 -yt)/ self.imscale),
-					int((titleDimX)/ self.imscale),int((y2 -yt)/ self.imscale)))
-				imagetk00 = ImageTk.PhotoImage(image00.resize((int(titleDimX - x1 + xt), int(y2 - y1))))
-				imageid00 = self.canvas.create_image(max(bbox2[0], bbox1[0]), max(bbox2[1], bbox1[1]),
-					anchor='nw', image=imagetk00, tags ='r')
-				self.canvas.lower(imageid00)
-				self.canvas.imagetk00 = imagetk00
-
-				if qx2 > 0:
-
-					image10 = self.image10.crop((0,int((y1 -yt)/ self.imscale),
-						int(qx2/ self.imscale),int((y2 - yt)/ self.imscale)))
-					imagetk10 = ImageTk.PhotoImage(image10.resize((int(qx2), int(y2-y1))))
-					imageid10 = self.canvas.create_image(max(bbox2[0], bbox1[0])+int(titleDimX - x1 + xt),max(bbox2[1], bbox1[1]),
-						anchor='nw', image=imagetk10, tags = 'r')
-					self.canvas.lower(imageid10)
-					self.canvas.imagetk10 = imagetk10
-
-
-
-			else:
-				# Quatre images à afficher.
-				if(tx2,ty1) != self.tuple10:
-					self.change_image(1,0,int(tx2),int(ty1))
-				if(tx1,ty2) != self.tuple01:
-					self.change_image(0,1,int(tx1),int(ty2))
-				if(tx2,ty2) != self.tuple11:
-					self.change_image(1,1,int(tx2),int(ty2))
-
-				image00 = self.image00.crop((int((x1 -xt)/ self.imscale), int((y1 -yt)/ self.imscale),
-					int((titleDimX)/ self.imscale),int((titleDimY)/ self.imscale)))
-				imagetk00 = ImageTk.PhotoImage(image00.resize((int(titleDimX - x1 + xt), int(titleDimY - y1 + yt))))
-				imageid00 = self.canvas.create_image(max(bbox2[0], bbox1[0]), max(bbox2[1], bbox1[1]),
-					anchor='nw', image=imagetk00, tags ='r')
-				self.canvas.lower(imageid00)
-				self.canvas.imagetk00 = imagetk00
-
-				if qy2 > 0:
-
-					image01 = self.image01.crop((int((x1 -xt)/ self.imscale),0,
-						int((titleDimX)/ self.imscale),int(qy2 / self.imscale)))
-					imagetk01 = ImageTk.PhotoImage(image01.resize((int(titleDimX - x1 + xt), int(qy2))))
-					imageid01 = self.canvas.create_image(max(bbox2[0], bbox1[0]),max(bbox2[1], bbox1[1])+int(titleDimY - y1 + yt),
-						anchor='nw', image=imagetk01, tags = 'r')
-					self.canvas.lower(imageid01)
-					self.canvas.imagetk01 = imagetk01
-
-				if qx2 > 0:
-
-					image10 = self.image10.crop((0,int((y1 -yt)/ self.imscale),
-						int(qx2/ self.imscale),int((titleDimY)/ self.imscale)))
-					imagetk10 = ImageTk.PhotoImage(image10.resize((int(qx2), int(titleDimY - y1 + yt))))
-					imageid10 = self.canvas.create_image(max(bbox2[0], bbox1[0])+int(titleDimX - x1 + xt),max(bbox2[1], bbox1[1]),
-						anchor='nw', image=imagetk10, tags = 'r')
-					self.canvas.lower(imageid10)
-					self.canvas.imagetk10 = imagetk10
-
-				if qx2 > 0 and qy2 > 0:
-
-					image11 = self.image11.crop((0,0,
-						int(qx2/ self.imscale),int(qy2 / self.imscale)))
-					imagetk11 = ImageTk.PhotoImage(image11.resize((int(qx2),int(qy2))))
-
-					imageid11 = self.canvas.create_image(max(bbox2[0], bbox1[0])+int(titleDimX - x1 + xt),max(bbox2[1], bbox1[1])+int(titleDimY - y1 + yt),
-						anchor='nw', image=imagetk11, tags = 'r')
-
-					self.canvas.lower(imageid11)
-					self.canvas.imagetk11 = imagetk11
-
-
-class WaitThread(threading.Thread):
-	'''
-		Apparition d'un message de chargement dans une nouvelle fenêtre.
-	'''
-	def __init__(self):
-		threading.Thread.__init__(self, target = self.Target)
-	def Target(self):
-		# Crée la fenêtre et la place au-dessus de la fenêtre principale
-		self.tp = tk.Toplevel(root)
-		lbl = tk.Label(self.tp, text='Chargement de l\'image à afficher', relief="groove", height=10, width=50)
-		lbl.pack()
-		self.tp.update()
-	def destroy(self):
-		# Détruit la fenêtre du message
-		self.tp.destroy()
-
-if len(sys.argv) != 4:
-	root = tk.Tk()
-	root.geometry('700x700') # Size 700, 700
-	Infos = [1.0, 8192.0, 0,0]
-	app = Zoom_Advanced(root, Infos)
-	root.mainloop()
-else:
-	root = tk.Tk()
-	root.geometry('700x700') # Size 700, 700
-
-	app = Zoom_Advanced(root,Infos)
-	root.mainloop()
+		# Configuration de la zone d'interaction et coordonnées de la partie visible.
+		bbox, zone, (xratio, yratio) = calculer_vue(bbox1, bbox2)
+		self.canvas.configure(scrollregion=bbox)
+
+		# Enregistrement de la session de navigation.
+		if arguments.trace:
+			self.trace.append({'t': time.perf_counter() - self.debut_trace, 'resolution': int(self.resolution),
+				'echelle': self.imscale, 'zone': list(zone)})
+
+		# Position courante, écrite sur le disque en arrière-plan.
+		self.position = [self.imscale, int(self.resolution), xratio, yratio]
+		with self.chrono.mesure('sauvegarde'):
+			self.sauvegarde.mettre_a_jour(self.position)
+
+		# Composition de la partie visible par le moteur de rendu, dans l'image du rendu précédent,
+		# sans attendre les tuiles absentes du cache : elles sont remplacées par la résolution
+		# inférieure jusqu'à leur chargement.
+		with self.chrono.mesure('rendu'):
+			self.cadre = self.moteur.rendre(int(self.resolution), zone, self.imscale, progressif=True,
+				qualite=qualite, cadre=self.cadre)
+		cadre = self.cadre
+		if self.afficher_annotations:
+			# Les annotations sont dessinées dans une copie : le cadre du moteur, décalé lors du
+			# rendu suivant, ne contient que l'image.
+			with self.chrono.mesure('annotations'):
+				cadre = cadre.copy()
+				annotations.dessiner(cadre, zone, (self.width * self.imscale, self.height * self.imscale))
+		if cadre.size[0] > 0 and cadre.size[1] > 0:
+			with self.chrono.mesure('photoimage'):
+				# La PhotoImage n'est recréée que si la taille de la partie visible change.
+				if self.imagetk is None or (self.imagetk.width(), self.imagetk.height()) != cadre.size:
+					self.imagetk = ImageTk.PhotoImage('RGB', cadre.size)
+					if self.image_canvas is not None:
+						self.canvas.itemconfigure(self.image_canvas, image=self.imagetk)
+				self.imagetk.paste(cadre)
+			with self.chrono.mesure('canvas'):
+				x, y = int(bbox1[0] + zone[0]), int(bbox1[1] + zone[1])
+				if self.image_canvas is None:
+					self.image_canvas = self.canvas.create_image(x, y, anchor='nw', image=self.imagetk, tags='r')
+					self.canvas.lower(self.image_canvas)
+				else:
+					self.canvas.coords(self.image_canvas, x, y)
+					self.canvas.itemconfigure(self.image_canvas, state='normal')
+		elif self.image_canvas is not None:
+			self.canvas.itemconfigure(self.image_canvas, state='hidden')
+
+		self.chrono.fin_image()
+		self.afficher_hud()
+
+
+if Infos is None:
+	Infos = [1.0, int(resolution), 0,0]
+root = tk.Tk()
+root.geometry('700x700') # Size 700, 700
+app = Zoom_Advanced(root,Infos)
+root.mainloop()
+
+app.prechargeur.arreter()
+if decodeur is not None:
+	decodeur.fermer()
+app.sauvegarde.vider()
+if annotations is not None and annotations.modifiees:
+	annotations.ecrire(arguments.annotations)
+if arguments.profil:
+	app.chrono.exporter(arguments.profil)
+if arguments.trace:
+	with open(arguments.trace, "w") as fichier:
+		json.dump({'pyramide': repertoire, 'fenetre': list(app.fenetre),
+			'images': app.trace}, fichier)
+# Compteurs du cache, utiles pour en ajuster le budget.
+print(app.cache.statistiques())
+if cache_disque is not None:
+	print(cache_disque.statistiques())
@@ -0,0 +1,163 @@
+'''
+Sauvegarde de la position affichée et signets nommés.
+
+Une position est la liste [échelle, résolution, xratio, yratio] : xratio et yratio, entre 0.0 et 1.0,
+indiquent le coin haut-gauche de la zone affichée dans la zone de défilement. Le fichier
+SauvegardePosition.txt contient une position, une valeur par ligne.
+
+La position courante est écrite par un thread dédié, au plus une fois par délai : l'écriture ne se
+fait jamais pendant le rendu. Chaque fichier est écrit sous un nom temporaire puis renommé, de sorte
+qu'une interruption ne laisse jamais de fichier incomplet. Une écriture qui échoue (disque plein,
+répertoire en lecture seule) est signalée par un avertissement sans arrêter le thread : la position
+suivante sera écrite si le problème a disparu.
+
+'''
+
+import json
+import os
+import threading
+import time
+import warnings
+
+from instrumentation import Chronometre
+
+
+def ecrire_atomique(chemin, contenu):
+	''' Écrit un fichier texte sous un nom temporaire puis le renomme. '''
+	temporaire = chemin + '.tmp'
+	with open(temporaire, 'w') as fichier:
+		fichier.write(contenu)
+		fichier.flush()
+		os.fsync(fichier.fileno())
+	os.replace(temporaire, chemin)
+
+
+def lire_position(chemin):
+	''' Lit une position enregistrée dans un fichier de sauvegarde.
+
+		Returns:
+		 - position : [échelle, résolution, xratio, yratio], la résolution étant un entier.
+	'''
+	with open(chemin, 'r') as fichier:
+		position = [float(ligne) for ligne in fichier.read().split()[:4]]
+	position[1] = int(position[1])
+	return position
+
+
+def ecrire_position(chemin, position):
+	''' Enregistre une position dans un fichier de sauvegarde, une valeur par ligne. '''
+	ecrire_atomique(chemin, "".join(str(valeur) + "\n" for valeur in position))
+
+
+class SauvegardeDifferee:
+	''' Enregistrement de la position courante par un thread dédié.
+		Les mises à jour rapprochées sont regroupées : la position n'est écrite qu'une fois le délai
+		écoulé sans nouvelle mise à jour.
+	'''
+
+	def __init__(self, chemin, delai=0.5, chrono=None):
+		''' Démarre le thread d'enregistrement.
+
+			Args:
+			 - chemin : fichier de sauvegarde ;
+			 - delai : durée sans mise à jour, en secondes, avant l'écriture ;
+			 - chrono : chronomètre mesurant les écritures (voir instrumentation.py), ou None.
+		'''
+		self.chemin = chemin
+		self.delai = delai
+		self.chrono = chrono if chrono is not None else Chronometre()
+		self._position = None
+		self._echeance = None
+		self._arret = False
+		self._condition = threading.Condition()
+		self._thread = threading.Thread(target=self._boucle, name='sauvegarde', daemon=True)
+		self._thread.start()
+
+
+	def mettre_a_jour(self, position):
+		''' Enregistre la nouvelle position courante, sans attendre l'écriture. '''
+		with self._condition:
+			self._position = list(position)
+			self._echeance = time.monotonic() + self.delai
+			self._condition.notify()
+
+
+	def _boucle(self):
+		''' Attend l'échéance de la dernière mise à jour puis écrit la position. '''
+		while True:
+			with self._condition:
+				while not self._arret and (self._echeance is None or self._echeance > time.monotonic()):
+					self._condition.wait(None if self._echeance is None else self._echeance - time.monotonic())
+				if self._arret:
+					return
+				position, self._echeance = self._position, None
+			with self.chrono.mesure('ecriture_position'):
+				self._ecrire(position)
+
+
+	def vider(self):
+		''' Arrête le thread et écrit immédiatement la position en attente. À appeler à la fermeture. '''
+		with self._condition:
+			self._arret = True
+			position = self._position if self._echeance is not None else None
+			self._condition.notify()
+		self._thread.join()
+		if position is not None:
+			self._ecrire(position)
+
+
+	def _ecrire(self, position):
+		''' Écrit une position, en signalant un échec d'écriture par un avertissement. '''
+		try:
+			ecrire_position(self.chemin, position)
+		except OSError as erreur:
+			warnings.warn("Position non enregistrée dans %s : %s" % (self.chemin, erreur))
+
+
+class Signets:
+	''' Ensemble de positions nommées, enregistré dans un fichier JSON. '''
+
+	def __init__(self, chemin):
+		''' Charge les signets existants.
+
+			Args:
+			 - chemin : fichier JSON des signets, créé au premier ajout.
+		'''
+		self.chemin = chemin
+		self._signets = {}
+		if os.path.exists(chemin):
+			with open(chemin, 'r') as fichier:
+				self._signets = json.load(fichier)
+
+
+	def __contains__(self, nom):
+		return nom in self._signets
+
+
+	def noms(self):
+		''' Renvoie la liste triée des noms des signets. '''
+		return sorted(self._signets)
+
+
+	def obtenir(self, nom):
+		''' Renvoie la position d'un signet, ou None s'il n'existe pas. '''
+		position = self._signets.get(nom)
+		if position is None:
+			return None
+		return [position[0], int(position[1]), position[2], position[3]]
+
+
+	def ajouter(self, nom, position):
+		''' Ajoute ou remplace un signet, puis enregistre le fichier. '''
+		self._signets[nom] = [float(position[0]), int(position[1]), float(position[2]), float(position[3])]
+		self._enregistrer()
+
+
+	def retirer(self, nom):
+		''' Supprime un signet, puis enregistre le fichier. '''
+		if self._signets.pop(nom, None) is not None:
+			self._enregistrer()
+
+
+	def _enregistrer(self):
+		ecrire_atomique(self.chemin, json.dumps(self._signets, indent=1, sort_keys=True))
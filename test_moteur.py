@@ -0,0 +1,99 @@
+'''
+Tests du moteur de rendu, sans écran, sur une pyramide synthétique.
+
+Le rendu d'une zone est comparé à la même zone découpée dans l'image source, redimensionnée d'un
+bloc : aucune colonne ni ligne ne doit s'en écarter franchement, en particulier aux jointures des
+tuiles. Lors d'une translation, le rendu incrémental doit être identique à un rendu complet.
+
+Exemple:
+ python -m pytest test_moteur.py
+
+'''
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from cache_tuiles import CacheTuiles
+from moteur import FILTRES, MoteurRendu
+from pyramide import ouvrir_pyramide
+
+# Côté de l'image source et des tuiles de la pyramide synthétique.
+COTE = 1024
+TUILE = 64
+
+# Échelles testées : réductions avec et sans décodage réduit, taille réelle et agrandissement.
+ECHELLES = (0.3, 0.6, 0.77, 1.0, 1.23)
+
+
+def image_source():
+	''' Crée une image lisse, dont le redimensionnement d'un bloc sert de référence. '''
+	y, x = np.mgrid[0:COTE, 0:COTE] / COTE
+	r = 127.5 * (1 + np.sin(2 * np.pi * (3 * x + y)))
+	g = 255 * x * y
+	b = 127.5 * (1 + np.cos(2 * np.pi * (2 * y - x)))
+	return Image.fromarray(np.stack([r, g, b], axis=-1).astype(np.uint8))
+
+
+@pytest.fixture(scope='module')
+def source():
+	return image_source()
+
+
+@pytest.fixture(scope='module')
+def pyramide(source, tmp_path_factory):
+	''' Écrit la pyramide de l'image source, nommée nom_<résolution>_<x>_<y>.png. '''
+	repertoire = tmp_path_factory.mktemp('pyramide')
+	resolution = COTE
+	while resolution >= TUILE:
+		niveau = source.resize((resolution, resolution), Image.Resampling.LANCZOS)
+		for x in range(resolution // TUILE):
+			for y in range(resolution // TUILE):
+				niveau.crop((x * TUILE, y * TUILE, (x + 1) * TUILE, (y + 1) * TUILE)).save(
+					repertoire / ('synthese_%d_%d_%d.png' % (resolution, x, y)))
+		resolution //= 2
+	return ouvrir_pyramide(str(repertoire))
+
+
+def moteur(pyramide, incremental=True):
+	''' Crée un moteur de rendu sans préchargement. '''
+	rendu = MoteurRendu(pyramide, CacheTuiles(64 * 1024 * 1024))
+	rendu.incremental = incremental
+	return rendu
+
+
+def test_echelle_un_decoupe_exacte(pyramide, source):
+	cadre = moteur(pyramide).rendre(COTE, (37.0, 201.0, 737.0, 651.0), 1.0, tableau=True)
+	assert np.array_equal(cadre, np.asarray(source.crop((37, 201, 737, 651))))
+
+
+@pytest.mark.parametrize('echelle', ECHELLES)
+@pytest.mark.parametrize('qualite', sorted(FILTRES))
+def test_rendu_proche_de_la_reference(pyramide, source, echelle, qualite):
+	cote = COTE * echelle
+	zone = (13.0, 29.0, min(613.0, cote), min(529.0, cote))
+	cadre = moteur(pyramide).rendre(COTE, zone, echelle, tableau=True, qualite=qualite).astype(int)
+
+	reference = source.resize((int(cote), int(cote)), FILTRES[qualite])
+	reference = np.asarray(reference.crop((13, 29, int(zone[2]), int(zone[3])))).astype(int)
+	assert cadre.shape == reference.shape
+	ecart = np.abs(cadre - reference).mean(axis=2)
+	# Une jointure noire entre deux tuiles écarte toute une colonne ou une ligne de la référence.
+	assert ecart.mean(axis=0).max() < 4
+	assert ecart.mean(axis=1).max() < 4
+	assert ecart.mean() < 1.5
+
+
+@pytest.mark.parametrize('echelle', ECHELLES)
+def test_translation_identique_au_rendu_complet(pyramide, echelle):
+	incremental, complet = moteur(pyramide), moteur(pyramide, incremental=False)
+	cote = COTE * echelle
+	cadre = None
+	for image in range(60):
+		# Déplacement en diagonale, de vitesse variable et changeant de sens, dans l'image.
+		x = (7.3 * image) % max(cote - 300, 1)
+		y = (3 * image + (image % 5) * 11) % max(cote - 200, 1)
+		zone = (x, y, min(x + 300, cote), min(y + 200, cote))
+		cadre = incremental.rendre(COTE, zone, echelle, cadre=cadre)
+		attendu = complet.rendre(COTE, zone, echelle)
+		assert np.array_equal(np.asarray(cadre), np.asarray(attendu)), "image %d" % image
@@ -0,0 +1,489 @@
+'''
+Transcodage d'une pyramide de tuiles dans un autre format, et comparaison des formats.
+
+Le format des tuiles fixe le coût de leur décodage dans la visionneuse : une grande tuile PNG se
+décode plusieurs fois plus lentement qu'une tuile JPEG, et les pixels bruts d'un conteneur se lisent
+sans aucun décodage. Ce script réécrit une pyramide nom_<résolution>_<x>_<y>.ext dans le format choisi
+et mesure, sur un échantillon de tuiles, ce que chaque format coûte et apporte.
+
+Sous-commandes :
+ - transcoder : réécrit toutes les tuiles d'une pyramide (répertoire, conteneur ou serveur de tuiles)
+   dans un répertoire de destination, au format cible. Les rangées de tuiles sont réparties entre
+   plusieurs processus. Un journal (transcodage.json) associe à chaque tuile écrite une empreinte de
+   la tuile source : une nouvelle exécution ne réécrit que les tuiles modifiées depuis, ajoutées, ou
+   toutes les tuiles si le format cible a changé, et supprime celles qui ont disparu de la source.
+   Les cibles brut et zlib produisent un conteneur (voir conteneur.py) : les processus encodent
+   les tuiles modifiées, et le conteneur est réassemblé en recopiant telles quelles les tuiles
+   inchangées de l'ancien conteneur ;
+ - mesurer : pour chaque format cible, encode un échantillon de tuiles tirées au hasard dans toutes
+   les résolutions et mesure le temps de décodage par le chemin de lecture de la visionneuse (depuis
+   la mémoire, sans lecture du disque), le nombre d'octets et l'écart aux pixels de la pyramide
+   source (PSNR et écart maximal). La première ligne décrit les tuiles source, lues sur le disque.
+
+Cibles, de la forme format[:niveau] :
+ - jpg:<qualité> et webp:<qualité>, qualité de 1 à 100 (90 par défaut) ; webp:sans-perte ;
+ - png:<niveau de compression>, de 0 (aucune) à 9 (6 par défaut) ;
+ - brut : conteneur de pixels non compressés ;
+ - zlib:<niveau> : conteneur de pixels compressés par zlib, de 1 à 9 (1 par défaut).
+
+Exemple:
+ python transcodage.py mesurer nomdudossiercontenantlesimages/ jpg:90 jpg:75 webp:80 png:1 png:9 brut --echantillon 64
+ python transcodage.py transcoder nomdudossiercontenantlesimages/ pyramide_jpg/ jpg:85 --processus 8
+
+'''
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import random
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from cache_disque import vers_tableau
+from conteneur import EcritureConteneur, PyramideConteneur, description_tableau
+from pyramide import IndexPyramide, decoder_reduit, ecrire_manifeste, ouvrir_pyramide
+
+# Formats cibles et niveau par défaut (qualité ou niveau de compression).
+CIBLES = {'jpg': 90, 'webp': 90, 'png': 6, 'brut': None, 'zlib': 1}
+
+# Cibles écrites dans un conteneur à fichier unique plutôt que dans un répertoire.
+CIBLES_CONTENEUR = ('brut', 'zlib')
+
+# Journal des tuiles transcodées, dans le répertoire de destination.
+JOURNAL = 'transcodage.json'
+
+# Pyramides ouvertes par chaque processus, une seule fois.
+_pyramides = {}
+
+
+def lire_cible(texte):
+	''' Analyse une cible de la forme format[:niveau].
+
+		Returns:
+		 - (format, niveau) : niveau entier, None pour brut ou 'sans-perte' pour webp.
+	'''
+	format, _, niveau = texte.lower().partition(':')
+	if format == 'jpeg':
+		format = 'jpg'
+	if format not in CIBLES:
+		raise ValueError("Format cible inconnu : %s (formats : %s)" % (format, ", ".join(CIBLES)))
+	if not niveau:
+		return format, CIBLES[format]
+	if format == 'webp' and niveau == 'sans-perte':
+		return format, niveau
+	if format == 'brut':
+		raise ValueError("La cible brut n'a pas de niveau : %s" % texte)
+	try:
+		niveau = int(niveau)
+	except ValueError:
+		raise ValueError("Niveau invalide : %s" % texte) from None
+	bornes = {'jpg': (1, 100), 'webp': (1, 100), 'png': (0, 9), 'zlib': (1, 9)}[format]
+	if not bornes[0] <= niveau <= bornes[1]:
+		raise ValueError("Niveau hors de [%d, %d] : %s" % (bornes + (texte,)))
+	return format, niveau
+
+
+def nom_cible(cible):
+	''' Renvoie la forme textuelle d'une cible, telle qu'enregistrée dans le journal. '''
+	format, niveau = cible
+	return format if niveau is None else "%s:%s" % (format, niveau)
+
+
+def encoder(tableau, cible):
+	''' Encode les pixels d'une tuile dans le format cible.
+
+		Args:
+		 - tableau : pixels de la tuile (voir cache_disque.vers_tableau) ;
+		 - cible : (format, niveau), voir lire_cible().
+
+		Returns:
+		 - donnees : octets de la tuile encodée ; pixels bruts, éventuellement compressés par zlib,
+		   pour les cibles des conteneurs.
+	'''
+	format, niveau = cible
+	if format in CIBLES_CONTENEUR:
+		donnees = np.ascontiguousarray(tableau, dtype=np.uint8).tobytes()
+		return donnees if format == 'brut' else zlib.compress(donnees, niveau)
+	image = Image.fromarray(tableau)
+	flux = io.BytesIO()
+	if format == 'jpg':
+		if image.mode not in ('L', 'RGB'):
+			image = image.convert('RGB')
+		image.save(flux, format='JPEG', quality=niveau)
+	elif format == 'webp':
+		options = {'lossless': True} if niveau == 'sans-perte' else {'quality': niveau}
+		image.save(flux, format='WEBP', **options)
+	else:
+		image.save(flux, format='PNG', compress_level=niveau)
+	return flux.getvalue()
+
+
+def decoder(donnees, cible, forme):
+	''' Décode une tuile encodée par encoder(), comme la visionneuse la lit.
+
+		Args:
+		 - donnees : octets de la tuile ;
+		 - cible : format de la tuile ;
+		 - forme : forme du tableau de pixels, pour les cibles des conteneurs.
+
+		Returns:
+		 - tableau : pixels de la tuile ; vue sans copie des octets pour la cible brut.
+	'''
+	format = cible[0]
+	if format == 'zlib':
+		donnees = zlib.decompress(donnees)
+	if format in CIBLES_CONTENEUR:
+		return np.frombuffer(donnees, dtype=np.uint8).reshape(forme)
+	return vers_tableau(decoder_reduit(Image.open(io.BytesIO(donnees))))
+
+
+def nom_destination(nom, cible):
+	''' Renvoie le nom d'une tuile transcodée : celui de la tuile source, avec l'extension du format
+		cible. Les tuiles d'un conteneur gardent le nom de la tuile source.
+	'''
+	if cible[0] in CIBLES_CONTENEUR:
+		return nom
+	return os.path.splitext(nom)[0] + '.' + cible[0]
+
+
+def empreinte(pyramide, resolution, x, y, par_date):
+	''' Identifie le contenu d'une tuile source.
+
+		Args:
+		 - par_date : la source est un répertoire ; l'empreinte est alors la date de modification et
+		   la taille du fichier, sans le lire. Sinon, l'empreinte est le condensé SHA-1 de la tuile.
+	'''
+	if par_date:
+		return list(pyramide.signature_tuile(resolution, x, y)[1:])
+	return hashlib.sha1(pyramide.octets_tuile(resolution, x, y)[0]).hexdigest()
+
+
+def _ouvrir(chemin):
+	''' Ouvre une pyramide une seule fois par processus. '''
+	if chemin not in _pyramides:
+		_pyramides[chemin] = ouvrir_pyramide(chemin)
+	return _pyramides[chemin]
+
+
+def transcoder_rangee(parametres, resolution, y, tuiles, anciennes):
+	''' Transcode une rangée de tuiles, sauf celles dont la source n'a pas changé.
+		Exécutée dans un processus de travail. Pour les cibles des conteneurs, les tuiles encodées
+		sont renvoyées au processus principal, qui écrit le conteneur.
+
+		Args:
+		 - parametres : dictionnaire décrivant le transcodage (voir transcoder) ;
+		 - resolution, y : résolution et indice de la rangée ;
+		 - tuiles : liste (x, nom de la tuile source) des tuiles de la rangée ;
+		 - anciennes : empreintes enregistrées dans le journal pour ces tuiles, par nom de destination.
+
+		Returns:
+		 - (empreintes, ecrites, encodees) : empreinte de chaque tuile de la rangée, par nom de
+		   destination, nombre de tuiles écrites ou encodées, et liste (entrée de l'index, octets) des
+		   tuiles encodées pour un conteneur (voir conteneur.EcritureConteneur).
+	'''
+	pyramide = _ouvrir(parametres['source'])
+	cible = parametres['cible']
+	empreintes = {}
+	ecrites = 0
+	encodees = []
+	for x, nom in tuiles:
+		nom = nom_destination(nom, cible)
+		signe = empreinte(pyramide, resolution, x, y, parametres['par_date'])
+		empreintes[nom] = signe
+		if parametres['destination'] is None:
+			# Tuile inchangée : recopiée depuis l'ancien conteneur par le processus principal.
+			if anciennes.get(nom) == signe:
+				continue
+			tableau = vers_tableau(pyramide.ouvrir_tuile(resolution, x, y))
+			entree = {'nom': nom, 'resolution': resolution, 'x': x, 'y': y, 'codage': cible[0]}
+			entree.update(description_tableau(tableau))
+			encodees.append((entree, encoder(tableau, cible)))
+			ecrites += 1
+			continue
+		chemin = os.path.join(parametres['destination'], nom)
+		if anciennes.get(nom) == signe and os.path.exists(chemin):
+			continue
+		donnees = encoder(vers_tableau(pyramide.ouvrir_tuile(resolution, x, y)), cible)
+		# Écriture sous un nom temporaire puis renommage, comme construction_pyramide.py.
+		temporaire = chemin + '.partiel'
+		with open(temporaire, 'wb') as fichier:
+			fichier.write(donnees)
+		os.replace(temporaire, chemin)
+		ecrites += 1
+	return empreintes, ecrites, encodees
+
+
+def lire_journal(chemin):
+	''' Lit un journal de transcodage, ou renvoie un journal vide s'il est absent ou illisible. '''
+	try:
+		with open(chemin) as fichier:
+			journal = json.load(fichier)
+		return {'cible': journal['cible'], 'tuiles': dict(journal['tuiles'])}
+	except (OSError, ValueError, KeyError, TypeError):
+		return {'cible': None, 'tuiles': {}}
+
+
+def ecrire_journal(chemin, journal):
+	''' Écrit un journal de transcodage sous un nom temporaire puis renommé. '''
+	temporaire = chemin + '.tmp'
+	with open(temporaire, 'w') as fichier:
+		json.dump(journal, fichier)
+	os.replace(temporaire, chemin)
+
+
+def transcoder(source, destination, cible, processus=None):
+	''' Transcode une pyramide dans un autre format, en ne réécrivant que les tuiles modifiées.
+
+		Args:
+		 - source : répertoire de tuiles, conteneur ou adresse d'un serveur de tuiles ;
+		 - destination : répertoire des tuiles transcodées, ou fichier conteneur pour les cibles brut
+		   et zlib ;
+		 - cible : texte format[:niveau] (voir lire_cible) ;
+		 - processus : nombre de processus, par défaut le nombre de cœurs.
+
+		Returns:
+		 - bilan : dictionnaire du nombre de tuiles écrites, conservées et supprimées.
+	'''
+	cible = lire_cible(cible)
+	if os.path.abspath(source.rstrip('/')) == os.path.abspath(destination.rstrip('/')):
+		raise ValueError("La destination doit être distincte de la source : %s" % destination)
+	pyramide = ouvrir_pyramide(source)
+	conteneur = cible[0] in CIBLES_CONTENEUR
+	if conteneur:
+		chemin_journal = destination + '.' + JOURNAL
+	else:
+		os.makedirs(destination, exist_ok=True)
+		chemin_journal = os.path.join(destination, JOURNAL)
+	journal = lire_journal(chemin_journal)
+	# Un changement de format cible invalide toutes les tuiles déjà écrites.
+	anciennes = journal['tuiles'] if journal['cible'] == nom_cible(cible) else {}
+	# Conteneur existant, dont les tuiles inchangées sont recopiées sans être encodées de nouveau.
+	ancien = None
+	if conteneur and anciennes:
+		try:
+			ancien = PyramideConteneur(destination)
+		except (OSError, ValueError):
+			anciennes = {}
+
+	parametres = {'source': source, 'destination': None if conteneur else destination, 'cible': cible,
+				  'par_date': os.path.isdir(source)}
+	# Tuiles regroupées par rangée ; chaque processus ne reçoit que les entrées du journal de sa rangée.
+	rangees = {}
+	for resolution in pyramide.index.niveaux():
+		for (x, y), nom in sorted(pyramide.index.tuiles(resolution).items()):
+			rangees.setdefault((resolution, y), []).append((x, nom))
+	cles = sorted(rangees)
+	precedentes = []
+	for resolution, y in cles:
+		precedentes.append({})
+		for x, nom in rangees[(resolution, y)]:
+			nom = nom_destination(nom, cible)
+			# Une tuile n'est conservée dans un conteneur que si l'ancien conteneur la contient.
+			if nom in anciennes and (ancien is None or ancien.entree_tuile(resolution, x, y) is not None):
+				precedentes[-1][nom] = anciennes[nom]
+	empreintes = {}
+	ecrites = 0
+	supprimees = 0
+	# Le conteneur n'est réécrit qu'à la première tuile encodée, ou à la fin si des tuiles ont disparu
+	# de la source ; les tuiles inchangées rencontrées avant sont recopiées à ce moment.
+	ecriture = None
+	recopiees = []
+	try:
+		with ProcessPoolExecutor(max_workers=processus) as executeur:
+			for (resolution, y), (rangee, nombre, encodees) in zip(cles, executeur.map(transcoder_rangee,
+					[parametres] * len(cles), [resolution for resolution, _ in cles], [y for _, y in cles],
+					[rangees[cle] for cle in cles], precedentes, chunksize=4)):
+				empreintes.update(rangee)
+				ecrites += nombre
+				if not conteneur:
+					continue
+				noms = {entree['nom'] for entree, _ in encodees}
+				recopiees.extend((resolution, x, y) for x, nom in rangees[(resolution, y)] if nom not in noms)
+				if encodees and ecriture is None:
+					ecriture = EcritureConteneur(destination)
+				if ecriture is not None:
+					for tuile in recopiees:
+						ecriture.recopier(ancien, *tuile)
+					recopiees = []
+					for entree, donnees in encodees:
+						ecriture.ajouter(entree, donnees)
+		if conteneur and ecriture is None and (empreintes != anciennes or not os.path.exists(destination)):
+			ecriture = EcritureConteneur(destination)
+			for tuile in recopiees:
+				ecriture.recopier(ancien, *tuile)
+		if ancien is not None:
+			ancien.fermer()
+			ancien = None
+		if ecriture is not None:
+			supprimees = len(set(anciennes) - set(empreintes))
+			ecriture.terminer()
+			ecriture = None
+	finally:
+		if ecriture is not None:
+			ecriture.abandonner()
+		if ancien is not None:
+			ancien.fermer()
+
+	if not conteneur:
+		# Tuiles disparues de la source, ou écrites dans un autre format.
+		for nom in set(journal['tuiles']) - set(empreintes):
+			chemin = os.path.join(destination, nom)
+			if os.path.exists(chemin):
+				os.remove(chemin)
+				supprimees += 1
+	ecrire_journal(chemin_journal, {'cible': nom_cible(cible), 'tuiles': empreintes})
+
+	if not conteneur:
+		# Manifeste écrit en dernier : il doit être plus récent que le répertoire.
+		ecrire_manifeste(destination, IndexPyramide(os.listdir(destination), pyramide.index.etendues()),
+			{resolution: pyramide.taille_tuile(resolution) for resolution in pyramide.index.niveaux()})
+	return {'ecrites': ecrites, 'conservees': len(empreintes) - ecrites, 'supprimees': supprimees}
+
+
+def echantillon_tuiles(pyramide, nombre, graine=0):
+	''' Tire au hasard des tuiles dans toutes les résolutions d'une pyramide.
+
+		Returns:
+		 - cles : liste de (résolution, x, y).
+	'''
+	cles = [(resolution, x, y) for resolution in pyramide.index.niveaux()
+			for x, y in sorted(pyramide.index.tuiles(resolution))]
+	return random.Random(graine).sample(cles, min(nombre, len(cles)))
+
+
+def _ecart(reference, tableau):
+	''' Renvoie la somme des carrés des écarts, l'écart maximal et le nombre de valeurs comparées,
+		sur les canaux communs aux deux tuiles (une tuile JPEG perd le canal alpha).
+	'''
+	if reference.ndim == 3 and tableau.ndim == 3:
+		canaux = min(reference.shape[2], tableau.shape[2])
+		reference, tableau = reference[..., :canaux], tableau[..., :canaux]
+	difference = reference.astype(np.int32) - tableau.astype(np.int32)
+	return float(np.square(difference, dtype=np.int64).sum()), int(np.abs(difference).max()), difference.size
+
+
+def _resume(nom, octets, durees, pixels, ecarts, octets_source):
+	''' Résume les mesures d'un format. '''
+	carres = sum(ecart[0] for ecart in ecarts)
+	valeurs = sum(ecart[2] for ecart in ecarts)
+	maximum = max((ecart[1] for ecart in ecarts), default=0)
+	mse = carres / valeurs if valeurs else 0.0
+	return {'format': nom, 'octets': octets, 'taux': octets / octets_source if octets_source else None,
+			'decodage_ms': 1000 * float(np.mean(durees)), 'decodage_p95_ms': 1000 * float(np.percentile(durees, 95)),
+			'mpix_s': pixels / sum(durees) / 1e6 if sum(durees) else None,
+			'psnr': None if mse == 0 else 10 * float(np.log10(255 ** 2 / mse)), 'ecart_max': maximum}
+
+
+def mesurer(source, cibles, echantillon=48, repetitions=3, graine=0):
+	''' Mesure, pour chaque format cible, le coût de décodage, la taille et l'erreur visuelle sur un
+		échantillon de tuiles de la pyramide.
+
+		Le temps de décodage d'une tuile est le plus court de plusieurs décodages depuis la mémoire :
+		il ne dépend pas de l'état du cache du système de fichiers. L'erreur est mesurée par rapport
+		aux pixels des tuiles source, elles-mêmes éventuellement compressées avec perte.
+
+		Args:
+		 - source : répertoire de tuiles, conteneur ou adresse d'un serveur de tuiles ;
+		 - cibles : textes format[:niveau] (voir lire_cible) ;
+		 - echantillon : nombre de tuiles mesurées ;
+		 - repetitions : nombre de décodages de chaque tuile ;
+		 - graine : graine du tirage des tuiles.
+
+		Returns:
+		 - mesures : liste de dictionnaires, un par format, le premier décrivant les tuiles source.
+	'''
+	cibles = [lire_cible(cible) for cible in cibles]
+	pyramide = ouvrir_pyramide(source)
+	cles = echantillon_tuiles(pyramide, echantillon, graine)
+
+	# Tuiles source, lues par la pyramide comme par la visionneuse.
+	references = {}
+	durees = []
+	octets_source = 0
+	for cle in cles:
+		octets_source += len(pyramide.octets_tuile(*cle)[0])
+		meilleure = None
+		for _ in range(repetitions):
+			debut = time.perf_counter()
+			tableau = vers_tableau(pyramide.ouvrir_tuile(*cle))
+			duree = time.perf_counter() - debut
+			meilleure = duree if meilleure is None else min(meilleure, duree)
+		references[cle] = np.array(tableau)
+		durees.append(meilleure)
+	pixels = sum(reference.shape[0] * reference.shape[1] for reference in references.values())
+	mesures = [_resume('source', octets_source, durees, pixels, [], octets_source)]
+
+	for cible in cibles:
+		octets = 0
+		durees = []
+		ecarts = []
+		for cle in cles:
+			reference = references[cle]
+			donnees = encoder(reference, cible)
+			octets += len(donnees)
+			meilleure = None
+			for _ in range(repetitions):
+				debut = time.perf_counter()
+				tableau = decoder(donnees, cible, reference.shape)
+				duree = time.perf_counter() - debut
+				meilleure = duree if meilleure is None else min(meilleure, duree)
+			durees.append(meilleure)
+			ecarts.append(_ecart(reference, tableau))
+		mesures.append(_resume(nom_cible(cible), octets, durees, pixels, ecarts, octets_source))
+	return mesures
+
+
+def main(args=None):
+	parser = argparse.ArgumentParser(description="Transcodage d'une pyramide de tuiles et comparaison des formats.")
+	commandes = parser.add_subparsers(dest='commande', required=True)
+
+	transcodage = commandes.add_parser('transcoder', help="Transcode une pyramide dans un autre format.")
+	transcodage.add_argument('source', help="Répertoire des tuiles, conteneur ou adresse d'un serveur de tuiles.")
+	transcodage.add_argument('destination', help="Répertoire des tuiles transcodées (fichier conteneur pour brut et zlib).")
+	transcodage.add_argument('cible', help="Format cible : jpg:90, webp:80, webp:sans-perte, png:1, brut, zlib:1...")
+	transcodage.add_argument('--processus', type=int, default=None, help="Nombre de processus (nombre de cœurs par défaut).")
+
+	mesure = commandes.add_parser('mesurer', help="Compare des formats sur un échantillon de tuiles.")
+	mesure.add_argument('source', help="Répertoire des tuiles, conteneur ou adresse d'un serveur de tuiles.")
+	mesure.add_argument('cibles', nargs='+', help="Formats à comparer (voir transcoder).")
+	mesure.add_argument('--echantillon', type=int, default=48, help="Nombre de tuiles mesurées (48 par défaut).")
+	mesure.add_argument('--repetitions', type=int, default=3, help="Nombre de décodages de chaque tuile (3 par défaut).")
+	mesure.add_argument('--graine', type=int, default=0, help="Graine du tirage des tuiles.")
+	mesure.add_argument('--rapport', help="Fichier JSON où écrire les mesures.")
+
+	arguments = parser.parse_args(args)
+	try:
+		if arguments.commande == 'transcoder':
+			debut = time.perf_counter()
+			bilan = transcoder(arguments.source, arguments.destination, arguments.cible, arguments.processus)
+			print("%d tuiles écrites, %d conservées, %d supprimées en %.1f s" % (bilan['ecrites'], bilan['conservees'],
+				bilan['supprimees'], time.perf_counter() - debut))
+
+		elif arguments.commande == 'mesurer':
+			mesures = mesurer(arguments.source, arguments.cibles, arguments.echantillon, arguments.repetitions,
+				arguments.graine)
+			print("%-16s %12s %7s %10s %10s %8s %8s %6s" % ('format', 'octets', 'taux', 'decod. ms', 'p95 ms',
+				'Mpix/s', 'PSNR', 'max'))
+			for ligne in mesures:
+				print("%-16s %12d %7s %10.2f %10.2f %8s %8s %6d" % (ligne['format'], ligne['octets'],
+					'%.3f' % ligne['taux'] if ligne['taux'] is not None else '-', ligne['decodage_ms'],
+					ligne['decodage_p95_ms'], '%.0f' % ligne['mpix_s'] if ligne['mpix_s'] else '-',
+					'%.2f' % ligne['psnr'] if ligne['psnr'] is not None else 'exact', ligne['ecart_max']))
+			if arguments.rapport:
+				with open(arguments.rapport, 'w') as fichier:
+					json.dump({'source': arguments.source, 'echantillon': arguments.echantillon, 'mesures': mesures},
+						fichier, indent=1)
+	except ValueError as erreur:
+		parser.error(str(erreur))
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())